@@ -0,0 +1,268 @@
+"""
+Generate reports for a cohort of users in parallel.
+
+    python batch_reports.py profiles.jsonl --model azure/o1 --model gemini/gemini-2.0-flash \\
+        --workers 16 --provider-limit azure=6 --provider-limit gemini=12
+
+Each input row is one user. JSONL rows are ReportRequest objects (metadata,
+biomarkers, onboarding_conversation, category_scores, recommendations,
+user_history) plus an optional "id". CSV rows have "biomarkers" (or
+"biomarkers_file"), optional "id", "onboarding_conversation",
+"category_scores", "recommendations" and "health_goals" (";"-separated)
+columns; every other column is onboarding metadata.
+
+The prompt is built exactly as in the Generate flow and each report runs
+through call_llm_with_fallback, which saves it (see llm_utils.save_response).
+Every finished row is appended to a checkpoint file, so rerunning the same
+command skips the rows that already succeeded and retries the failed ones.
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from biomarkers import parse_biomarkers
+from llm_cache import cache_bypass
+from llm_events import LLM_REQUEST, capture_events
+from llm_utils import MODEL_CONFIGS, call_llm_with_fallback
+from models import HealthVizorResponse
+from rate_limiter import expected_output_scope
+from report_jobs import summarize_llm_events
+from report_service import DEFAULT_MODEL, ReportRequest, build_report_messages, build_user_context, report_job_key
+from token_budget import predict_output_tokens
+
+logger = logging.getLogger(__name__)
+
+BATCH_WORKERS = int(os.getenv("BATCH_REPORT_WORKERS", "8"))
+
+# CSV columns that are not onboarding metadata
+CSV_REQUEST_COLUMNS = ("id", "biomarkers", "biomarkers_file", "onboarding_conversation", "category_scores", "recommendations")
+
+def _csv_request(row: Dict[str, str], base_dir: str) -> Tuple[Optional[str], ReportRequest]:
+    biomarkers = row.get("biomarkers") or ""
+    if row.get("biomarkers_file"):
+        with open(os.path.join(base_dir, row["biomarkers_file"]), 'r', encoding='utf-8') as f:
+            biomarkers = f.read()
+    metadata = {key: value for key, value in row.items() if key not in CSV_REQUEST_COLUMNS and value not in (None, "")}
+    if "health_goals" in metadata:
+        metadata["health_goals"] = [goal.strip() for goal in metadata["health_goals"].split(";") if goal.strip()]
+    return row.get("id") or None, ReportRequest(
+        metadata=metadata,
+        biomarkers=biomarkers,
+        onboarding_conversation=row.get("onboarding_conversation") or "",
+        category_scores=row.get("category_scores") or "",
+        recommendations=row.get("recommendations") or "",
+    )
+
+def read_profiles(path: str) -> Iterator[Tuple[str, ReportRequest]]:
+    """
+    Yield (profile id, request) for every row of a JSONL or CSV profile file.
+
+    Rows without an "id" are keyed by their report inputs, so the id is
+    stable across runs and resuming works without one.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.lower().endswith(".csv"):
+            rows = (_csv_request(row, base_dir) for row in csv.DictReader(f))
+        else:
+            rows = ((data.pop("id", None), ReportRequest.model_validate(data))
+                    for data in (json.loads(line) for line in f if line.strip()))
+        for profile_id, request in rows:
+            yield str(profile_id) if profile_id is not None else report_job_key(request)[:16], request
+
+def load_checkpoint(path: str) -> Dict[str, Dict[str, Any]]:
+    """Latest checkpoint record per profile id (the file is append-only, so later lines win)."""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from an interrupted run
+            records[record["id"]] = record
+    return records
+
+class ProviderSlots:
+    """
+    Per-provider caps on reports in flight.
+
+    A report takes a slot on the provider of the model it is assigned; when
+    that provider is full it goes to the next model whose provider has a
+    free slot, and only waits when every provider is at its cap. Providers
+    without a limit are capped by the worker count alone.
+    """
+
+    def __init__(self, models: List[str], limits: Dict[str, int]):
+        self.models = models
+        self._semaphores = {provider: threading.BoundedSemaphore(limit) for provider, limit in limits.items()}
+
+    def _semaphore(self, model: str) -> Optional[threading.BoundedSemaphore]:
+        return self._semaphores.get(MODEL_CONFIGS.get(model, {}).get("provider"))
+
+    def acquire(self, preferred: int) -> str:
+        """Take a slot, preferring models[preferred]; returns the model to use."""
+        ordered = self.models[preferred:] + self.models[:preferred]
+        for model in ordered:
+            semaphore = self._semaphore(model)
+            if semaphore is None or semaphore.acquire(blocking=False):
+                return model
+        semaphore = self._semaphore(ordered[0])
+        semaphore.acquire()
+        return ordered[0]
+
+    def release(self, model: str) -> None:
+        semaphore = self._semaphore(model)
+        if semaphore is not None:
+            semaphore.release()
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+class BatchRunner:
+    """Runs report requests over a bounded thread pool, checkpointing each result."""
+
+    def __init__(self, models: List[str], workers: int = BATCH_WORKERS, provider_limits: Optional[Dict[str, int]] = None,
+                 checkpoint_path: str = "batch_checkpoint.jsonl", bypass_cache: bool = False):
+        self.models = models
+        self.workers = workers
+        self.slots = ProviderSlots(models, provider_limits or {})
+        self.checkpoint_path = checkpoint_path
+        self.bypass_cache = bypass_cache
+        self._checkpoint_lock = threading.Lock()
+
+    def _write_checkpoint(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._checkpoint_lock:
+            with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def run_one(self, index: int, profile_id: str, request: ReportRequest) -> Dict[str, Any]:
+        """Generate one report and checkpoint the outcome; never raises."""
+        model = self.slots.acquire(index % len(self.models))
+        started = time.perf_counter()
+        record = {"id": profile_id, "user_name": request.metadata.get("name", "User"), "model": model}
+        try:
+            messages = build_report_messages(request)
+            biomarker_table = parse_biomarkers(request.biomarkers_text())
+            user_context = {**build_user_context(request.metadata, request.user_history), "biomarker_table": biomarker_table}
+            expected_output = predict_output_tokens(len(biomarker_table), len(biomarker_table.all_categories()))
+            with capture_events() as llm_events, cache_bypass(self.bypass_cache), expected_output_scope(expected_output):
+                call_llm_with_fallback(model, messages, HealthVizorResponse, user_context)
+            usage = summarize_llm_events(llm_events, model)
+            models_used = [event.get("model_used") for event in llm_events if event.kind == LLM_REQUEST]
+            record.update(status="ok", model_used=models_used[-1] if models_used else model,
+                          fallback_models=usage["fallback_models"], tokens=usage["total_tokens"], cost=usage["cost"])
+        except Exception as e:
+            logger.warning("❌ Report for %s failed: %s", profile_id, e)
+            record.update(status="failed", error=f"{type(e).__name__}: {e}")
+        finally:
+            self.slots.release(model)
+        record["seconds"] = round(time.perf_counter() - started, 3)
+        record["finished_at"] = datetime.now().isoformat()
+        self._write_checkpoint(record)
+        return record
+
+    def run(self, profiles: List[Tuple[str, ReportRequest]], progress: bool = True) -> Dict[str, Any]:
+        """Run every profile and return the throughput summary."""
+        started = time.perf_counter()
+        records = []
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch-report")
+        try:
+            futures = [executor.submit(self.run_one, index, profile_id, request)
+                       for index, (profile_id, request) in enumerate(profiles)]
+            for future in as_completed(futures):
+                record = future.result()
+                records.append(record)
+                if progress:
+                    print(f"[{len(records)}/{len(profiles)}] {record['id']}: {record['status']} "
+                          f"({record.get('model_used') or record['model']}, {record['seconds']:.1f}s)", flush=True)
+        except KeyboardInterrupt:
+            print("Interrupted: waiting for reports in flight (finished ones are checkpointed)", flush=True)
+            executor.shutdown(wait=True, cancel_futures=True)
+        finally:
+            executor.shutdown(wait=True)
+        return summarize_batch(records, time.perf_counter() - started)
+
+def summarize_batch(records: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """Throughput, latency percentiles, per-model counts and token / cost totals for a run."""
+    succeeded = [record for record in records if record["status"] == "ok"]
+    latencies = [record["seconds"] for record in succeeded]
+    by_model = {}
+    for record in succeeded:
+        by_model[record["model_used"]] = by_model.get(record["model_used"], 0) + 1
+    return {
+        "reports": len(records),
+        "succeeded": len(succeeded),
+        "failed": len(records) - len(succeeded),
+        "wall_seconds": round(wall_seconds, 1),
+        "reports_per_minute": round(len(succeeded) / wall_seconds * 60, 2) if wall_seconds > 0 else None,
+        "latency_p50_seconds": _percentile(latencies, 0.5),
+        "latency_p95_seconds": _percentile(latencies, 0.95),
+        "models_used": by_model,
+        "fallbacks": sum(1 for record in succeeded if record.get("fallback_models")),
+        "total_tokens": sum(record.get("tokens") or 0 for record in succeeded),
+        "cost": round(sum(record.get("cost") or 0 for record in succeeded), 4),
+    }
+
+def _provider_limit(value: str) -> Tuple[str, int]:
+    provider, _, limit = value.partition("=")
+    if not provider or not limit.isdigit() or int(limit) < 1:
+        raise argparse.ArgumentTypeError(f"expected PROVIDER=N, got {value!r}")
+    return provider, int(limit)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate reports for many users in parallel.")
+    parser.add_argument("profiles", help="JSONL or CSV file with one user per row")
+    parser.add_argument("--model", action="append", dest="models",
+                        help=f"model to use (repeat to spread reports across models; default {DEFAULT_MODEL})")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="reports generated concurrently")
+    parser.add_argument("--provider-limit", action="append", type=_provider_limit, default=[], metavar="PROVIDER=N",
+                        help="max reports in flight on a provider (azure, openai, gemini)")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <profiles>.checkpoint.jsonl)")
+    parser.add_argument("--limit", type=int, help="only run the first N pending profiles")
+    parser.add_argument("--bypass-cache", action="store_true", help="ignore cached responses (e.g. after a prompt revision)")
+    parser.add_argument("--summary", help="also write the throughput summary to this JSON file")
+    parser.add_argument("--quiet", action="store_true", help="no per-report progress lines")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    models = args.models or [DEFAULT_MODEL]
+    unknown = [model for model in models if model not in MODEL_CONFIGS]
+    if unknown:
+        print(f"Unknown model(s): {', '.join(unknown)} (configured: {', '.join(MODEL_CONFIGS)})")
+        return 2
+
+    checkpoint_path = args.checkpoint or os.path.splitext(args.profiles)[0] + ".checkpoint.jsonl"
+    done = {profile_id for profile_id, record in load_checkpoint(checkpoint_path).items() if record.get("status") == "ok"}
+    pending = ((profile_id, request) for profile_id, request in read_profiles(args.profiles) if profile_id not in done)
+    profiles = list(itertools.islice(pending, args.limit) if args.limit else pending)
+    print(f"{len(profiles)} profiles to run ({len(done)} already done per {checkpoint_path})", flush=True)
+    if not profiles:
+        return 0
+
+    runner = BatchRunner(models, args.workers, dict(args.provider_limit), checkpoint_path, args.bypass_cache)
+    summary = runner.run(profiles, progress=not args.quiet)
+    print(json.dumps(summary, indent=2))
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    return 0 if summary["failed"] == 0 and summary["reports"] == len(profiles) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
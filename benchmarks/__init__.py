@@ -0,0 +1 @@
+"""Benchmarks for HealthVizor. Run each module with `python -m benchmarks.<name>` from the repository root."""
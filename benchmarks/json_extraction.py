@@ -0,0 +1,269 @@
+"""
+Benchmark the JSON extraction and repair pipeline on saved LLM results.
+
+The reports saved in llm_results/ and llm_results/old/ are used as a seed
+corpus. Each is re-serialized and mutated into the failure shapes seen from
+real providers (markdown fences, stray prose, trailing commas, truncation at
+a random offset, an unbalanced document inside a closed fence), then fed to
+every extraction strategy. One extra
+"truncated_large" case grows a report to several MB of biomarker insights
+and cuts it off near the end, so parse time that grows faster than the input
+shows up as a throughput regression. For each strategy and mutation the
+benchmark reports throughput, p50/p99 latency and how much of the original
+report was recovered.
+
+    python -m benchmarks.json_extraction
+    python -m benchmarks.json_extraction --variants 5 --seed 7 --output bench.json
+
+Exits with status 1 if any result falls below the limits in
+benchmarks/json_extraction_thresholds.json.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import llm_utils
+from json_repair import repair_json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS_GLOBS = [
+    os.path.join(REPO_ROOT, "llm_results", "*.json"),
+    os.path.join(REPO_ROOT, "llm_results", "old", "*.json"),
+]
+# Size of the truncated_large case
+LARGE_CASE_BYTES = 3 * 1024 * 1024
+DEFAULT_THRESHOLDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "json_extraction_thresholds.json")
+
+# Strategies under test; each takes the raw response text and returns a dict or raises
+STRATEGIES: Dict[str, Callable[[str], Any]] = {
+    "clean_json_content": lambda content: json.loads(llm_utils.clean_json_content(content)),
+    "fix_gemini_json": lambda content: json.loads(llm_utils.fix_gemini_json(content)),
+    "aggressive_json_reconstruction": llm_utils.aggressive_json_reconstruction,
+    "extract_with_required_fields": llm_utils.extract_with_required_fields,
+    "repair_json": lambda content: repair_json(content)[0],
+    "extract_json_from_gemini_response": llm_utils.extract_json_from_gemini_response,
+}
+
+_VALUE_BEFORE_CLOSER = re.compile(r'([\]}"\del])(\n\s*[}\]])')
+
+PROSE_PREFIXES = [
+    "Here is the personalized health report based on the provided biomarkers:\n\n",
+    "Sure! Below is the JSON response.\n",
+    "Based on your lab results, I have prepared the following analysis.\n\n",
+]
+PROSE_SUFFIXES = [
+    "\n\nLet me know if you would like more detail on any section.",
+    "\n\nNote: please consult a healthcare provider before making changes.",
+]
+
+def _fence(text: str, rng: random.Random) -> str:
+    return f"```json\n{text}\n```"
+
+def _prose(text: str, rng: random.Random) -> str:
+    return rng.choice(PROSE_PREFIXES) + text + rng.choice(PROSE_SUFFIXES)
+
+def _trailing_commas(text: str, rng: random.Random) -> str:
+    return _VALUE_BEFORE_CLOSER.sub(lambda m: m.group(1) + ',' + m.group(2) if rng.random() < 0.5 else m.group(0), text)
+
+def _truncate(text: str, rng: random.Random) -> str:
+    return text[:rng.randint(len(text) // 2, len(text) - 1)]
+
+def _fenced_truncated_commas(text: str, rng: random.Random) -> str:
+    return "```json\n" + _truncate(_trailing_commas(text, rng), rng)
+
+def _fenced_unbalanced(text: str, rng: random.Random) -> str:
+    # Missing final brace inside a closed fence, followed by prose
+    return f"```json\n{text.rstrip()[:-1]}\n```" + rng.choice(PROSE_SUFFIXES)
+
+# Mutation name -> (function, whether the full report is still recoverable, deterministic)
+MUTATIONS = {
+    "clean": (lambda text, rng: text, True, True),
+    "fenced": (_fence, True, True),
+    "prose": (_prose, True, False),
+    "trailing_commas": (_trailing_commas, True, False),
+    "truncated": (_truncate, False, False),
+    "fenced_truncated_commas": (_fenced_truncated_commas, False, False),
+    "fenced_unbalanced": (_fenced_unbalanced, True, False),
+}
+
+def load_corpus() -> List[Dict[str, Any]]:
+    """Load the report bodies of every saved LLM result."""
+    corpus = []
+    for pattern in CORPUS_GLOBS:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            report = data.get("result", data)
+            if isinstance(report, dict) and report:
+                corpus.append({"path": os.path.relpath(path, REPO_ROOT), "report": report})
+    return corpus
+
+def build_large_case(report: Dict[str, Any], rng: random.Random, size: int = LARGE_CASE_BYTES) -> Dict[str, Any]:
+    """A report grown to about size bytes by repeating its biomarker insights, truncated in its last 10%."""
+    insights = report.get("biomarker_insights") or [{"biomarker_name": "placeholder", "current_value": "1"}]
+    copies = size // max(1, len(json.dumps(insights, indent=2, ensure_ascii=False))) + 1
+    large = dict(report, biomarker_insights=insights * copies)
+    text = json.dumps(large, indent=2, ensure_ascii=False)
+    return {
+        "path": "(generated)",
+        "mutation": "truncated_large",
+        "complete": False,
+        "content": text[:rng.randint(len(text) * 9 // 10, len(text) - 1)],
+        "expected": large,
+    }
+
+def build_cases(corpus: List[Dict[str, Any]], variants: int, seed: int) -> List[Dict[str, Any]]:
+    """Mutate every corpus report into the benchmark cases (seeded, so runs are reproducible)."""
+    rng = random.Random(seed)
+    cases = []
+    for entry in corpus:
+        text = json.dumps(entry["report"], indent=2, ensure_ascii=False)
+        for mutation, (mutate, complete, deterministic) in MUTATIONS.items():
+            for _ in range(1 if deterministic else variants):
+                cases.append({
+                    "path": entry["path"],
+                    "mutation": mutation,
+                    "complete": complete,
+                    "content": mutate(text, rng),
+                    "expected": entry["report"],
+                })
+    if corpus:
+        cases.append(build_large_case(corpus[0]["report"], rng))
+    return cases
+
+def field_recovery(result: Any, expected: Dict[str, Any]) -> float:
+    """Fraction of the original top-level fields recovered with their exact value."""
+    if not isinstance(result, dict) or not expected:
+        return 0.0
+    return sum(1 for key, value in expected.items() if result.get(key) == value) / len(expected)
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of values."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def run_strategy(strategy: Callable[[str], Any], cases: List[Dict[str, Any]], repeat: int) -> Dict[str, Dict[str, Any]]:
+    """Run one strategy over all cases and aggregate the metrics per mutation."""
+    samples = {}
+    for case in cases:
+        timings = []
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                result = strategy(case["content"])
+            except Exception:
+                result = None
+            timings.append(time.perf_counter() - start)
+
+        bucket = samples.setdefault(case["mutation"], {"latencies": [], "bytes": 0, "parsed": 0, "exact": 0, "recovery": 0.0, "count": 0, "complete": case["complete"]})
+        bucket["latencies"].extend(timings)
+        bucket["bytes"] += len(case["content"].encode('utf-8')) * repeat
+        bucket["count"] += 1
+        if isinstance(result, dict) and result:
+            bucket["parsed"] += 1
+        if result == case["expected"]:
+            bucket["exact"] += 1
+        bucket["recovery"] += field_recovery(result, case["expected"])
+
+    metrics = {}
+    for mutation, bucket in samples.items():
+        total_time = sum(bucket["latencies"])
+        metrics[mutation] = {
+            "cases": bucket["count"],
+            "mb_per_s": bucket["bytes"] / (1024 * 1024) / total_time if total_time else float('inf'),
+            "p50_ms": percentile(bucket["latencies"], 50) * 1000,
+            "p99_ms": percentile(bucket["latencies"], 99) * 1000,
+            "parse_rate": bucket["parsed"] / bucket["count"],
+            "exact_rate": bucket["exact"] / bucket["count"] if bucket["complete"] else None,
+            "field_recovery": bucket["recovery"] / bucket["count"],
+        }
+    return metrics
+
+def check_thresholds(results: Dict[str, Dict[str, Dict[str, Any]]], thresholds: Dict[str, Any]) -> List[str]:
+    """
+    Compare results against the threshold file and return a list of violations.
+
+    Thresholds are keyed by strategy then mutation ("*" applies to every
+    mutation) and may set min_mb_per_s, max_p99_ms, min_parse_rate,
+    min_exact_rate and min_field_recovery.
+    """
+    violations = []
+    for strategy, by_mutation in thresholds.items():
+        if strategy not in results:
+            continue
+        for mutation, metrics in results[strategy].items():
+            limits = dict(by_mutation.get("*", {}))
+            limits.update(by_mutation.get(mutation, {}))
+            for limit, bound in limits.items():
+                kind, metric = limit.split('_', 1)
+                value = metrics.get(metric)
+                if value is None:
+                    continue
+                if (kind == "min" and value < bound) or (kind == "max" and value > bound):
+                    violations.append(f"{strategy} / {mutation}: {metric} = {value:.3f} (limit {limit} {bound})")
+    return violations
+
+def format_table(results: Dict[str, Dict[str, Dict[str, Any]]]) -> str:
+    """Render the results as a plain-text table."""
+    header = f"{'strategy':<34} {'mutation':<24} {'cases':>5} {'MB/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'parsed':>7} {'exact':>7} {'fields':>7}"
+    lines = [header, '-' * len(header)]
+    for strategy, by_mutation in results.items():
+        for mutation, m in by_mutation.items():
+            exact = f"{m['exact_rate']:.0%}" if m['exact_rate'] is not None else "n/a"
+            lines.append(
+                f"{strategy:<34} {mutation:<24} {m['cases']:>5} {m['mb_per_s']:>9.2f} {m['p50_ms']:>9.2f} {m['p99_ms']:>9.2f} "
+                f"{m['parse_rate']:>7.0%} {exact:>7} {m['field_recovery']:>7.0%}"
+            )
+    return '\n'.join(lines)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seed", type=int, default=1234, help="seed for the mutations")
+    parser.add_argument("--variants", type=int, default=3, help="random variants per report for each randomized mutation")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per case")
+    parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES), help="only run these strategies")
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS, help="threshold file (pass '' to skip the regression check)")
+    parser.add_argument("--output", help="also write the results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    # Parse failures are expected on mutated inputs; keep the strategies' logging out of the report
+    logging.getLogger("llm_utils").setLevel(logging.CRITICAL)
+
+    corpus = load_corpus()
+    if not corpus:
+        print("No saved results found in llm_results/", file=sys.stderr)
+        return 1
+    cases = build_cases(corpus, args.variants, args.seed)
+    print(f"Corpus: {len(corpus)} reports -> {len(cases)} cases (seed {args.seed})\n")
+
+    results = {}
+    for name in args.strategies or STRATEGIES:
+        results[name] = run_strategy(STRATEGIES[name], cases, args.repeat)
+    print(format_table(results))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"seed": args.seed, "variants": args.variants, "results": results}, f, indent=2)
+
+    if args.thresholds:
+        with open(args.thresholds, encoding='utf-8') as f:
+            violations = check_thresholds(results, json.load(f))
+        if violations:
+            print("\nRegressions:")
+            for violation in violations:
+                print(f"  {violation}")
+            return 1
+        print("\nAll thresholds met.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
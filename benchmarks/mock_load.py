@@ -0,0 +1,142 @@
+"""
+Load-test the LLM call path offline against the mock provider.
+
+Sends concurrent report requests to a mock MODEL_CONFIGS entry (see
+mock_provider) through the real fallback, streaming or hedging entry point,
+so rate limiting, circuit breakers, fallbacks and JSON repair all run as in
+production while the provider is simulated. Reports throughput, latency
+percentiles, outcomes, repair strategies and the faults that were injected.
+
+    python -m benchmarks.mock_load
+    python -m benchmarks.mock_load --model mock/flaky --requests 500 --concurrency 32 --latency-scale 0.05
+    python -m benchmarks.mock_load --mode stream --latency-scale 0 --output load.json
+"""
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import llm_utils
+from llm_cache import cache_bypass
+from llm_events import LLM_CALL, LLM_REQUEST, capture_events
+from mock_provider import get_mock_provider
+from models import HealthVizorResponse
+
+MODES = ("fallback", "stream", "hedged")
+
+def _messages(index: int) -> List[Dict[str, str]]:
+    # Distinct user messages so requests replay different recorded reports and never share a cache entry
+    return [
+        {"role": "system", "content": "You are a functional medicine assistant. Respond with the health report JSON."},
+        {"role": "user", "content": f"Profile #{index}\nVitamin D: {20 + index % 40} ng/mL - Categories: Bone Health"},
+    ]
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+def run_request(model_name: str, mode: str, index: int, use_cache: bool) -> Dict[str, Any]:
+    """One request through the chosen entry point; returns its outcome, latency and call records."""
+    messages = _messages(index)
+    started = time.perf_counter()
+    outcome = "ok"
+    with capture_events() as events, cache_bypass(not use_cache):
+        try:
+            if mode == "stream":
+                result = llm_utils.call_llm_stream_with_fallback(model_name, messages, HealthVizorResponse, save_result=False)
+            elif mode == "hedged":
+                result = asyncio.run(llm_utils.acall_llm_hedged(model_name, messages, HealthVizorResponse, save_result=False))
+            else:
+                result = llm_utils.call_llm_with_fallback(model_name, messages, HealthVizorResponse, save_result=False)
+            if not isinstance(result, HealthVizorResponse):
+                outcome = "unparsed"
+        except Exception:
+            outcome = "failed"
+    calls = [event for event in events if event.kind == LLM_CALL]
+    requests_done = [event for event in events if event.kind == LLM_REQUEST]
+    return {
+        "outcome": outcome,
+        "seconds": time.perf_counter() - started,
+        "model_used": requests_done[-1].get("model_used") if requests_done else None,
+        "calls": len(calls),
+        "repairs": [event.get("repair_strategy") for event in calls if event.get("repair_strategy")],
+        "cache_hits": sum(1 for event in calls if event.get("cache_hit")),
+    }
+
+def run_load(model_name: str, mode: str, requests: int, concurrency: int, use_cache: bool) -> Dict[str, Any]:
+    """Run requests over concurrency threads and summarize them."""
+    provider = get_mock_provider()
+    faults_before = dict(provider.stats)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        records = list(executor.map(lambda index: run_request(model_name, mode, index, use_cache), range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = [record["seconds"] for record in records if record["outcome"] != "failed"]
+    return {
+        "model": model_name,
+        "mode": mode,
+        "requests": requests,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 2),
+        "requests_per_second": round(requests / wall, 2) if wall > 0 else None,
+        "latency_p50": _percentile(latencies, 0.50),
+        "latency_p95": _percentile(latencies, 0.95),
+        "latency_p99": _percentile(latencies, 0.99),
+        "outcomes": dict(collections.Counter(record["outcome"] for record in records)),
+        "models_used": dict(collections.Counter(record["model_used"] for record in records if record["model_used"])),
+        "provider_calls": sum(record["calls"] for record in records),
+        "cache_hits": sum(record["cache_hits"] for record in records),
+        "repairs": dict(collections.Counter(strategy for record in records for strategy in record["repairs"])),
+        "faults_injected": {key: value - faults_before.get(key, 0) for key, value in provider.stats.items()},
+        "circuits": {model: row["state"] for model, row in llm_utils.get_provider_scoreboard().items()
+                     if llm_utils.is_mock_model(model)},
+    }
+
+def format_report(summary: Dict[str, Any]) -> str:
+    lines = [f"{summary['requests']} {summary['mode']} requests to {summary['model']} at concurrency {summary['concurrency']}",
+             f"  wall {summary['wall_seconds']}s, {summary['requests_per_second']} req/s, "
+             f"p50 {summary['latency_p50']}s, p95 {summary['latency_p95']}s, p99 {summary['latency_p99']}s"]
+    for key in ("outcomes", "models_used", "repairs", "faults_injected", "circuits"):
+        lines.append(f"  {key}: {json.dumps(summary[key])}")
+    lines.append(f"  provider calls: {summary['provider_calls']}, cache hits: {summary['cache_hits']}")
+    return "\n".join(lines)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default="mock/flaky", help="mock model to target")
+    parser.add_argument("--mode", choices=MODES, default="fallback", help="entry point to exercise")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-scale", type=float, default=0.02, help="multiplier on the mock latency distributions")
+    parser.add_argument("--seed", default="1234", help="seed for latency and fault injection")
+    parser.add_argument("--use-cache", action="store_true", help="let requests hit the response cache")
+    parser.add_argument("--output", help="also write the summary as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if not llm_utils.is_mock_model(args.model):
+        print(f"{args.model} is not a mock model; refusing to load-test a real provider", file=sys.stderr)
+        return 2
+
+    # Injected faults are expected; keep per-call error logging out of the report
+    logging.getLogger("llm_utils").setLevel(logging.CRITICAL)
+    provider = get_mock_provider()
+    provider.latency_scale = args.latency_scale
+    provider.reseed(args.seed)
+
+    summary = run_load(args.model, args.mode, args.requests, args.concurrency, args.use_cache)
+    print(format_report(summary))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    return 0 if summary["outcomes"].get("failed", 0) == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
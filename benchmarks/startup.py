@@ -0,0 +1,145 @@
+"""
+Benchmark cold import time of the app and CLI entry points.
+
+Each target is imported in a fresh interpreter (so nothing is cached in
+sys.modules) several times; the benchmark reports the median import time,
+the slowest modules pulled in (from python -X importtime) and whether any
+module that must stay lazy (litellm, the provider SDKs, pandas, ...) was
+imported eagerly.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 10 --targets llm_utils app
+    python -m benchmarks.startup --history benchmarks/startup_history.jsonl   # record this release
+
+Exits with status 1 if a lazy module is imported eagerly or a target is
+slower than its limit in benchmarks/startup_thresholds.json.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_THRESHOLDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_thresholds.json")
+
+# Target name -> modules imported together ("app" is what health_vizor.py imports besides streamlit)
+TARGETS = {
+    "llm_utils": ["llm_utils"],
+    "app": ["llm_utils", "biomarkers", "escalation", "report_jobs", "report_service", "result_store", "tracing"],
+    "batch_reports": ["batch_reports"],
+    "replay": ["replay"],
+    "response_archive": ["response_archive"],
+}
+
+# Modules that must only be imported on first use, never by importing a target
+LAZY_MODULES = ("litellm", "openai", "httpx", "google.generativeai", "tiktoken", "pandas", "fastapi", "uvicorn")
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+{imports}
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "eager": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+def _run_probe(modules: List[str], importtime: bool = False) -> subprocess.CompletedProcess:
+    code = _PROBE.format(imports="\n".join(f"import {module}" for module in modules), lazy=LAZY_MODULES)
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    return subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+
+def slowest_modules(importtime_output: str, top: int = 10) -> List[Dict[str, Any]]:
+    """The modules with the largest self import time in python -X importtime output."""
+    rows = []
+    for line in importtime_output.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[0].startswith("import time:") or not parts[1].strip().isdigit():
+            continue
+        rows.append({"module": parts[2].strip(), "self_ms": int(parts[0].split(':')[1]) / 1000,
+                     "cumulative_ms": int(parts[1]) / 1000})
+    return sorted(rows, key=lambda row: row["self_ms"], reverse=True)[:top]
+
+def measure(modules: List[str], runs: int) -> Dict[str, Any]:
+    """Median / min cold import time over runs fresh interpreters, plus the slowest modules and eager lazy imports."""
+    timings, eager = [], set()
+    for _ in range(runs):
+        result = json.loads(_run_probe(modules).stdout)
+        timings.append(result["seconds"] * 1000)
+        eager.update(result["eager"])
+    breakdown = _run_probe(modules, importtime=True)
+    return {
+        "median_ms": round(statistics.median(timings), 1),
+        "min_ms": round(min(timings), 1),
+        "eager_lazy_modules": sorted(eager),
+        "slowest_modules": slowest_modules(breakdown.stderr),
+    }
+
+def check_thresholds(results: Dict[str, Dict[str, Any]], thresholds: Dict[str, Any]) -> List[str]:
+    """Violations of the per-target max_median_ms limits and of the lazy-import rule."""
+    violations = []
+    for target, metrics in results.items():
+        if metrics["eager_lazy_modules"]:
+            violations.append(f"{target}: imports {', '.join(metrics['eager_lazy_modules'])} eagerly")
+        limit = thresholds.get(target, {}).get("max_median_ms")
+        if limit is not None and metrics["median_ms"] > limit:
+            violations.append(f"{target}: median import {metrics['median_ms']} ms (limit {limit} ms)")
+    return violations
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), help="only measure these targets")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per target")
+    parser.add_argument("--top", type=int, default=5, help="slowest modules to print per target")
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS, help="threshold file (pass '' to skip the limit check)")
+    parser.add_argument("--output", help="also write the results as JSON to this path")
+    parser.add_argument("--history", help="append the results (with commit and timestamp) to this JSONL file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for target in args.targets or TARGETS:
+        try:
+            results[target] = measure(TARGETS[target], args.runs)
+        except subprocess.CalledProcessError as e:
+            print(f"{target}: import failed\n{e.stderr.strip().splitlines()[-1] if e.stderr else ''}", file=sys.stderr)
+            return 1
+        metrics = results[target]
+        print(f"{target}: median {metrics['median_ms']} ms (min {metrics['min_ms']} ms over {args.runs} runs)")
+        for row in metrics["slowest_modules"][:args.top]:
+            print(f"    {row['self_ms']:8.1f} ms  {row['module']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.history:
+        entry = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _git_commit(),
+                 "python": platform.python_version(), "results": {target: {key: metrics[key] for key in ("median_ms", "min_ms")}
+                                                                   for target, metrics in results.items()}}
+        with open(args.history, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + "\n")
+
+    thresholds = {}
+    if args.thresholds:
+        with open(args.thresholds, encoding='utf-8') as f:
+            thresholds = json.load(f)
+    violations = check_thresholds(results, thresholds)
+    if violations:
+        print("\nRegressions:")
+        for violation in violations:
+            print(f"  {violation}")
+        return 1
+    print("\nAll startup checks met.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
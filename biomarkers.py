@@ -0,0 +1,198 @@
+import functools
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Flags in severity order; stored in the table as their index (-1 if missing/unknown)
+FLAGS = ("Green", "Yellow", "Red")
+_FLAG_CODES = {flag.lower(): code for code, flag in enumerate(FLAGS)}
+
+# One biomarker per line, e.g.
+# Haemoglobin: 15.6 g/dL (Clinical range: 13.5-18 g/dL, Optimal range: 12-15.5 g/dL, Flag: Yellow) - Categories: Cardiac Health, Nutrient Status
+# Everything after the value is optional so partially formatted lines still yield a row.
+# The unit is matched greedily (no backtracking) and split from the categories afterwards
+# when a line has no range details.
+_BIOMARKER_LINE = re.compile(r"""
+    ^[ \t]*(?P<name>[^:\n]*[^:\s])[ \t]*:[ \t]*
+    (?P<value>[-+]?(?:\d[\d,]*(?:\.\d*)?|\.\d+))?[ \t]*
+    (?P<unit>[^(\n]*)
+    (?:\([ \t]*Clinical[ \t]range:[ \t]*(?P<clinical>[^,)\n]*),[ \t]*
+       Optimal[ \t]range:[ \t]*(?P<optimal>[^,)\n]*),[ \t]*
+       Flag:[ \t]*(?P<flag>[A-Za-z]*)[ \t]*\)
+    |\([^)\n]*\))?[ \t]*
+    (?:-[ \t]*Categories:(?P<categories>[^\n]*))?[ \t\r]*$
+""", re.MULTILINE | re.VERBOSE)
+
+_RANGE = re.compile(r'^\s*(?:(?P<low>\d*\.?\d+)\s*-\s*(?P<high>\d*\.?\d+)|(?P<op>[<>])=?\s*(?P<bound>\d*\.?\d+))')
+_NUMBER = re.compile(r'[-+]?\d[\d,]*(?:\.\d+)?|[-+]?\.\d+')
+
+@functools.lru_cache(maxsize=4096)
+def parse_range(text: Optional[str]) -> Tuple[float, float]:
+    """Parse "13.5-18 g/dL", "< 10 mm/hr" or ">90 ml/min" into (low, high); open ends are NaN."""
+    match = _RANGE.match(text) if text else None
+    if not match:
+        return np.nan, np.nan
+    if match.group('low') is not None:
+        return float(match.group('low')), float(match.group('high'))
+    bound = float(match.group('bound'))
+    return (np.nan, bound) if match.group('op') == '<' else (bound, np.nan)
+
+def parse_numeric_value(text: Any) -> float:
+    """Extract the first number from a value string such as "51.5 ml/min" (NaN if there is none)."""
+    if isinstance(text, (int, float)):
+        return float(text)
+    match = _NUMBER.search(text) if isinstance(text, str) else None
+    return float(match.group(0).replace(',', '')) if match else np.nan
+
+class BiomarkerTable:
+    """
+    Column-oriented table of parsed biomarkers.
+
+    Numeric columns (value and clinical/optimal bounds) are float64 arrays with
+    NaN for missing values and flags is an int8 array of FLAGS indices, so
+    checks across a panel are vectorized. Names, units and categories are
+    plain lists aligned with the arrays. Lines that could not be parsed are
+    kept in `unparsed`.
+    """
+
+    def __init__(self, names: Sequence[str], values, units: Sequence[str], clinical_low, clinical_high,
+                 optimal_low, optimal_high, flags, categories: Sequence[Tuple[str, ...]], unparsed: Sequence[str] = ()):
+        self.names = list(names)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.units = list(units)
+        self.clinical_low = np.asarray(clinical_low, dtype=np.float64)
+        self.clinical_high = np.asarray(clinical_high, dtype=np.float64)
+        self.optimal_low = np.asarray(optimal_low, dtype=np.float64)
+        self.optimal_high = np.asarray(optimal_high, dtype=np.float64)
+        self.flags = np.asarray(flags, dtype=np.int8)
+        self.categories = [tuple(c) for c in categories]
+        self.unparsed = list(unparsed)
+        self._index = {}
+        for i, name in enumerate(self.names):
+            self._index.setdefault(name.casefold(), i)
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Dict[str, Any]]) -> "BiomarkerTable":
+        """Rebuild a table from rows() output (e.g. stored as JSON)."""
+        def number(row, key):
+            return np.nan if row.get(key) is None else row[key]
+
+        return cls(
+            [row["name"] for row in rows],
+            [number(row, "value") for row in rows],
+            [row.get("unit", "") for row in rows],
+            [number(row, "clinical_low") for row in rows],
+            [number(row, "clinical_high") for row in rows],
+            [number(row, "optimal_low") for row in rows],
+            [number(row, "optimal_high") for row in rows],
+            [_FLAG_CODES.get((row.get("flag") or "").lower(), -1) for row in rows],
+            [row.get("categories", ()) for row in rows],
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def index(self, name: str) -> Optional[int]:
+        """Row index of a biomarker by exact (case-insensitive) name, or None."""
+        return self._index.get(name.strip().casefold())
+
+    def row(self, i: int) -> Dict[str, Any]:
+        """One biomarker as a dict; missing numbers are None."""
+        def number(column):
+            value = column[i]
+            return None if np.isnan(value) else float(value)
+
+        flag = int(self.flags[i])
+        return {
+            "name": self.names[i],
+            "value": number(self.values),
+            "unit": self.units[i],
+            "clinical_low": number(self.clinical_low),
+            "clinical_high": number(self.clinical_high),
+            "optimal_low": number(self.optimal_low),
+            "optimal_high": number(self.optimal_high),
+            "flag": FLAGS[flag] if flag >= 0 else None,
+            "categories": list(self.categories[i]),
+        }
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """One biomarker by name as a dict, or None if it is not in the table."""
+        i = self.index(name)
+        return None if i is None else self.row(i)
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """All biomarkers as dicts."""
+        return [self.row(i) for i in range(len(self))]
+
+    def flag_counts(self) -> Dict[str, int]:
+        """Number of biomarkers per flag."""
+        counts = np.bincount(self.flags[self.flags >= 0], minlength=len(FLAGS))
+        return {flag: int(count) for flag, count in zip(FLAGS, counts)}
+
+    def flag_mask(self, flag: str) -> np.ndarray:
+        """Boolean mask of biomarkers with the given flag."""
+        return self.flags == _FLAG_CODES.get(flag.lower(), -2)
+
+    def outside_range(self, kind: str = "optimal") -> np.ndarray:
+        """Boolean mask of values below/above the "clinical" or "optimal" bounds (open bounds never trigger)."""
+        low, high = (self.clinical_low, self.clinical_high) if kind == "clinical" else (self.optimal_low, self.optimal_high)
+        with np.errstate(invalid='ignore'):
+            return (self.values < low) | (self.values > high)
+
+    def all_categories(self) -> List[str]:
+        """Distinct categories in order of first appearance (case-insensitive)."""
+        seen = {}
+        for categories in self.categories:
+            for category in categories:
+                seen.setdefault(category.casefold(), category)
+        return list(seen.values())
+
+    def in_category(self, category: str) -> List[str]:
+        """Names of the biomarkers listed under a category."""
+        key = category.casefold()
+        return [name for name, categories in zip(self.names, self.categories)
+                if any(c.casefold() == key for c in categories)]
+
+def parse_biomarkers(text: str) -> BiomarkerTable:
+    """Parse the biomarkers text (one "Name: value unit (ranges, flag) - Categories: ..." per line) into a table."""
+    names, values, units, categories = [], [], [], []
+    clinical_low, clinical_high, optimal_low, optimal_high, flags = [], [], [], [], []
+    unparsed = []
+
+    position = 0
+    for match in _BIOMARKER_LINE.finditer(text):
+        if match.start() > position + 1:
+            _collect_unparsed(text[position:match.start()], unparsed)
+        position = match.end()
+
+        name, value, unit, clinical, optimal, flag, category_text = match.group(
+            'name', 'value', 'unit', 'clinical', 'optimal', 'flag', 'categories')
+        if category_text is None and '- Categories:' in unit:
+            unit, category_text = unit.split('- Categories:', 1)
+
+        names.append(name)
+        values.append(float(value.replace(',', '')) if value else np.nan)
+        units.append(unit.strip())
+        low, high = parse_range(clinical)
+        clinical_low.append(low)
+        clinical_high.append(high)
+        low, high = parse_range(optimal)
+        optimal_low.append(low)
+        optimal_high.append(high)
+        flags.append(_FLAG_CODES.get(flag.lower(), -1) if flag else -1)
+        categories.append(_split_categories(category_text) if category_text else ())
+    _collect_unparsed(text[position:], unparsed)
+
+    return BiomarkerTable(names, values, units, clinical_low, clinical_high, optimal_low, optimal_high,
+                          flags, categories, unparsed)
+
+@functools.lru_cache(maxsize=4096)
+def _split_categories(text: str) -> Tuple[str, ...]:
+    # Panels in a batch share a small vocabulary of category lists, so this is cached like parse_range
+    return tuple(c.strip() for c in text.split(',') if c.strip())
+
+def _collect_unparsed(text: str, unparsed: List[str]) -> None:
+    for line in text.splitlines():
+        if line.strip():
+            unparsed.append(line.strip())
@@ -0,0 +1,253 @@
+import functools
+import logging
+import re
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from biomarkers import FLAGS, BiomarkerTable, parse_numeric_value
+
+logger = logging.getLogger(__name__)
+
+# Deterministic escalation thresholds. A rule fires when the lab value of a
+# biomarker matching one of its aliases is below / above the threshold. Names
+# are split into tokens (see biomarker_name_tokens) and an alias matches when
+# its tokens appear as a whole-token sequence, so "Creatinine, Serum" and
+# "ALT/SGPT" match but "Alkaline Phosphatase" does not match "alt". A name
+# containing any of the rule's exclusions (also token sequences) never
+# matches it. When several rules match, the longest alias wins
+# ("Hemoglobin A1c" is HbA1c, not hemoglobin).
+ESCALATION_RULES = [
+    {
+        "id": "egfr_low",
+        "aliases": ["egfr", "gfr", "estimated gfr", "gfr estimated", "estimated glomerular filtration rate"],
+        "exclusions": ["ratio"],
+        "op": "<",
+        "threshold": 60.0,
+        "message": "eGFR {value} indicates stage-3+ kidney function; clinician review advised.",
+    },
+    {
+        "id": "creatinine_high",
+        "aliases": ["creatinine", "serum creatinine"],
+        "exclusions": ["urine", "urinary", "urine creatinine", "creatine kinase", "clearance", "ratio"],
+        "op": ">",
+        "threshold": 1.5,
+        "message": "Creatinine {value} indicates kidney dysfunction; medical evaluation needed.",
+    },
+    {
+        "id": "alt_high",
+        "aliases": ["alt", "sgpt", "alanine aminotransferase", "alanine transaminase"],
+        "exclusions": ["ratio"],
+        "op": ">",
+        "threshold": 100.0,
+        "message": "ALT {value} indicates severe liver dysfunction; immediate medical attention required.",
+    },
+    {
+        "id": "ast_high",
+        "aliases": ["ast", "sgot", "aspartate aminotransferase", "aspartate transaminase"],
+        "exclusions": ["ratio"],
+        "op": ">",
+        "threshold": 100.0,
+        "message": "AST {value} indicates severe liver dysfunction; immediate medical attention required.",
+    },
+    {
+        "id": "hba1c_high",
+        "aliases": ["hba1c", "hb a1c", "a1c", "hemoglobin a1c", "haemoglobin a1c", "glycated hemoglobin", "glycated haemoglobin"],
+        "op": ">",
+        "threshold": 9.0,
+        "message": "HbA1c {value} indicates uncontrolled diabetes; urgent medical review needed.",
+    },
+    {
+        "id": "hemoglobin_low",
+        "aliases": ["hemoglobin", "haemoglobin", "hb", "hgb"],
+        "exclusions": ["a1c", "glycated", "corpuscular", "urine", "urinary"],
+        "op": "<",
+        "threshold": 8.0,
+        "message": "Hemoglobin {value} indicates severe anemia; medical evaluation required.",
+    },
+]
+
+# Escalate when at least this many biomarkers are flagged red
+RED_FLAG_MIN_COUNT = 3
+RED_FLAG_MESSAGE = "Multiple critical biomarkers ({count} red flags) require comprehensive medical review."
+
+_RED = FLAGS.index("Red")
+_TOKEN_SEPARATORS = re.compile(r'[^0-9a-z]+')
+
+@functools.lru_cache(maxsize=8192)
+def biomarker_name_tokens(name: str) -> Tuple[str, ...]:
+    """Lower-cased tokens of a biomarker name, split on commas, slashes, hyphens, brackets and whitespace."""
+    return tuple(token for token in _TOKEN_SEPARATORS.split((name or '').casefold()) if token)
+
+def normalize_biomarker_name(name: str) -> str:
+    """A biomarker name as its space-joined tokens ("eGFR CKD-EPI" -> "egfr ckd epi")."""
+    return ' '.join(biomarker_name_tokens(name))
+
+def _contains_sequence(tokens: Tuple[str, ...], sequence: Tuple[str, ...]) -> bool:
+    size = len(sequence)
+    return size > 0 and any(tokens[i:i + size] == sequence for i in range(len(tokens) - size + 1))
+
+class EscalationEngine:
+    """
+    Evaluates the escalation rule table against lab values.
+
+    Rule thresholds are compiled into arrays once; evaluation gathers each
+    rule's lab value per panel into a (panels x rules) matrix and applies all
+    comparisons at once, so a whole cohort is screened in a single pass.
+    """
+
+    def __init__(self, rules: Sequence[Dict[str, Any]] = ESCALATION_RULES, red_flag_min_count: int = RED_FLAG_MIN_COUNT):
+        self.rules = list(rules)
+        self.red_flag_min_count = red_flag_min_count
+        self.rule_ids = [rule["id"] for rule in self.rules]
+        self.thresholds = np.array([rule["threshold"] for rule in self.rules], dtype=np.float64)
+        self.below = np.array([rule["op"] == "<" for rule in self.rules], dtype=bool)
+        # (alias tokens, rule position), longest alias first
+        self._aliases = sorted(((biomarker_name_tokens(alias), position)
+                                for position, rule in enumerate(self.rules) for alias in rule["aliases"]),
+                               key=lambda item: -len(item[0]))
+        self._exclusions = [[biomarker_name_tokens(exclusion) for exclusion in rule.get("exclusions", ())]
+                            for rule in self.rules]
+        self._rule_by_name = {}
+
+    def match_rule(self, name: str) -> Optional[str]:
+        """Id of the rule a biomarker name falls under, or None."""
+        position = self._rule_position(name)
+        return None if position is None else self.rule_ids[position]
+
+    def _rule_position(self, name: str) -> Optional[int]:
+        if name not in self._rule_by_name:
+            tokens = biomarker_name_tokens(name)
+            self._rule_by_name[name] = next(
+                (position for alias, position in self._aliases
+                 if _contains_sequence(tokens, alias)
+                 and not any(_contains_sequence(tokens, exclusion) for exclusion in self._exclusions[position])),
+                None)
+        return self._rule_by_name[name]
+
+    def _rule_rows(self, table: BiomarkerTable) -> np.ndarray:
+        """Row index in table for each rule (-1 if the panel has no matching biomarker)."""
+        rows = np.full(len(self.rules), -1, dtype=np.int64)
+        for row, name in enumerate(table.names):
+            position = self._rule_position(name)
+            if position is not None and rows[position] < 0:
+                rows[position] = row
+        return rows
+
+    def screen(self, tables: Sequence[BiomarkerTable]) -> Dict[str, Any]:
+        """
+        Screen many panels at once.
+
+        Returns arrays aligned with tables: "values" (panels x rules, NaN where
+        the biomarker is missing), "hits" (panels x rules booleans),
+        "red_counts", and "escalation_needed", plus the "rule_ids" column order.
+        """
+        values = np.full((len(tables), len(self.rules)), np.nan)
+        red_counts = np.zeros(len(tables), dtype=np.int64)
+        for i, table in enumerate(tables):
+            rows = self._rule_rows(table)
+            present = rows >= 0
+            values[i, present] = table.values[rows[present]]
+            red_counts[i] = np.count_nonzero(table.flags == _RED)
+
+        with np.errstate(invalid='ignore'):
+            hits = np.where(self.below, values < self.thresholds, values > self.thresholds)
+        escalation_needed = hits.any(axis=1) | (red_counts >= self.red_flag_min_count)
+        return {
+            "rule_ids": self.rule_ids,
+            "values": values,
+            "hits": hits,
+            "red_counts": red_counts,
+            "escalation_needed": escalation_needed,
+        }
+
+    def evaluate(self, table: BiomarkerTable) -> Dict[str, Any]:
+        """
+        Evaluate one panel.
+
+        Returns escalation_needed, escalation_reason (the first triggered rule in
+        table order, None if nothing fired), all reasons and the triggered rule ids.
+        """
+        screened = self.screen([table])
+        rows = self._rule_rows(table)
+        reasons, triggered = [], []
+        for position in np.flatnonzero(screened["hits"][0]):
+            row = rows[position]
+            unit = table.units[row]
+            value = f"{table.values[row]:g}{'' if unit.startswith('%') else ' '}{unit}".strip()
+            reasons.append(self.rules[position]["message"].format(value=value))
+            triggered.append(self.rule_ids[position])
+
+        red_count = int(screened["red_counts"][0])
+        if red_count >= self.red_flag_min_count:
+            reasons.append(RED_FLAG_MESSAGE.format(count=red_count))
+            triggered.append("red_flags")
+
+        return {
+            "escalation_needed": bool(reasons),
+            "escalation_reason": reasons[0] if reasons else None,
+            "reasons": reasons,
+            "triggered_rules": triggered,
+        }
+
+_default_engine = None
+
+def get_escalation_engine() -> EscalationEngine:
+    """Return the engine for the default rule table."""
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = EscalationEngine()
+    return _default_engine
+
+def evaluate_escalation(table: BiomarkerTable) -> Dict[str, Any]:
+    """Evaluate the default escalation rules against a parsed lab panel (usable before any LLM call)."""
+    return get_escalation_engine().evaluate(table)
+
+def screen_cohort(tables: Sequence[BiomarkerTable]) -> Dict[str, Any]:
+    """Screen a cohort of parsed lab panels with the default rules in one vectorized pass."""
+    return get_escalation_engine().screen(tables)
+
+def table_from_insights(biomarker_insights: Iterable[Any]) -> BiomarkerTable:
+    """
+    Build a table from LLM biomarker_insights (name, current_value, status).
+
+    Used only when the original lab panel is not available; the values are
+    whatever the model echoed back.
+    """
+    names, values, units, flags = [], [], [], []
+    for insight in biomarker_insights:
+        if not isinstance(insight, dict):
+            continue
+        current_value = insight.get('current_value', '') or ''
+        value = parse_numeric_value(current_value)
+        names.append(insight.get('biomarker_name', '') or '')
+        values.append(value)
+        units.append(current_value.split(' ', 1)[1].strip() if isinstance(current_value, str) and ' ' in current_value.strip() else '')
+        flags.append(_status_flag(insight.get('status', '')))
+    nan = [np.nan] * len(names)
+    return BiomarkerTable(names, values, units, nan, nan, nan, nan, flags, [()] * len(names))
+
+def _status_flag(status: Any) -> int:
+    status = (status or '').lower() if isinstance(status, str) else ''
+    if 'red' in status:
+        return FLAGS.index("Red")
+    if 'amber' in status or 'yellow' in status:
+        return FLAGS.index("Yellow")
+    if 'green' in status:
+        return FLAGS.index("Green")
+    return -1
+
+def apply_escalation(response_data: Dict[str, Any], biomarker_table: Optional[BiomarkerTable] = None) -> Dict[str, Any]:
+    """Set escalation_needed / escalation_reason on a report from the lab table (or the report's own insights)."""
+    if not isinstance(response_data, dict):
+        return response_data
+    if biomarker_table is None:
+        biomarker_table = table_from_insights(response_data.get('biomarker_insights', []) or [])
+
+    result = evaluate_escalation(biomarker_table)
+    response_data['escalation_needed'] = result["escalation_needed"]
+    response_data['escalation_reason'] = result["escalation_reason"]
+    if result["escalation_needed"]:
+        logger.info("🚨 Escalation triggered: %s", result['escalation_reason'])
+    return response_data
+
@@ -2,16 +2,25 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import json
+import logging
 import streamlit as st
-from pydantic import BaseModel
-from typing import Dict, List, Optional
-from llm_utils import call_llm_with_fallback
-from prompt import PROMPT
+from llm_utils import get_provider_scoreboard, get_rate_headroom
+from mock_provider import MOCK_LLM_ENABLED
+from biomarkers import parse_biomarkers
+from escalation import evaluate_escalation
+from report_jobs import QUEUED, SUCCEEDED, get_job_queue
+from report_service import ReportRequest, history_entry, plan_report_update, report_job_key, submit_report, submit_report_update
+from result_store import RESULT_STORE_BACKEND, get_result_store
+from tracing import start_span, start_trace
 import os
-import pandas as pd
+import time
+from datetime import datetime
 
 st.set_page_config(page_title="HealthVizor", layout="wide")
 
+# LLM pipeline logs go to the terminal; set LOG_LEVEL=DEBUG for raw response previews
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(name)s %(message)s")
+
 # Initialize session state for metadata if not present
 if 'metadata' not in st.session_state:
     st.session_state.metadata = {
@@ -167,147 +176,6 @@ if 'user_history' not in st.session_state:
 
 
 
-from pydantic import Field
-
-# LiteLLM-compatible Pydantic models with non-empty object schemas for Gemini/VertexAI
-
-class SupplementRecommendation(BaseModel):
-    supplement_name: str = Field(..., description="Name of the supplement being recommended")
-    rationale: str = Field(..., description="Rationale for recommending this supplement based on user profile and biomarkers")
-    dosage: str = Field(..., description="Recommended dose using educational language (e.g., 'Studies suggest 500mg may support...')")
-    timing: str = Field(..., description="When to take (morning, evening, with meals, etc.)")
-    food_timing: str = Field(..., description="Before/with/after food instructions")
-    purpose: str = Field(..., description="Purpose and how it helps the user - what it does for you")
-    biomarker_connection: str = Field(..., description="How this connects to user's biomarker data and health goals")
-    longevity_performance_benefit: str = Field(..., description="How this supports longevity and performance goals")
-    duration: str = Field(..., description="How long to take the supplement")
-    retest_timing: str = Field(..., description="When to retest biomarkers")
-    evidence_source: str = Field(..., description="Scientific evidence source from approved knowledge sources")
-    cautions: Optional[str] = Field(None, description="Side effects, cautions, or things to avoid")
-    interactions: Optional[str] = Field(None, description="Any interactions with other supplements or medications")
-    indian_availability: Optional[str] = Field(None, description="Notes on availability in India or Indian brands if relevant")
-
-class NutritionRecommendation(BaseModel):
-    nutrition_name: str = Field(..., description="Name of the nutrition recommendation")
-    rationale: str = Field(..., description="Why this is recommended based on biomarker data and personalization data")
-    priority_rank: int = Field(..., description="Priority ranking (1-5)")
-    evidence_strength: str = Field(..., description="Strength of evidence (High/Medium/Low)")
-    biomarker_connection: str = Field(..., description="How this connects to specific biomarker data")
-    implementation_tips: List[str] = Field(default_factory=list, description="3-4 practical tips for implementation with Indian context")
-    foods_to_include: List[str] = Field(default_factory=list, description="Specific foods to eat more of (Indian foods when possible)")
-    foods_to_avoid: List[str] = Field(default_factory=list, description="Foods to avoid or limit")
-    meal_timing_guidance: Optional[str] = Field(None, description="Meal timing recommendations if relevant")
-    indian_food_examples: List[str] = Field(default_factory=list, description="Examples using Indian cuisine and locally available foods")
-    female_specific_notes: Optional[str] = Field(None, description="Special considerations for female users based on cycle status")
-    evidence_source: str = Field(..., description="Scientific evidence source with links")
-
-class ExerciseRecommendation(BaseModel):
-    exercise_name: str = Field(..., description="Name of the exercise/lifestyle recommendation")
-    rationale: str = Field(..., description="Why this is recommended based on biomarker data and personalization data")
-    workout_type: str = Field(..., description="Type of workout (strength, cardio, flexibility, etc.)")
-    frequency: str = Field(..., description="How often per week")
-    duration: str = Field(..., description="Duration per session")
-    intensity: str = Field(..., description="Intensity level recommendations")
-    volume: str = Field(..., description="Volume recommendations")
-    rest_periods: str = Field(..., description="Rest period recommendations")
-    biomarker_connection: str = Field(..., description="How this connects to biomarker data and goals")
-    current_optimization: Optional[str] = Field(None, description="What user is doing right and how to optimize further")
-    athlete_specific_notes: Optional[str] = Field(None, description="Training periodization or protocols for competitive athletes")
-    female_specific_notes: Optional[str] = Field(None, description="Recommendations based on cycle status for female users")
-    no_intervention_note: Optional[str] = Field(None, description="Note if no intervention needed (e.g., 'well-balanced, no critical changes needed')")
-    evidence_source: str = Field(..., description="Scientific evidence source with links")
-
-class CategoryInsight(BaseModel):
-    category_name: str = Field(..., description="Name of the health category with emoji (e.g., '💪 Strength & Endurance')")
-    score: str = Field(..., description="Category score (e.g., '75/100')")
-    summary: str = Field(..., description="Comprehensive 3-4 sentence summary explaining the category's current state, key biomarker patterns, and overall assessment. Should identify multi-marker patterns (e.g., HPA axis fatigue) and explain the functional medicine significance")
-    whats_working_well: Optional[str] = Field(None, description="Specific biomarkers and values that are optimal, with exact values and why they support the user's goals")
-    what_needs_work: Optional[str] = Field(None, description="Specific biomarkers that are amber/red with exact values and status, explaining the functional implications")
-    behavioral_contributors: List[str] = Field(default_factory=list, description="Specific lifestyle factors from user metadata that contribute to this category's performance")
-    priority_actions: List[str] = Field(default_factory=list, description="Specific, actionable interventions to improve this category (supplements, lifestyle changes, etc.)")
-    how_this_links_to_goals: Optional[str] = Field(None, description="Clear explanation of how optimizing this category directly impacts the user's stated health goals and lifestyle")
-    relevance_to_goals: str = Field(..., description="Why this category matters for the user's goals")
-    impact_on_goals: str = Field(..., description="How this category impacts user's goals")
-    performance_longevity_impact: str = Field(..., description="Why this score matters for performance or longevity")
-    biomarker_connections: List[str] = Field(default_factory=list, description="Connected biomarkers")
-    interrelated_categories: List[str] = Field(default_factory=list, description="Other categories that are interrelated")
-    what_to_continue: Optional[str] = Field(None, description="What's working well to continue (for green categories)")
-
-class BiomarkerInsight(BaseModel):
-    biomarker_name: str = Field(..., description="Name of the biomarker")
-    status: str = Field(..., description="Status (Red/Amber/Green/Optimal)")
-    current_value: str = Field(..., description="Current biomarker value")
-    reference_range: str = Field(..., description="Normal reference range")
-    what_it_is_why_matters: str = Field(..., description="Explain the biomarker in plain language (2-3 sentences). What does it measure? Why is it important for the user's health goals, longevity, or performance?")
-    your_result: str = Field(..., description="State the user's actual value, whether it is in the optimal, yellow, amber, or red range, and what that means for their health")
-    likely_contributors: str = Field(..., description="Use user metadata and known lifestyle associations to infer what may be contributing to the value. Be explicit and tie it back to the user's behaviors or reported symptoms")
-    health_implications: str = Field(..., description="Explain what happens if this marker remains out of range. Use credible, non-alarmist language to outline risks")
-    recommended_next_steps: str = Field(..., description="Suggest 1-2 specific, actionable interventions that can help. Make it practical and tied to this biomarker")
-    deviation_severity: Optional[str] = Field(None, description="Mild/Moderate/Severe based on % deviation from optimal")
-    what_to_continue: Optional[str] = Field(None, description="What's working well (for Green/Optimal)")
-    trend_analysis: Optional[str] = Field(None, description="Trend compared to past data if available")
-    related_biomarkers: List[str] = Field(default_factory=list, description="Other biomarkers that are related or show consistent patterns")
-    evidence_source: str = Field(..., description="Scientific evidence source")
-
-class TopPriority(BaseModel):
-    priority_number: int = Field(..., description="Priority ranking (1, 2, or 3)")
-    priority_name: str = Field(..., description="Name of the priority area (e.g., 'Rebuild Adrenal Resilience')")
-    detailed_narrative: str = Field(default="", description="Comprehensive narrative paragraph integrating biomarker evidence, lifestyle factors, functional medicine insights, and impact on user's goals")
-    # Legacy fields for backward compatibility
-    biomarker_evidence: List[str] = Field(default_factory=list, description="Specific biomarkers and their values that support this priority")
-    lifestyle_evidence: List[str] = Field(default_factory=list, description="User's lifestyle factors, symptoms, or behaviors that support this priority")
-    functional_significance: str = Field(default="", description="Explanation of the functional medicine significance and patterns identified")
-    impact_statement: str = Field(default="", description="Why addressing this priority is essential for the user's goals, energy, health, etc.")
-
-class MonthlyPlan(BaseModel):
-    month_range: str = Field(..., description="Month range (e.g., 'Months 0-2')")
-    focus_areas: List[str] = Field(default_factory=list, description="Key focus areas for this period")
-    supplement_adjustments: List[str] = Field(default_factory=list, description="Supplement plan for this period")
-    nutrition_focus: List[str] = Field(default_factory=list, description="Nutrition focus for this period")
-    exercise_goals: List[str] = Field(default_factory=list, description="Exercise goals for this period")
-    lifestyle_targets: List[str] = Field(default_factory=list, description="Lifestyle targets")
-    retest_schedule: List[str] = Field(default_factory=list, description="When to retest biomarkers")
-
-class ActionPlan(BaseModel):
-    supplements: List[SupplementRecommendation] = Field(default_factory=list, description="Supplement recommendations (max 5, no duplicates)")
-    supplement_schedule_summary: str = Field(..., description="Daily supplement schedule organized by time of day for easy reading")
-    supplement_disclaimer: str = Field(default="These suggestions are for educational purposes only and do not constitute medical advice. Please consult a healthcare provider before beginning any supplement regimen.", description="Supplement disclaimer")
-    nutrition: List[NutritionRecommendation] = Field(default_factory=list, description="Nutrition recommendations (max 5, ranked by priority)")
-    exercise_lifestyle: List[ExerciseRecommendation] = Field(default_factory=list, description="Exercise and lifestyle recommendations (max 5)")
-    six_month_timeline: List[MonthlyPlan] = Field(default_factory=list, description="6-month action plan timeline with logical progression")
-
-class HealthVizorResponse(BaseModel):
-    # A) Overall Health Summary & Personalization
-    overall_health_summary: str = Field(..., description="Warm, celebratory 5-6 sentence paragraph in second person that commends the user for taking charge of their health, personalizes using age, gender, health goals, habits, or activity level, reflects overall impression based on biomarkers, reinforces hope and actionability")
-    congratulations_message: str = Field(..., description="Congratulate user on taking this step")
-    wins_to_celebrate: List[str] = Field(default_factory=list, description="What's Working Well - highlight key green biomarkers and high-performing categories, reinforce positive behaviors")
-    what_to_continue: List[str] = Field(default_factory=list, description="What the user should continue doing - encourage to continue or double down on these habits")
-    what_needs_work: List[str] = Field(default_factory=list, description="What Needs Attention - flag notable amber/red biomarkers or risk patterns with constructive language")
-    top_3_priorities_detailed: List[TopPriority] = Field(default_factory=list, description="Detailed breakdown of top 3 health priorities with comprehensive narrative format integrating biomarker evidence, lifestyle factors, and impact statements")
-    biomarker_snapshot: str = Field(..., description="Simple count of red, amber, and green biomarkers with encouraging message (e.g., 'You have 4 red, 6 amber, and 12 green biomarkers. That's a strong foundation — and a great place to start.')")
-    goal_relevance: str = Field(..., description="How this relates to the user's goals")
-    longevity_performance_impact: str = Field(..., description="What this means for overall longevity and performance")
-
-    # B) Category Level Insights & Personalization
-    category_insights: List[CategoryInsight] = Field(default_factory=list, description="Detailed insights for each health category")
-
-    # C) Biomarker Level Findings & Personalization
-    biomarker_insights: List[BiomarkerInsight] = Field(default_factory=list, description="Detailed insights for each biomarker")
-    biomarker_pattern_analysis: Optional[str] = Field(None, description="Analysis of biomarker patterns across multiple systems")
-
-    # D) Personalized Action Plan
-    action_plan: ActionPlan = Field(default_factory=ActionPlan, description="Comprehensive personalized action plan")
-
-    # Escalation flags
-    escalation_needed: bool = Field(default=False, description="Whether escalation is needed (under 18, pregnant, critical biomarkers)")
-    escalation_reason: Optional[str] = Field(None, description="Reason for escalation if needed")
-
-    # Disclaimer
-    disclaimer: str = Field(
-        default="These recommendations are for educational purposes only and do not constitute medical advice. Please consult a healthcare provider before starting any new regimen.",
-        description="Medical disclaimer"
-    )
-
 # Helper functions for displaying structured data
 def display_category_insight(insight, user_name="User"):
     if isinstance(insight, dict):
@@ -759,6 +627,44 @@ def display_monthly_plan(plan, user_name):
             for retest in retest_schedule:
                 st.markdown(f"• {retest}")
 
+def display_streamed_supplement(supp):
+    """Compact supplement card used while the report is still streaming (no widgets)"""
+    supp_name = supp.get('supplement_name', '') if isinstance(supp, dict) else getattr(supp, 'supplement_name', '')
+    dosage = supp.get('dosage', '') if isinstance(supp, dict) else getattr(supp, 'dosage', '')
+    timing = supp.get('timing', '') if isinstance(supp, dict) else getattr(supp, 'timing', '')
+    with st.expander(f"💊 {supp_name}", expanded=False):
+        if dosage:
+            st.markdown(f"**Dosage:** {dosage}")
+        if timing:
+            st.markdown(f"**Timing:** {timing}")
+
+def biomarker_status_icon(status):
+    """Map a biomarker status to the icon used in the report"""
+    status = (status or '').lower()
+    if 'red' in status:
+        return "🚨"
+    if 'amber' in status or 'yellow' in status:
+        return "⚠️"
+    return "✅"
+
+def get_biomarker_table():
+    """Parse the biomarkers text once per edit and keep the table in session state"""
+    biomarkers_text = st.session_state.get("biomarkers_data", "")
+    if st.session_state.get("biomarker_table_source") != biomarkers_text or "biomarker_table" not in st.session_state:
+        st.session_state.biomarker_table = parse_biomarkers(biomarkers_text)
+        st.session_state.biomarker_table_source = biomarkers_text
+    return st.session_state.biomarker_table
+
+def render_streamed_item(path, item, user_name="User"):
+    """Render a single report item as soon as it arrives from a streaming or sectioned call"""
+    if path == "biomarker_insights[]":
+        status = item.get('status', '') if isinstance(item, dict) else getattr(item, 'status', '')
+        display_biomarker_insight(item, biomarker_status_icon(status))
+    elif path == "category_insights[]":
+        display_category_insight(item, user_name)
+    elif path == "action_plan.supplements[]":
+        display_streamed_supplement(item)
+
 # Add breezy, light, semi-transparent background
 st.markdown(
     """
@@ -1033,6 +939,12 @@ st.text_area(
     key="biomarkers_data",
     help="Enter any relevant biomarker data, lab results, or health metrics"
 )
+biomarker_table = get_biomarker_table()
+if len(biomarker_table):
+    flag_counts = biomarker_table.flag_counts()
+    st.caption(f"Parsed {len(biomarker_table)} biomarkers: 🟢 {flag_counts['Green']} · 🟡 {flag_counts['Yellow']} · 🔴 {flag_counts['Red']}")
+if biomarker_table.unparsed:
+    st.warning(f"⚠️ {len(biomarker_table.unparsed)} line(s) could not be read as biomarkers: " + "; ".join(biomarker_table.unparsed[:3]))
 
 st.markdown("#### Category Scores")
 st.text_area(
@@ -1064,8 +976,11 @@ model_options = {
     "azure/o1": "Azure o1(Original endpoint)",
     "azure/o4-mini": "Azure O4 Mini (New endpoint - O-Series)",
     "openai/o3": "OpenAI O3",
-    "gemini/gemini-2.0-flash": "Google Gemini 2.0 Flash"
+    "gemini/gemini-2.0-flash": "Google Gemini 2.0 Flash",
 }
+if MOCK_LLM_ENABLED:
+    # Development only: replays other people's saved reports
+    model_options["mock/replay"] = "Mock provider (replays saved reports offline)"
 
 selected_model = st.selectbox(
     "Select LLM Model",
@@ -1077,6 +992,66 @@ selected_model = st.selectbox(
 
 st.info(f"🤖 Using {model_options[selected_model]}")
 
+headroom = get_rate_headroom(selected_model)[selected_model]
+if headroom["requests_per_minute"] or headroom["tokens_per_minute"]:
+    rate_caption = (f"⏱️ Rate headroom: {headroom['requests_available']}/{headroom['requests_per_minute']} requests, "
+                    f"{headroom['tokens_available']:,}/{headroom['tokens_per_minute']:,} tokens per minute, "
+                    f"{headroom['in_flight']}/{headroom['max_concurrency']} in flight")
+    if headroom["blocked_for_seconds"]:
+        rate_caption += f" — provider rate limit hit, cooling down for {headroom['blocked_for_seconds']}s"
+    st.caption(rate_caption)
+
+scoreboard = get_provider_scoreboard()
+if any(health["calls"] or health["state"] != "closed" for health in scoreboard.values()):
+    with st.expander("🩺 Provider health"):
+        st.dataframe([
+            {
+                "Model": model_options.get(model, model),
+                "Circuit": health["state"].replace("_", "-"),
+                "Calls": health["calls"],
+                "Success rate": f"{health['success_rate']:.0%}" if health["success_rate"] is not None else "–",
+                "p50 latency (s)": round(health["p50_latency"], 1) if health["p50_latency"] is not None else None,
+                "p95 latency (s)": round(health["p95_latency"], 1) if health["p95_latency"] is not None else None,
+                "Retry in (s)": health["retry_in_seconds"],
+            }
+            for model, health in scoreboard.items()
+        ], hide_index=True)
+
+stream_insights = st.checkbox(
+    "📡 Show insights as they arrive",
+    value=True,
+    key="stream_insights",
+    help="Stream the response and render each biomarker, category and supplement insight as soon as it is complete"
+)
+
+bypass_response_cache = st.checkbox(
+    "♻️ Bypass response cache",
+    value=False,
+    key="bypass_response_cache",
+    help="Always call the model, even if an identical request was answered recently"
+)
+
+sectioned_generation = st.checkbox(
+    "⚡ Sectioned parallel generation",
+    value=False,
+    key="sectioned_generation",
+    help="Generate the summary, category insights, biomarker insights (in chunks) and action plan as parallel calls and merge them into one report"
+)
+
+hedge_requests = st.checkbox(
+    "🏁 Hedge slow requests",
+    value=False,
+    key="hedge_requests",
+    help="If the model is slower than usual (past the 90th percentile of its recent latency), also send the request to the next healthy model and keep whichever valid report arrives first. Hedges are capped to a small share of requests. Live insights are not shown for hedged requests."
+)
+
+record_stage_timings = st.checkbox(
+    "⏱️ Record stage timings",
+    value=False,
+    key="record_stage_timings",
+    help="Time each stage of report generation (prompt, token plan, model calls, parsing, validation, rendering) and save it as a Chrome trace and an OTLP-JSON file"
+)
+
 # --- JSON File Viewer ---
 st.markdown("#### JSON File Viewer")
 st.markdown("Upload a JSON file to view its contents in the same interface as the health report results.")
@@ -1164,137 +1139,225 @@ if 'uploaded_json_meta' in st.session_state and uploaded_json_file is None:
             del st.session_state['uploaded_json_meta']
         st.rerun()
 
+# --- Report History ---
+if RESULT_STORE_BACKEND == "sqlite":
+    st.markdown("#### Report History")
+    result_store = get_result_store()
+    stored_users = result_store.users()
+    if stored_users:
+        user_names = [user["user_name"] for user in stored_users]
+        current_name = st.session_state.metadata.get('name')
+        history_user = st.selectbox(
+            "User",
+            user_names,
+            index=user_names.index(current_name) if current_name in user_names else 0,
+            key="history_user"
+        )
+        history = result_store.history(user_name=history_user, limit=50)
+        history_labels = {
+            entry["id"]: f"{entry['generation_date'][:19].replace('T', ' ')} · {entry['ai_model_used']}"
+                         f"{' · ⚠️ escalation' if entry['escalation_needed'] else ''}"
+            for entry in history
+        }
+        selected_report_id = st.selectbox("Stored report", list(history_labels), format_func=history_labels.get, key="history_report")
+        if st.button("📂 Open stored report", key="open_stored_report"):
+            stored = result_store.get(selected_report_id)
+            result_store.mark_viewed(selected_report_id)
+            st.session_state['uploaded_json_report'] = stored["result"]
+            st.session_state['uploaded_json_meta'] = {
+                'filename': stored["report_name"],
+                'size': stored["size"],
+                'original_timestamp': stored["generation_date"],
+                'original_user': stored["user_name"],
+                'original_model': stored["ai_model_used"],
+                'provider': stored["provider"]
+            }
+            st.rerun()
+    else:
+        st.caption("No reports stored yet.")
+    if st.button("📥 Import llm_results/*.json into history", key="import_json_results"):
+        st.session_state['imported_report_count'] = result_store.import_json_files()
+        st.rerun()
+    if 'imported_report_count' in st.session_state:
+        st.success(f"✅ Imported {st.session_state.pop('imported_report_count')} report(s)")
+
 st.markdown("---")  # Separator line
 
+# Deterministic escalation pre-check on the lab values, before any LLM call
+lab_escalation = evaluate_escalation(get_biomarker_table())
+if lab_escalation["escalation_needed"]:
+    with st.expander(f"🚨 Lab pre-check: {len(lab_escalation['reasons'])} escalation finding(s)", expanded=True):
+        for reason in lab_escalation["reasons"]:
+            st.markdown(f"• {reason}")
+        st.caption("These findings come from the lab values alone and will be reflected in the report's escalation flag.")
+
+# Reports are generated by background jobs, so they survive reruns and reconnects
+report_queue = get_job_queue()
+report_trace = None
 if st.button("Generate Personalized Report", key="generate_single"):
-    with st.spinner(f"Creating personalized health insights for {st.session_state.metadata.get('name', 'you')}..."):
-        # Update interaction count
-        st.session_state.user_history["interaction_count"] += 1
-        st.session_state.user_history["last_interaction_date"] = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        personal_details = f"""
-Name: {st.session_state.metadata.get('name', '')}
-Age: {st.session_state.metadata.get('age', '')}
-Gender: {st.session_state.metadata.get('gender', '')}
-Body Weight: {st.session_state.metadata.get('body_weight', '')}
-Height: {st.session_state.metadata.get('height', '')}
-Body Fat%: {st.session_state.metadata.get('body_fat_percentage', '')}
-Waist Circumference: {st.session_state.metadata.get('waist_circumference', '')}
-Diet Type: {st.session_state.metadata.get('diet_type', '')}
-Known Medical Conditions: {st.session_state.metadata.get('known_medical_conditions', '')}
-Open to Supplements: {st.session_state.metadata.get('open_to_supplements', '')}
-Supplements & Medications: {st.session_state.metadata.get('current_supplements_medications', '')}
-Activity Level: {st.session_state.metadata.get('activity_level', '')}
-Competitive Athlete: {st.session_state.metadata.get('competitive_athlete', '')}
-Average Hours of Sleep/Night: {st.session_state.metadata.get('average_sleep_hours', '')}
-Wake Up Time: {st.session_state.metadata.get('wake_up_time', '')}
-Smoker: {st.session_state.metadata.get('smoker', '')}
-Sun Exposure: {st.session_state.metadata.get('sun_exposure', '')}
-Alcohol Intake: {st.session_state.metadata.get('alcohol_intake', '')}
-Caffeine: {st.session_state.metadata.get('caffeine', '')}
-Health Goals: {', '.join(st.session_state.metadata.get('health_goals', []))}
-"""
-        
-        # Build user history context
-        user_history_context = f"""
-Interaction Count: {st.session_state.user_history.get('interaction_count', 0)}
-Previous Reports Generated: {len(st.session_state.user_history.get('previous_reports', []))}
-Preferred Supplements from Past: {', '.join(st.session_state.user_history.get('preferred_supplements', []))}
-Lifestyle Preferences: {', '.join(st.session_state.user_history.get('lifestyle_preferences', []))}
-Nutrition Preferences: {', '.join(st.session_state.user_history.get('nutrition_preferences', []))}
-Last Interaction: {st.session_state.user_history.get('last_interaction_date', 'First time')}
-"""
-        
-        prompt = PROMPT.format(
-            onboarding_questions=st.session_state.user_conversation,
-            personal_details=personal_details,
-            biomarkers_data=st.session_state.biomarkers_data,
-            category_scores=st.session_state.category_scores,
-            recommendations=st.session_state.user_recommendations_text,
-            user_history=user_history_context
-        )
-        # Create user context for personalized LLM call
-        user_context = {
-            "name": st.session_state.metadata.get('name', 'User'),
-            "interaction_count": st.session_state.user_history.get('interaction_count', 1),
-            "preferences_summary": f"Supplements: {', '.join(st.session_state.user_history.get('preferred_supplements', [])[:3])}; Lifestyle: {', '.join(st.session_state.user_history.get('lifestyle_preferences', [])[:3])}; Nutrition: {', '.join(st.session_state.user_history.get('nutrition_preferences', [])[:3])}"
-        }
-        
-        messages = [{"role": "user", "content": prompt}]
-
-        # Show progress indicator
-        with st.spinner(f"🤖 Generating personalized health report using {selected_model}..."):
-            try:
-                # Capture console output to detect fallback usage
-                import io
-                import sys
-                from contextlib import redirect_stdout, redirect_stderr
-
-                captured_output = io.StringIO()
-                with redirect_stdout(captured_output), redirect_stderr(captured_output):
-                    report = call_llm_with_fallback(selected_model, messages, HealthVizorResponse, user_context)
-
-                # Check if fallback was used
-                output_text = captured_output.getvalue()
-                if "fallback model:" in output_text.lower():
-                    # Extract the fallback model name
-                    lines = output_text.split('\n')
-                    for line in lines:
-                        if "Successfully used fallback model:" in line:
-                            fallback_model = line.split(":")[-1].strip()
-                            st.warning(f"🔄 **Note:** Primary model hit rate limits, successfully used fallback model: `{fallback_model}`")
-                            break
-
-                # Convert Pydantic object to dict for better Streamlit session state compatibility
-                if hasattr(report, 'model_dump'):
-                    # Use model_dump for Pydantic v2
-                    st.session_state.report_single = report.model_dump()
-                elif hasattr(report, 'dict'):
-                    # Fallback for older Pydantic versions
-                    st.session_state.report_single = report.dict()
-                else:
-                    # Store as-is if it's already a dict or other type
-                    st.session_state.report_single = report
-
-                # Store report in history
-                st.session_state.user_history["previous_reports"].append({
-                    "timestamp": pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "model_used": selected_model,
-                    "report_summary": str(report)[:200] + "..." if len(str(report)) > 200 else str(report)
-                })
-
-                st.success(f"✨ Personalized analysis complete for {st.session_state.metadata.get('name', 'you')}!")
-            except Exception as e:
-                error_msg = str(e)
-                if "rate limit" in error_msg.lower() or "429" in error_msg or "quota" in error_msg.lower():
-                    if "all available models" in error_msg.lower():
-                        st.error(f"❌ All Models Rate Limited: {error_msg}")
-                        st.warning("⏰ **All models are currently rate limited. Please:**")
-                        st.markdown("""
-                        - **Wait 60 seconds** and try again
-                        - **Try again later** when usage resets
-                        - **Check your API quotas** for each provider
-                        """)
-
-                        # Add retry button with countdown
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            if st.button("🔄 Retry Now", key="retry_rate_limit"):
-                                st.rerun()
-                        with col2:
-                            st.info("💡 **Tip:** Wait 60 seconds for best results")
-                    else:
-                        st.error(f"❌ Rate Limit Reached: {error_msg}")
-                        st.info("🔄 **The system automatically tried fallback models but they were also rate limited.**")
-
-                        # Add retry button
-                        if st.button("🔄 Retry with Fallback Models", key="retry_fallback"):
-                            st.rerun()
-                else:
-                    st.error(f"❌ LLM call failed: {error_msg}")
-                    st.info("💡 **Tip:** Try adjusting your inputs or try again in a few moments.")
+    report_request = ReportRequest(
+        model=selected_model,
+        metadata=st.session_state.metadata,
+        biomarkers=st.session_state.biomarkers_data,
+        onboarding_conversation=st.session_state.user_conversation,
+        category_scores=st.session_state.category_scores,
+        recommendations=st.session_state.user_recommendations_text,
+        sectioned=sectioned_generation,
+        hedge=hedge_requests,
+        stream=stream_insights,
+        bypass_cache=bypass_response_cache,
+        trace=record_stage_timings,
+    )
+    # Clicking again while the same report is generating follows the running job
+    active_report_job = report_queue.active_job(report_job_key(report_request))
+    if active_report_job is not None:
+        st.session_state.report_job_id = active_report_job.id
+        st.info("⏳ This report is already being generated, showing the running job.")
+    else:
+        if record_stage_timings:
+            report_trace = start_trace("generate_report", model=selected_model)
+        with st.spinner(f"Creating personalized health insights for {st.session_state.metadata.get('name', 'you')}..."):
+            # Update interaction count
+            st.session_state.user_history["interaction_count"] += 1
+            st.session_state.user_history["last_interaction_date"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            report_request.user_history = dict(st.session_state.user_history)
+
+            # Build the prompt, check it against the model's limits and queue the job
+            report_job, token_plan = submit_report(report_request, report_queue)
+            if token_plan is not None:
+                st.session_state.report_token_plan = {"plan": token_plan, "note": token_plan["note"]}
+            st.session_state.report_job_id = report_job.id
+
+# After edits to the inputs of the current report, regenerate only the sections that depend on them
+report_inputs = st.session_state.get("report_inputs")
+if st.session_state.get("report_single") and report_inputs:
+    update_request = ReportRequest(
+        model=selected_model,
+        metadata=st.session_state.metadata,
+        biomarkers=st.session_state.biomarkers_data,
+        onboarding_conversation=st.session_state.user_conversation,
+        category_scores=st.session_state.category_scores,
+        recommendations=st.session_state.user_recommendations_text,
+        user_history=dict(st.session_state.user_history),
+        bypass_cache=bypass_response_cache,
+        trace=record_stage_timings,
+    )
+    previous_request = ReportRequest.model_validate(report_inputs)
+    update_plan = plan_report_update(previous_request, st.session_state.report_single, update_request)
+    if not update_plan["unchanged"]:
+        if update_plan["full"]:
+            st.caption(f"♻️ Inputs changed ({'; '.join(update_plan['reasons'][:5])}), the full report has to be regenerated.")
+        else:
+            regenerated = [label for label, wanted in (
+                ("overview", update_plan["overview"]),
+                ("all categories" if update_plan["all_categories"] else ", ".join(update_plan["categories"]),
+                 update_plan["all_categories"] or update_plan["categories"]),
+                (", ".join(update_plan["biomarkers"]), update_plan["biomarkers"]),
+                ("action plan", update_plan["action_plan"]),
+            ) if wanted]
+            st.caption(f"♻️ Inputs changed ({'; '.join(update_plan['reasons'][:5])}). Will regenerate: {'; '.join(regenerated)} "
+                       f"- {update_plan['calls']} section call(s) instead of {update_plan['full_calls']}.")
+        if st.button("♻️ Update report (changed inputs only)", key="update_single"):
+            st.session_state.user_history["interaction_count"] += 1
+            st.session_state.user_history["last_interaction_date"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            update_request.user_history = dict(st.session_state.user_history)
+            report_job, _ = submit_report_update(previous_request, st.session_state.report_single, update_request, report_queue)
+            st.session_state.report_job_id = report_job.id
+
+# Token budget of the latest request
+report_token_plan = st.session_state.get("report_token_plan")
+if report_token_plan:
+    token_plan = report_token_plan["plan"]
+    with st.expander(f"📐 Token budget: ~{token_plan['prompt_tokens']:,} prompt + ~{token_plan['predicted_output_tokens']:,} output tokens"):
+        st.dataframe(token_plan["sections"], hide_index=True)
+    if report_token_plan["note"]:
+        st.info(report_token_plan["note"])
+
+# Follow the background job of this session
+report_job_running = False
+report_job = report_queue.get(st.session_state["report_job_id"]) if st.session_state.get("report_job_id") else None
+if report_job is not None and st.session_state.get("report_job_handled") != report_job.id:
+    report_job_user = report_job.params.get("user_context", {}).get("name", "User")
+    if not report_job.done:
+        report_job_running = True
+        if report_job.status == QUEUED:
+            st.info(f"⏳ Report queued, {report_queue.position(report_job)} job(s) ahead")
+        else:
+            st.info(f"🤖 Generating personalized health report using {report_job.params['model']}... ({report_job.elapsed_seconds:.0f}s)")
+        st.caption("The report keeps generating in the background if you change settings or reload the page.")
+
+        # Insights that arrived before the full report is ready
+        live_items = report_job.items_since(0)
+        if stream_insights and live_items:
+            st.markdown("#### 📡 Live insights")
+            for path, item in live_items:
+                render_streamed_item(path, item, report_job_user)
+    elif report_job.status == SUCCEEDED:
+        st.session_state.report_job_handled = report_job.id
+        notes = report_job.notes
+
+        # Report fallbacks and hedges from the job's LLM events
+        if notes.get("fallback_models"):
+            cause = "hit rate limits" if notes.get("fallback_reasons") == ["rate_limit"] else "was unavailable"
+            st.warning(f"🔄 **Note:** Primary model {cause}, successfully used fallback model: `{'`, `'.join(notes['fallback_models'])}`")
+        if notes.get("hedge_winners"):
+            st.info(f"🏁 **Note:** {report_job.params['model']} was slower than usual, the hedged request to `{'`, `'.join(notes['hedge_winners'])}` answered first")
+        if notes.get("calls"):
+            st.caption(f"🧾 {notes['calls']} model call(s), {notes.get('total_tokens', 0):,} tokens, ${notes.get('cost', 0):.4f}, "
+                       f"{report_job.elapsed_seconds:.0f}s")
+        if notes.get("stage_timings"):
+            with st.expander("⏱️ Report job stage timings"):
+                st.dataframe([
+                    {
+                        "Stage": "  " * row["depth"] + row["stage"],
+                        "Duration (ms)": round(row["duration_ms"], 1),
+                        "Error": row["error"] or "",
+                    }
+                    for row in notes["stage_timings"]
+                ], hide_index=True)
+                st.caption(f"Saved to `{notes['trace_paths']['chrome']}` and `{notes['trace_paths']['otlp']}`")
+
+        st.session_state.report_single = report_job.result
+        st.session_state.report_inputs = report_job.params.get("inputs")
+
+        # Store report in history
+        st.session_state.user_history["previous_reports"].append(history_entry(report_job.params["model"], report_job.result))
+
+        st.success(f"✨ Personalized analysis complete for {report_job_user}!")
+    else:
+        st.session_state.report_job_handled = report_job.id
+        error_msg = report_job.error or "Unknown error"
+        if "rate limit" in error_msg.lower() or "429" in error_msg or "quota" in error_msg.lower():
+            if "all available models" in error_msg.lower():
+                st.error(f"❌ All Models Rate Limited: {error_msg}")
+                st.warning("⏰ **All models are currently rate limited. Please:**")
+                st.markdown("""
+                - **Wait 60 seconds** and try again
+                - **Try again later** when usage resets
+                - **Check your API quotas** for each provider
+                """)
+
+                # Add retry button with countdown
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("🔄 Retry Now", key="retry_rate_limit"):
+                        st.rerun()
+                with col2:
+                    st.info("💡 **Tip:** Wait 60 seconds for best results")
+            else:
+                st.error(f"❌ Rate Limit Reached: {error_msg}")
+                st.info("🔄 **The system automatically tried fallback models but they were also rate limited.**")
+
+                # Add retry button
+                if st.button("🔄 Retry with Fallback Models", key="retry_fallback"):
+                    st.rerun()
+        else:
+            st.error(f"❌ LLM call failed: {error_msg}")
+            st.info("💡 **Tip:** Try adjusting your inputs or try again in a few moments.")
+
 
 # Display the generated report
+render_span = start_span("render_report")
 if st.session_state.get("report_single"):
     report = st.session_state.report_single
     user_name = st.session_state.metadata.get('name', 'User')
@@ -1594,6 +1657,25 @@ if st.session_state.get("report_single"):
                 st.write(f"**Lifestyle Goals:** {len(st.session_state.user_history.get('lifestyle_preferences', []))}")
                 st.write(f"**Nutrition Focus:** {len(st.session_state.user_history.get('nutrition_preferences', []))}")
 
+if render_span is not None:
+    render_span.end()
+if report_trace is not None:
+    report_trace.finish()
+    trace_paths = report_trace.write()
+    with st.expander(f"⏱️ Stage timings: {report_trace.root.duration_ms / 1000:.1f}s end to end"):
+        st.dataframe([
+            {
+                "Stage": "  " * row["depth"] + row["stage"],
+                "Duration (ms)": round(row["duration_ms"], 1),
+                "Error": row["error"] or "",
+            }
+            for row in report_trace.summary()
+        ], hide_index=True)
+        st.caption(f"Saved to `{trace_paths['chrome']}` (open in chrome://tracing or ui.perfetto.dev) and `{trace_paths['otlp']}`")
+        with open(trace_paths["chrome"], 'r', encoding='utf-8') as f:
+            st.download_button("📥 Download Chrome trace", f.read(), file_name=os.path.basename(trace_paths["chrome"]),
+                               mime="application/json", key="download_trace")
+
 # --- Display Uploaded JSON Report ---
 if st.session_state.get("uploaded_json_report"):
     uploaded_report = st.session_state.uploaded_json_report
@@ -2053,3 +2135,7 @@ if st.session_state.get("uploaded_json_report"):
             st.markdown("### 📄 Raw Data")
             st.code(str(uploaded_report), language='json')
 
+# Poll the background report job until it finishes
+if report_job_running:
+    time.sleep(1)
+    st.rerun()
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+from llm_events import HEDGE, emit, note_fallback, note_request
+from provider_health import get_provider_health
+
+logger = logging.getLogger(__name__)
+
+# Fire the hedge once the primary has been running longer than this quantile of its recent latencies
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.9"))
+# Successful calls needed before the observed percentile is trusted; until then HEDGE_DEFAULT_DELAY_SECONDS applies
+HEDGE_MIN_SAMPLES = 5
+HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_SECONDS", "90"))
+HEDGE_MIN_DELAY_SECONDS = 5.0
+
+# Cost cap: on average at most this many hedges per request, with a small burst allowance
+HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))
+HEDGE_BURST = 2.0
+
+class HedgeBudget:
+    """
+    Caps how often hedges may fire.
+
+    Every request earns max_ratio of a hedge credit (up to burst credits);
+    firing a hedge spends one. Over time hedges therefore add at most
+    max_ratio extra provider calls per request.
+    """
+
+    def __init__(self, max_ratio: float = HEDGE_MAX_RATIO, burst: float = HEDGE_BURST):
+        self.max_ratio = max_ratio
+        self.burst = burst
+        self.credits = burst
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self._lock = threading.Lock()
+
+    def on_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.credits = min(self.burst, self.credits + self.max_ratio)
+
+    def try_spend(self) -> bool:
+        """Take one hedge credit if available."""
+        with self._lock:
+            if self.credits < 1:
+                return False
+            self.credits -= 1
+            self.hedges_fired += 1
+            return True
+
+    def record_win(self) -> None:
+        with self._lock:
+            self.hedges_won += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges_fired": self.hedges_fired,
+                "hedges_won": self.hedges_won,
+                "credits": round(self.credits, 2),
+            }
+
+_hedge_budget = HedgeBudget()
+
+def get_hedge_budget() -> HedgeBudget:
+    """Process-wide hedge budget shared by all hedged requests."""
+    return _hedge_budget
+
+def hedge_delay(model_name: str, percentile: float = HEDGE_PERCENTILE) -> float:
+    """Seconds to wait on model_name before hedging: the given percentile of its observed latency."""
+    observed = get_provider_health(model_name).latency_percentile(percentile, HEDGE_MIN_SAMPLES)
+    if observed is None:
+        return HEDGE_DEFAULT_DELAY_SECONDS
+    return max(HEDGE_MIN_DELAY_SECONDS, observed)
+
+async def hedged_race(models: Sequence[str], start: Callable[[str], Awaitable[Any]], delay: float,
+                      is_valid: Callable[[Any], bool] = lambda result: True,
+                      budget: Optional[HedgeBudget] = None,
+                      should_try_next: Callable[[Exception, str, int, int], bool] = lambda error, model, attempt, total: attempt < total - 1,
+                      fallback_reason: Callable[[Exception], str] = lambda error: "error") -> Tuple[str, Any]:
+    """
+    Run start(models[0]), hedging with the next model if it is still running after delay seconds.
+
+    Returns (model, result) for the first result that passes is_valid and
+    cancels the other call. A failed call goes through the same decision as
+    the fallback chain: should_try_next(error, model, attempt, total_models)
+    (see llm_utils._should_try_next_model) decides whether to go on, and if
+    no other call is running the next model in the list is started (a plain
+    fallback, not charged to the budget). An invalid result also moves on to
+    the next model; it is only returned, as the first one that arrived, once
+    no model is left. If every call fails, the last error is raised.
+    """
+    budget = budget or get_hedge_budget()
+    budget.on_request()
+    queue = list(models)
+    primary = queue.pop(0)
+    pending = {asyncio.ensure_future(start(primary)): primary}
+    hedge = None
+    first_invalid = None
+    last_error = None
+
+    def start_next(model: str, reason: str, error: Optional[Exception] = None) -> None:
+        fallback = queue.pop(0)
+        logger.info("🔄 Trying fallback model: %s", fallback)
+        note_fallback(model, fallback, reason, error)
+        pending[asyncio.ensure_future(start(fallback))] = fallback
+
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done and queue and budget.try_spend():
+            hedge = queue.pop(0)
+            logger.info("🏁 %s still running after %.0fs, hedging with %s", primary, delay, hedge)
+            note_request(hedge_fired=True)
+            emit(HEDGE, model=hedge, primary_model=primary, action="fired", delay_seconds=delay)
+            pending[asyncio.ensure_future(start(hedge))] = hedge
+
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                model = pending.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    last_error = e
+                    # Models still running or queued count as the ones left to try
+                    remaining = len(queue) + len(pending)
+                    if not should_try_next(e, model, len(models) - 1 - remaining, len(models)):
+                        if pending:
+                            continue
+                        raise e
+                    if not pending and queue:
+                        start_next(model, fallback_reason(e), e)
+                    continue
+
+                if is_valid(result):
+                    if model == hedge:
+                        budget.record_win()
+                        logger.info("🏁 Hedge won: %s", model)
+                        note_request(hedge_won=True)
+                        emit(HEDGE, model=model, primary_model=primary, action="won")
+                    elif model != primary:
+                        logger.info("✅ Successfully used fallback model: %s", model)
+                    return model, result
+                if first_invalid is None:
+                    first_invalid = (model, result)
+                if pending:
+                    logger.warning("⚠️ %s returned a response that failed validation, waiting for the other call", model)
+                elif queue:
+                    logger.warning("⚠️ %s returned a response that failed validation, trying the next model", model)
+                    start_next(model, "invalid_response")
+
+        if first_invalid is not None:
+            return first_invalid
+        raise last_error if last_error else Exception("All models failed")
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
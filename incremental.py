@@ -0,0 +1,303 @@
+"""
+Incremental report regeneration.
+
+When a user edits one biomarker or one onboarding answer, most of the
+previous report still holds. plan_incremental() maps each changed input
+field to the report sections that depend on it, and regenerate_report()
+regenerates only those sections (as sectioned calls, see report_sections)
+and merges them into the previous report:
+
+    biomarker value       that BiomarkerInsight, the CategoryInsight of each of its
+                          categories and the overview (top priorities, snapshot, ...)
+    biomarker flag        as above, plus the action plan
+    biomarker added       as above; a removed biomarker also drops its insight
+    category score line   that CategoryInsight and the overview
+    metadata field        see METADATA_DEPENDENCIES
+    conversation          overview, every CategoryInsight and the action plan
+    recommendations       overview and action plan
+
+Unrelated categories and biomarkers are kept as they were. The merged
+report goes through the same whole-report validations (escalation,
+timeline, disclaimer) as a freshly generated one.
+"""
+import asyncio
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Type
+
+from pydantic import BaseModel, ValidationError
+
+from biomarkers import BiomarkerTable, parse_biomarkers
+from llm_utils import aclose_async_clients
+from models import HealthVizorResponse
+from report_sections import (
+    DEFAULT_BIOMARKER_CHUNK_SIZE,
+    REPORT_SECTIONS,
+    arun_section_requests,
+    build_section_requests,
+    chunk_biomarker_names,
+    finalize_report,
+    sections_model_name,
+)
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Units of regeneration besides single categories and biomarkers
+OVERVIEW = "overview"
+ALL_CATEGORIES = "categories"
+ACTION_PLAN = "action_plan"
+FULL_REPORT = "full"
+
+# metadata key -> report parts that depend on it (keys not listed regenerate the full report)
+METADATA_DEPENDENCIES = {
+    # Shape every insight: name, demographics and conditions
+    "name": (FULL_REPORT,),
+    "age": (FULL_REPORT,),
+    "gender": (FULL_REPORT,),
+    "known_medical_conditions": (FULL_REPORT,),
+    # Goals are referenced by the overview, every category and the plan
+    "health_goals": (OVERVIEW, ALL_CATEGORIES, ACTION_PLAN),
+    # Lifestyle factors are the categories' behavioral contributors
+    "average_sleep_hours": (OVERVIEW, ALL_CATEGORIES, ACTION_PLAN),
+    "wake_up_time": (OVERVIEW, ALL_CATEGORIES, ACTION_PLAN),
+    "smoker": (OVERVIEW, ALL_CATEGORIES, ACTION_PLAN),
+    "sun_exposure": (OVERVIEW, ALL_CATEGORIES, ACTION_PLAN),
+    "alcohol_intake": (OVERVIEW, ALL_CATEGORIES, ACTION_PLAN),
+    "caffeine": (OVERVIEW, ALL_CATEGORIES, ACTION_PLAN),
+    # Body composition and activity feed the summary and the exercise / nutrition plan
+    "body_weight": (OVERVIEW, ACTION_PLAN),
+    "height": (OVERVIEW, ACTION_PLAN),
+    "body_fat_percentage": (OVERVIEW, ACTION_PLAN),
+    "waist_circumference": (OVERVIEW, ACTION_PLAN),
+    "activity_level": (OVERVIEW, ACTION_PLAN),
+    "competitive_athlete": (OVERVIEW, ACTION_PLAN),
+    # Diet and supplements only change what the plan recommends
+    "diet_type": (ACTION_PLAN,),
+    "open_to_supplements": (ACTION_PLAN,),
+    "current_supplements_medications": (ACTION_PLAN,),
+}
+
+# ReportRequest text fields -> report parts that depend on them
+TEXT_DEPENDENCIES = {
+    "onboarding_conversation": (OVERVIEW, ALL_CATEGORIES, ACTION_PLAN),
+    "recommendations": (OVERVIEW, ACTION_PLAN),
+}
+
+_NON_ALPHANUMERIC = re.compile(r'[^0-9a-z]+')
+
+def insight_key(name: Any) -> str:
+    """Matching key for category / biomarker names: casefolded, without emoji or punctuation."""
+    return _NON_ALPHANUMERIC.sub(' ', str(name or '').casefold()).strip()
+
+def _category_score_lines(text: str) -> Dict[str, str]:
+    """category_scores text as category key -> line ("" key for lines without a "Category:" prefix)."""
+    lines = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        name, sep, _ = line.partition(':')
+        key = insight_key(name) if sep else ""
+        lines[key] = (lines.get(key, "") + "\n" + line.strip()).strip()
+    return lines
+
+def _rows_by_key(table: BiomarkerTable) -> Dict[str, Dict[str, Any]]:
+    return {insight_key(row["name"]): row for row in table.rows()}
+
+def plan_incremental(previous, current, previous_report: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Report sections invalidated by going from the previous to the current ReportRequest.
+
+    Returns a dict with "full" (regenerate everything), "reasons" (one line
+    per change), "overview" / "action_plan" (regenerate those sections),
+    "all_categories", "categories" and "biomarkers" (names to regenerate),
+    "removed_categories" / "removed_biomarkers" (insights to drop) and
+    "unchanged" (nothing to regenerate).
+    """
+    plan = {"full": False, "reasons": [], "overview": False, "action_plan": False, "all_categories": False,
+            "categories": [], "biomarkers": [], "removed_categories": [], "removed_biomarkers": []}
+    categories = {}
+
+    def invalidate(parts, reason):
+        plan["reasons"].append(reason)
+        for part in parts:
+            if part == FULL_REPORT:
+                plan["full"] = True
+            elif part == ALL_CATEGORIES:
+                plan["all_categories"] = True
+            else:
+                plan[part] = True
+
+    def invalidate_categories(names):
+        for name in names:
+            categories.setdefault(insight_key(name), name)
+
+    if previous_report is not None:
+        try:
+            HealthVizorResponse.model_validate(previous_report)
+        except ValidationError:
+            invalidate((FULL_REPORT,), "previous report is incomplete")
+    if previous.model != current.model:
+        invalidate((FULL_REPORT,), f"model changed to {current.model}")
+
+    # Metadata fields
+    for key in sorted(set(previous.metadata) | set(current.metadata)):
+        if previous.metadata.get(key) != current.metadata.get(key):
+            invalidate(METADATA_DEPENDENCIES.get(key, (FULL_REPORT,)), f"{key} changed")
+
+    for field, parts in TEXT_DEPENDENCIES.items():
+        if (getattr(previous, field) or "").strip() != (getattr(current, field) or "").strip():
+            invalidate(parts, f"{field} changed")
+
+    # Category scores, line by line
+    old_scores, new_scores = _category_score_lines(previous.category_scores), _category_score_lines(current.category_scores)
+    changed_scores = [key for key in set(old_scores) | set(new_scores) if old_scores.get(key) != new_scores.get(key)]
+    if "" in changed_scores:
+        invalidate((OVERVIEW, ALL_CATEGORIES), "category scores changed")
+    elif changed_scores:
+        names = [(new_scores.get(key) or old_scores[key]).partition(':')[0].strip() for key in sorted(changed_scores)]
+        invalidate((OVERVIEW,), f"category score changed: {', '.join(names)}")
+        invalidate_categories(names)
+
+    # Biomarkers, row by row
+    old_table, new_table = parse_biomarkers(previous.biomarkers_text()), parse_biomarkers(current.biomarkers_text())
+    if old_table.unparsed != new_table.unparsed:
+        invalidate((FULL_REPORT,), "unparsed biomarker lines changed")
+    old_rows, new_rows = _rows_by_key(old_table), _rows_by_key(new_table)
+    for key, row in new_rows.items():
+        old = old_rows.get(key)
+        if old is None:
+            invalidate((OVERVIEW, ACTION_PLAN), f"{row['name']} added")
+        elif old != row:
+            flag_changed = old["flag"] != row["flag"]
+            invalidate((OVERVIEW, ACTION_PLAN) if flag_changed else (OVERVIEW,),
+                       f"{row['name']} flag {old['flag']} → {row['flag']}" if flag_changed else f"{row['name']} changed")
+            invalidate_categories(old["categories"])
+        else:
+            continue
+        plan["biomarkers"].append(row["name"])
+        invalidate_categories(row["categories"])
+    for key, row in old_rows.items():
+        if key not in new_rows:
+            invalidate((OVERVIEW, ACTION_PLAN), f"{row['name']} removed")
+            plan["removed_biomarkers"].append(row["name"])
+            invalidate_categories(row["categories"])
+
+    # Categories that no longer have a biomarker or a score line are dropped rather than regenerated
+    current_categories = {insight_key(name) for name in new_table.all_categories()} | (set(new_scores) - {""})
+    for key, name in categories.items():
+        (plan["categories"] if key in current_categories else plan["removed_categories"]).append(name)
+
+    every_biomarker = len(plan["biomarkers"]) == len(new_table) and len(new_table) > 0
+    every_category = plan["all_categories"] or len(plan["categories"]) >= len(new_table.all_categories())
+    if every_biomarker and every_category and plan["overview"] and plan["action_plan"]:
+        invalidate((FULL_REPORT,), "every section changed")
+    plan["unchanged"] = not plan["reasons"]
+    return plan
+
+def incremental_section_requests(messages: list, plan: Dict[str, Any],
+                                 chunk_size: int = DEFAULT_BIOMARKER_CHUNK_SIZE) -> List[Dict[str, Any]]:
+    """The section requests that regenerate the parts of the report invalidated in plan."""
+    sections = [section for section, wanted in (
+        (OVERVIEW, plan["overview"]),
+        (ALL_CATEGORIES, plan["all_categories"] or plan["categories"]),
+        ("biomarkers", plan["biomarkers"]),
+        (ACTION_PLAN, plan["action_plan"]),
+    ) if wanted]
+    if not sections:
+        return []
+    category_names = None if plan["all_categories"] else plan["categories"]
+    return build_section_requests(messages, plan["biomarkers"], chunk_size, sections, category_names)
+
+def count_incremental_calls(plan: Dict[str, Any], chunk_size: int = DEFAULT_BIOMARKER_CHUNK_SIZE) -> int:
+    """Section calls regenerate_report() makes for plan."""
+    return (int(plan["overview"]) + int(bool(plan["all_categories"] or plan["categories"])) + int(plan["action_plan"])
+            + len(chunk_biomarker_names(plan["biomarkers"], chunk_size)))
+
+def _merge_insights(previous: List[Dict[str, Any]], regenerated: List[Dict[str, Any]], name_field: str,
+                    requested: List[str], removed: List[str], replace_all: bool = False) -> List[Dict[str, Any]]:
+    """
+    Previous insights with the regenerated ones for the requested names swapped in.
+
+    Insights the model returned for names that were not requested are
+    ignored, a requested one it did not return keeps its previous insight,
+    and removed ones are dropped. New names are appended.
+    """
+    if replace_all:
+        return list(regenerated)
+    wanted = {insight_key(name) for name in requested}
+    replacements = {}
+    for insight in regenerated:
+        key = insight_key(insight.get(name_field))
+        if key in wanted:
+            replacements[key] = insight
+    dropped = {insight_key(name) for name in removed}
+    merged = []
+    for insight in previous:
+        key = insight_key(insight.get(name_field))
+        if key in replacements:
+            merged.append(replacements.pop(key))
+        elif key not in dropped:
+            merged.append(insight)
+    merged.extend(replacements.values())
+    return merged
+
+def merge_incremental(previous_report: Dict[str, Any], section_results: List[Dict[str, Any]],
+                      plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge regenerated section results (see arun_section_requests) into a copy of the previous report."""
+    merged = dict(previous_report)
+    regenerated = {"category_insights": [], "biomarker_insights": []}
+    for item in section_results:
+        result = item["result"]
+        data = result.model_dump() if hasattr(result, 'model_dump') else dict(result)
+        for field in REPORT_SECTIONS[item["section"]]["fields"]:
+            if field not in data:
+                continue
+            if field in regenerated:
+                regenerated[field].extend(data[field] or [])
+            else:
+                merged[field] = data[field]
+
+    merged["category_insights"] = _merge_insights(
+        previous_report.get("category_insights") or [], regenerated["category_insights"], "category_name",
+        plan["categories"], plan["removed_categories"], replace_all=plan["all_categories"])
+    merged["biomarker_insights"] = _merge_insights(
+        previous_report.get("biomarker_insights") or [], regenerated["biomarker_insights"], "biomarker_name",
+        plan["biomarkers"], plan["removed_biomarkers"])
+    return merged
+
+async def aregenerate_report(model_name: str, messages: list, previous_report: Dict[str, Any], plan: Dict[str, Any],
+                             response_format: Type[BaseModel] = HealthVizorResponse, user_context=None,
+                             chunk_size: int = DEFAULT_BIOMARKER_CHUNK_SIZE,
+                             on_section: Optional[Callable[[str, Any], None]] = None) -> BaseModel:
+    """
+    Regenerate the sections of previous_report invalidated in plan (see plan_incremental) and merge them in.
+
+    messages are the report messages built from the current inputs. The plan
+    must not be "full"; callers generate a fresh report in that case.
+    """
+    if plan["full"]:
+        raise ValueError("plan_incremental() asked for a full regeneration")
+    requests = incremental_section_requests(messages, plan, chunk_size)
+    logger.info("♻️ Incremental regeneration: %s section call(s) with %s (%s)", len(requests), model_name,
+                "; ".join(plan["reasons"]) or "no changes")
+    outcomes = await arun_section_requests(model_name, requests, response_format, user_context, on_section)
+
+    with span("merge_incremental", sections=len(outcomes)):
+        merged = merge_incremental(previous_report, outcomes, plan)
+
+    return finalize_report(merged, sections_model_name(model_name, outcomes), response_format, user_context)
+
+def regenerate_report(model_name: str, messages: list, previous_report: Dict[str, Any], plan: Dict[str, Any],
+                      response_format: Type[BaseModel] = HealthVizorResponse, user_context=None,
+                      chunk_size: int = DEFAULT_BIOMARKER_CHUNK_SIZE,
+                      on_section: Optional[Callable[[str, Any], None]] = None) -> BaseModel:
+    """Blocking wrapper around aregenerate_report for sync callers (e.g. the report job workers)."""
+    async def run():
+        try:
+            return await aregenerate_report(model_name, messages, previous_report, plan, response_format,
+                                            user_context, chunk_size, on_section)
+        finally:
+            await aclose_async_clients()
+
+    return asyncio.run(run())
@@ -0,0 +1,145 @@
+import bisect
+import json
+import re
+from typing import Any, Iterable, List, Tuple
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+class IncrementalJSONParser:
+    """
+    Incremental JSON scanner for streamed LLM output.
+
+    Text is fed in arbitrary chunks as it arrives. The scanner tracks nesting
+    and the key path of every open container, and as soon as an object or array
+    at one of the watched paths is closed it is decoded and returned. Paths use
+    dotted keys with "[]" for array items, e.g. "biomarker_insights[]" or
+    "action_plan.supplements[]".
+
+    Anything before the first "{" or "[" (markdown fences, prose) is skipped.
+    Each character is scanned once, so total work is linear in the response size.
+    """
+
+    def __init__(self, watch_paths: Iterable[str]):
+        self._watch = {self._path_key(path): path for path in watch_paths}
+        self._chunks = []
+        self._chunk_offsets = []
+        self._length = 0
+        self._stack = []
+        self._started = False
+        self._done = False
+        self._in_string = False
+        self._escape = False
+        self._string_is_key = False
+        self._string_start = 0
+
+    @staticmethod
+    def _path_key(path: str) -> Tuple[str, ...]:
+        """Convert "a.b[]" into the internal path tuple ("a", "b", "[]")."""
+        parts = []
+        for part in path.split('.'):
+            depth = 0
+            while part.endswith('[]'):
+                part = part[:-2]
+                depth += 1
+            if part:
+                parts.append(part)
+            parts.extend(['[]'] * depth)
+        return tuple(parts)
+
+    @property
+    def done(self) -> bool:
+        """True once the top-level JSON value has been closed."""
+        return self._done
+
+    @property
+    def text(self) -> str:
+        """All text fed so far."""
+        return ''.join(self._chunks)
+
+    def _slice(self, start: int, end: int) -> str:
+        """Return text[start:end] across the stored chunks without joining the whole buffer."""
+        index = bisect.bisect_right(self._chunk_offsets, start) - 1
+        parts = []
+        while index < len(self._chunks) and self._chunk_offsets[index] < end:
+            offset = self._chunk_offsets[index]
+            chunk = self._chunks[index]
+            parts.append(chunk[max(0, start - offset):end - offset])
+            index += 1
+        return ''.join(parts)
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Feed the next chunk of text and return (path, value) for every watched value completed by it."""
+        if not chunk:
+            return []
+        base = self._length
+        self._chunks.append(chunk)
+        self._chunk_offsets.append(base)
+        self._length += len(chunk)
+        completed = []
+        pos = 0
+        end = len(chunk)
+
+        while pos < end and not self._done:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    pos += 1
+                    continue
+                match = _STRING_SPECIAL.search(chunk, pos)
+                if match is None:
+                    break
+                pos = match.start()
+                if chunk[pos] == '\\':
+                    self._escape = True
+                else:
+                    self._in_string = False
+                    if self._string_is_key:
+                        key_text = self._slice(self._string_start, base + pos + 1)
+                        try:
+                            self._stack[-1]["key"] = json.loads(key_text, strict=False)
+                        except json.JSONDecodeError:
+                            self._stack[-1]["key"] = key_text[1:-1]
+                pos += 1
+                continue
+
+            char = chunk[pos]
+            if not self._started:
+                if char in '{[':
+                    self._started = True
+                else:
+                    pos += 1
+                    continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = base + pos
+                top = self._stack[-1] if self._stack else None
+                self._string_is_key = bool(top and top["type"] == '{' and top["expect_key"])
+            elif char == ':':
+                if self._stack:
+                    self._stack[-1]["expect_key"] = False
+            elif char == ',':
+                if self._stack and self._stack[-1]["type"] == '{':
+                    self._stack[-1]["expect_key"] = True
+                    self._stack[-1]["key"] = None
+            elif char in '{[':
+                if self._stack:
+                    parent = self._stack[-1]
+                    path = parent["path"] + (('[]',) if parent["type"] == '[' else (parent["key"],))
+                else:
+                    path = ()
+                self._stack.append({"type": char, "path": path, "start": base + pos, "key": None, "expect_key": char == '{'})
+            elif char in '}]':
+                if self._stack:
+                    frame = self._stack.pop()
+                    watched = self._watch.get(frame["path"])
+                    if watched is not None:
+                        try:
+                            completed.append((watched, json.loads(self._slice(frame["start"], base + pos + 1), strict=False)))
+                        except json.JSONDecodeError:
+                            pass
+                    if not self._stack:
+                        self._done = True
+            pos += 1
+
+        return completed
@@ -0,0 +1,403 @@
+import json
+import re
+from typing import Any, Dict, Tuple
+
+# Repairs reported by repair_json
+MARKDOWN_FENCE = "markdown_fence"
+LEADING_TEXT = "leading_text"
+TRAILING_TEXT = "trailing_text"
+TRAILING_COMMA = "trailing_comma"
+MISSING_COMMA = "missing_comma"
+MISSING_COLON = "missing_colon"
+EXTRA_COMMA = "extra_comma"
+UNESCAPED_QUOTE = "unescaped_quote"
+INVALID_ESCAPE = "invalid_escape"
+CONTROL_CHARACTER = "control_character"
+UNQUOTED_KEY = "unquoted_key"
+UNQUOTED_VALUE = "unquoted_value"
+PYTHON_LITERAL = "python_literal"
+SKIPPED_CHARACTER = "skipped_character"
+MISMATCHED_BRACKET = "mismatched_bracket"
+UNCLOSED_OBJECT = "unclosed_object"
+UNCLOSED_ARRAY = "unclosed_array"
+TRUNCATED_STRING = "truncated_string"
+TRUNCATED_VALUE = "truncated_value"
+
+# Repairs that mean the response was cut off before the JSON was complete
+TRUNCATION_REPAIRS = {UNCLOSED_OBJECT, UNCLOSED_ARRAY, TRUNCATED_STRING, TRUNCATED_VALUE}
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?')
+_STRING_RUN = re.compile(r'[^"\\\x00-\x1f]*')
+_UNQUOTED_KEY = re.compile(r'([A-Za-z_][\w\-]*)\s*:')
+_UNQUOTED_VALUE = re.compile(r'[^,}\]\n]*')
+_CLOSING_FENCE = re.compile(r'\n[ \t]*```')
+_VALUE_START = set('"{[]}-0123456789tfnTFN')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_LITERALS = (
+    ('true', True, False), ('false', False, False), ('null', None, False),
+    ('True', True, True), ('False', False, True), ('None', None, True),
+)
+_MISSING = object()
+
+_decoder = json.JSONDecoder(strict=False)
+
+def repair_json(content: str) -> Tuple[Any, Dict[str, int]]:
+    """
+    Parse JSON from an LLM response, repairing common defects in a single pass.
+
+    Handles markdown fences and surrounding prose, trailing/missing commas,
+    unescaped quotes inside strings, raw control characters, unbalanced braces
+    and brackets, and responses truncated mid-value. Valid JSON takes the C
+    decoder fast path; anything else goes through a tolerant recursive-descent
+    parser that hands every well-formed subtree back to the C decoder and only
+    walks the broken parts itself.
+
+    Returns (value, repairs) where repairs maps each repair applied to the number
+    of times it was needed (empty for clean JSON). Raises json.JSONDecodeError
+    if the content contains no JSON object or array at all.
+    """
+    start = _find_json_start(content)
+    if start == -1:
+        raise json.JSONDecodeError("No JSON object or array found", content, 0)
+
+    repairs = {}
+    _note_prefix(content[:start], repairs)
+
+    try:
+        try:
+            value, end = _decoder.raw_decode(content, start)
+        except json.JSONDecodeError:
+            parser = _TolerantParser(content[:_json_end(content, start)], start, repairs)
+            value = parser.parse()
+            end = parser.pos
+    except RecursionError:
+        raise json.JSONDecodeError("JSON is nested too deeply", content, start) from None
+
+    _note_suffix(content[end:], repairs)
+    return value, repairs
+
+def was_truncated(repairs: Dict[str, int]) -> bool:
+    """Check whether the repairs indicate the response was cut off."""
+    return any(name in TRUNCATION_REPAIRS for name in repairs)
+
+def _find_json_start(content: str) -> int:
+    brace = content.find('{')
+    bracket = content.find('[')
+    if brace == -1:
+        return bracket
+    if bracket == -1:
+        return brace
+    return min(brace, bracket)
+
+def _json_end(content: str, start: int) -> int:
+    """
+    Where the JSON in a fenced response ends: at the closing fence.
+
+    Once an opening ``` has been seen, a ``` at the start of a line closes the
+    code block, so an unbalanced document stops there instead of taking the
+    fence and any prose after it as data.
+    """
+    if '```' not in content[:start]:
+        return len(content)
+    match = _CLOSING_FENCE.search(content, start)
+    return match.start() if match else len(content)
+
+def _note(repairs: Dict[str, int], name: str) -> None:
+    repairs[name] = repairs.get(name, 0) + 1
+
+def _note_prefix(prefix: str, repairs: Dict[str, int]) -> None:
+    if '```' in prefix:
+        _note(repairs, MARKDOWN_FENCE)
+        prefix = re.sub(r'```[a-zA-Z]*', '', prefix)
+    if prefix.strip():
+        _note(repairs, LEADING_TEXT)
+
+def _note_suffix(suffix: str, repairs: Dict[str, int]) -> None:
+    if '```' in suffix:
+        if MARKDOWN_FENCE not in repairs:
+            _note(repairs, MARKDOWN_FENCE)
+        suffix = suffix.replace('```', '')
+    if suffix.strip():
+        _note(repairs, TRAILING_TEXT)
+
+class _TolerantParser:
+    """Recursive-descent JSON parser that repairs instead of failing."""
+
+    def __init__(self, text: str, start: int, repairs: Dict[str, int]):
+        self.text = text
+        self.pos = start
+        self.end = len(text)
+        self.repairs = repairs
+        self.open_arrays = 0
+        self.open_objects = 0
+        # Text from the last failed fast-path attempt up to here is known to be well-formed
+        self.valid_until = start
+
+    def parse(self) -> Any:
+        value = self._value()
+        return None if value is _MISSING else value
+
+    def _skip_whitespace(self) -> None:
+        self.pos = _WHITESPACE.match(self.text, self.pos).end()
+
+    def _value(self) -> Any:
+        self._skip_whitespace()
+        if self.pos >= self.end:
+            _note(self.repairs, TRUNCATED_VALUE)
+            return _MISSING
+
+        char = self.text[self.pos]
+        if char in '{[':
+            value = self._decode_subtree()
+            if value is not _MISSING:
+                return value
+            return self._object() if char == '{' else self._array()
+        if char == '"':
+            return self._string(is_key=False)
+
+        match = _NUMBER.match(self.text, self.pos)
+        if match and match.end() > self.pos:
+            if match.end() >= self.end:
+                # A number at the very end may have been cut off
+                self.pos = self.end
+                _note(self.repairs, TRUNCATED_VALUE)
+                return _MISSING
+            self.pos = match.end()
+            number = match.group(0)
+            return float(number) if any(c in number for c in '.eE') else int(number)
+
+        for literal, value, is_python in _LITERALS:
+            if self.text.startswith(literal, self.pos):
+                self.pos += len(literal)
+                if is_python:
+                    _note(self.repairs, PYTHON_LITERAL)
+                return value
+            remaining = self.text[self.pos:self.pos + len(literal)]
+            if self.pos + len(remaining) >= self.end and literal.startswith(remaining):
+                self.pos = self.end
+                _note(self.repairs, TRUNCATED_VALUE)
+                return _MISSING
+
+        # Bare text where a value should be: read it up to the next delimiter
+        match = _UNQUOTED_VALUE.match(self.text, self.pos)
+        self.pos = match.end()
+        _note(self.repairs, UNQUOTED_VALUE)
+        return match.group(0).strip()
+
+    def _decode_subtree(self) -> Any:
+        """
+        Decode the container at pos with the C decoder if it is well-formed.
+
+        The decoder runs on the full text from pos (no slicing, so nothing is
+        copied). A failed attempt records the absolute offset of the error in
+        valid_until; a container nested inside the failed one that decodes
+        past that offset is treated as failed too, since its text crosses the
+        known defect. Complete sibling containers are only read once, so a
+        truncated document is parsed in time linear in its size times the
+        nesting depth.
+        """
+        limit = self.valid_until if self.pos < self.valid_until else self.end
+        try:
+            value, end = _decoder.raw_decode(self.text, self.pos)
+        except json.JSONDecodeError as e:
+            self.valid_until = min(limit, e.pos)
+            return _MISSING
+        if end > limit:
+            return _MISSING
+        self.pos = end
+        return value
+
+    def _object(self) -> Dict[str, Any]:
+        self.pos += 1
+        self.open_objects += 1
+        try:
+            return self._object_members({})
+        finally:
+            self.open_objects -= 1
+
+    def _object_members(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        while True:
+            self._skip_whitespace()
+            if self.pos >= self.end:
+                _note(self.repairs, UNCLOSED_OBJECT)
+                return result
+
+            char = self.text[self.pos]
+            if char == '}':
+                self.pos += 1
+                return result
+            if char == ']':
+                return self._mismatched_close(result, self.open_arrays)
+            if char == ',':
+                self.pos += 1
+                _note(self.repairs, EXTRA_COMMA)
+                continue
+
+            if char == '"':
+                key = self._string(is_key=True)
+                if self.pos >= self.end:
+                    # Truncated inside or right after the key: drop the member
+                    _note(self.repairs, UNCLOSED_OBJECT)
+                    return result
+            else:
+                match = _UNQUOTED_KEY.match(self.text, self.pos)
+                if not match:
+                    self.pos += 1
+                    _note(self.repairs, SKIPPED_CHARACTER)
+                    continue
+                key = match.group(1)
+                self.pos = match.end() - 1
+                _note(self.repairs, UNQUOTED_KEY)
+
+            self._skip_whitespace()
+            if self.pos < self.end and self.text[self.pos] == ':':
+                self.pos += 1
+            elif self.pos < self.end:
+                _note(self.repairs, MISSING_COLON)
+
+            value = self._value()
+            if value is not _MISSING:
+                result[key] = value
+
+            self._skip_whitespace()
+            if self.pos >= self.end:
+                _note(self.repairs, UNCLOSED_OBJECT)
+                return result
+
+            char = self.text[self.pos]
+            if char == ',':
+                self.pos += 1
+                self._skip_whitespace()
+                if self.pos < self.end and self.text[self.pos] == '}':
+                    _note(self.repairs, TRAILING_COMMA)
+            elif char == '}':
+                self.pos += 1
+                return result
+            elif char == ']':
+                return self._mismatched_close(result, self.open_arrays)
+            else:
+                _note(self.repairs, MISSING_COMMA)
+
+    def _array(self) -> list:
+        self.pos += 1
+        self.open_arrays += 1
+        try:
+            return self._array_items([])
+        finally:
+            self.open_arrays -= 1
+
+    def _array_items(self, result: list) -> list:
+        while True:
+            self._skip_whitespace()
+            if self.pos >= self.end:
+                _note(self.repairs, UNCLOSED_ARRAY)
+                return result
+
+            char = self.text[self.pos]
+            if char == ']':
+                self.pos += 1
+                return result
+            if char == '}':
+                return self._mismatched_close(result, self.open_objects)
+            if char == ',':
+                self.pos += 1
+                _note(self.repairs, EXTRA_COMMA)
+                continue
+
+            value = self._value()
+            if value is not _MISSING:
+                result.append(value)
+
+            self._skip_whitespace()
+            if self.pos >= self.end:
+                _note(self.repairs, UNCLOSED_ARRAY)
+                return result
+
+            char = self.text[self.pos]
+            if char == ',':
+                self.pos += 1
+                self._skip_whitespace()
+                if self.pos < self.end and self.text[self.pos] == ']':
+                    _note(self.repairs, TRAILING_COMMA)
+            elif char == ']':
+                self.pos += 1
+                return result
+            elif char == '}':
+                return self._mismatched_close(result, self.open_objects)
+            else:
+                _note(self.repairs, MISSING_COMMA)
+
+    def _mismatched_close(self, result: Any, enclosing: int) -> Any:
+        """
+        Handle a closer of the wrong kind for the current container.
+
+        If an enclosing container of that kind is open, the current container was
+        never closed and the closer belongs to the parent, so it is left in place.
+        Otherwise it is a typo for the right closer and is consumed.
+        """
+        _note(self.repairs, MISMATCHED_BRACKET)
+        if not enclosing:
+            self.pos += 1
+        return result
+
+    def _string(self, is_key: bool) -> str:
+        text = self.text
+        self.pos += 1
+        parts = []
+        while True:
+            match = _STRING_RUN.match(text, self.pos)
+            parts.append(match.group(0))
+            self.pos = match.end()
+            if self.pos >= self.end:
+                _note(self.repairs, TRUNCATED_STRING)
+                return ''.join(parts)
+
+            char = text[self.pos]
+            if char == '"':
+                self.pos += 1
+                if is_key or self._closes_string(self.pos):
+                    return ''.join(parts)
+                _note(self.repairs, UNESCAPED_QUOTE)
+                parts.append('"')
+            elif char == '\\':
+                if self.pos + 1 >= self.end:
+                    self.pos = self.end
+                    _note(self.repairs, TRUNCATED_STRING)
+                    return ''.join(parts)
+                escape = text[self.pos + 1]
+                if escape in _ESCAPES:
+                    parts.append(_ESCAPES[escape])
+                    self.pos += 2
+                elif escape == 'u' and re.fullmatch(r'[0-9a-fA-F]{4}', text[self.pos + 2:self.pos + 6]):
+                    code = int(text[self.pos + 2:self.pos + 6], 16)
+                    self.pos += 6
+                    if 0xD800 <= code <= 0xDBFF and text.startswith('\\u', self.pos) and re.fullmatch(r'[dD][c-fC-F][0-9a-fA-F]{2}', text[self.pos + 2:self.pos + 6]):
+                        low = int(text[self.pos + 2:self.pos + 6], 16)
+                        code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                        self.pos += 6
+                    parts.append(chr(code))
+                else:
+                    parts.append(escape)
+                    self.pos += 2
+                    _note(self.repairs, INVALID_ESCAPE)
+            else:
+                # Raw control character (usually a newline) inside the string
+                parts.append(char)
+                self.pos += 1
+                _note(self.repairs, CONTROL_CHARACTER)
+
+    def _closes_string(self, after: int) -> bool:
+        """Decide whether the quote just before `after` ends the string or is an unescaped inner quote."""
+        text = self.text
+        position = _WHITESPACE.match(text, after).end()
+        if position >= self.end:
+            return True
+        char = text[position]
+        if char in ':}]':
+            return True
+        if char == ',':
+            position = _WHITESPACE.match(text, position + 1).end()
+            return position >= self.end or text[position] in _VALUE_START
+        # Another quote after whitespace is most likely the next key with a missing comma
+        return char == '"' and position > after
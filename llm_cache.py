@@ -0,0 +1,163 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+# Cache location and limits (override via environment)
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(".llm_cache", "responses.sqlite3"))
+CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "500"))
+CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+CACHE_DISABLED = os.getenv("LLM_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+
+_bypass = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+@contextlib.contextmanager
+def cache_bypass(enabled: bool = True):
+    """Skip cache lookups (but still store fresh responses) for LLM calls made inside this block."""
+    token = _bypass.set(enabled)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+def is_bypassed() -> bool:
+    """Check whether cache lookups are currently bypassed."""
+    return CACHE_DISABLED or _bypass.get()
+
+def make_cache_key(model_name: str, messages: list, schema_hash: Optional[str] = None, prefix_hash: Optional[str] = None) -> str:
+    """
+    Content-addressed key: SHA-256 over the final message list, model name and response schema hash.
+
+    If prefix_hash is given, the first message is a static prompt prefix
+    (plus the schema instruction, which schema_hash and the model already
+    determine) and is represented by that hash instead of its content.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode('utf-8'))
+    digest.update(b'\0')
+    if prefix_hash is not None:
+        digest.update(prefix_hash.encode('utf-8'))
+        digest.update(b'\0')
+        messages = messages[1:]
+    digest.update(json.dumps(messages, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    digest.update(b'\0')
+    if schema_hash is not None:
+        digest.update(schema_hash.encode('utf-8'))
+    return digest.hexdigest()
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of raw completion content.
+
+    Entries expire after ttl_seconds and the cache is kept within max_entries /
+    max_bytes by evicting the least recently used entries.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, ttl_seconds: int = CACHE_TTL_SECONDS,
+                 max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model_name TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached content for key, or None if missing or expired."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT content, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            content, created_at = row
+            if now - created_at > self.ttl_seconds:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return content
+        finally:
+            conn.close()
+
+    def put(self, key: str, model_name: str, content: str) -> None:
+        """Store content under key and evict expired / least recently used entries."""
+        now = time.time()
+        size = len(content.encode('utf-8'))
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model_name, content, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, content, size, now, now)
+            )
+            self._evict(conn, now)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall():
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            count -= 1
+            total_bytes -= size
+
+    def clear(self) -> None:
+        """Remove every cached entry."""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return entry count and total size of the cache."""
+        conn = self._connect()
+        try:
+            count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        finally:
+            conn.close()
+        return {"entries": count, "bytes": total_bytes, "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+
+_default_cache = None
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
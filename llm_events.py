@@ -0,0 +1,284 @@
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+# Event kinds
+LLM_CALL = "llm_call"            # one provider attempt (or cache hit) for one model
+LLM_REQUEST = "llm_request"      # one request through the fallback / hedging layer
+FALLBACK = "fallback"            # moving from one model to the next within a request
+HEDGE = "hedge"                  # a hedge fired / won
+CIRCUIT = "circuit"              # a circuit breaker changed state
+
+# Optional JSONL event log, enabled by setting a path
+EVENTS_JSONL_PATH = os.getenv("LLM_EVENTS_JSONL")
+
+# Latency histogram buckets (seconds) for the Prometheus sink
+LATENCY_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600)
+
+class LLMEvent:
+    """A structured event: kind, wall-clock timestamp and raw (unformatted) fields."""
+
+    __slots__ = ("kind", "timestamp", "fields")
+
+    def __init__(self, kind: str, fields: Dict[str, Any]):
+        self.kind = kind
+        self.timestamp = time.time()
+        self.fields = fields
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.fields.get(key, default)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "timestamp": self.timestamp, **self.fields}
+
+class MemorySink:
+    """Keeps the most recent events in memory."""
+
+    def __init__(self, max_events: int = 1000):
+        self._events = collections.deque(maxlen=max_events)
+
+    def __call__(self, event: LLMEvent) -> None:
+        self._events.append(event)
+
+    def events(self, kind: Optional[str] = None) -> List[LLMEvent]:
+        return [event for event in self._events if kind is None or event.kind == kind]
+
+    def clear(self) -> None:
+        self._events.clear()
+
+class JSONLSink:
+    """Appends every event as one JSON line to a file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, event: LLMEvent) -> None:
+        line = json.dumps(event.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+class PrometheusSink:
+    """Aggregates call / request events into counters and a latency histogram, rendered in Prometheus text format."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = collections.defaultdict(float)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _inc(self, name: str, labels: Dict[str, Any], value: float = 1.0) -> None:
+        self._counters[(name, tuple(sorted((k, str(v)) for k, v in labels.items())))] += value
+
+    def _observe(self, name: str, labels: Dict[str, Any], value: float) -> None:
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def __call__(self, event: LLMEvent) -> None:
+        fields = event.fields
+        with self._lock:
+            if event.kind == LLM_CALL:
+                labels = {"model": fields.get("model"), "provider": fields.get("provider")}
+                self._inc("llm_calls_total", {**labels, "outcome": fields.get("outcome"), "cache": "hit" if fields.get("cache_hit") else "miss"})
+                if not fields.get("cache_hit") and fields.get("latency_seconds") is not None:
+                    self._observe("llm_call_latency_seconds", labels, fields["latency_seconds"])
+                for kind in ("prompt_tokens", "completion_tokens"):
+                    if fields.get(kind):
+                        self._inc("llm_tokens_total", {**labels, "kind": kind.split('_')[0]}, fields[kind])
+                if fields.get("cost"):
+                    self._inc("llm_cost_usd_total", labels, fields["cost"])
+                if fields.get("repair_strategy"):
+                    self._inc("llm_repairs_total", {"model": fields.get("model"), "strategy": fields["repair_strategy"]})
+            elif event.kind == LLM_REQUEST:
+                self._inc("llm_requests_total", {"model": fields.get("requested_model"), "outcome": fields.get("outcome")})
+            elif event.kind == FALLBACK:
+                self._inc("llm_fallbacks_total", {"from_model": fields.get("from_model"), "to_model": fields.get("to_model"), "reason": fields.get("reason")})
+            elif event.kind == HEDGE:
+                self._inc("llm_hedges_total", {"model": fields.get("model"), "action": fields.get("action")})
+            elif event.kind == CIRCUIT:
+                self._inc("llm_circuit_transitions_total", {"model": fields.get("model"), "state": fields.get("state")})
+
+    def render(self) -> str:
+        """Current metrics in the Prometheus text exposition format."""
+        def label_text(labels):
+            return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels) + "}" if labels else ""
+
+        lines = []
+        with self._lock:
+            by_name = collections.defaultdict(list)
+            for (name, labels), value in sorted(self._counters.items()):
+                by_name[name].append((labels, value))
+            for name, samples in by_name.items():
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(f"{name}{label_text(labels)} {value:g}" for labels, value in samples)
+
+            histograms = collections.defaultdict(list)
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                histograms[name].append((labels, histogram))
+            for name, samples in histograms.items():
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in samples:
+                    for bound, count in zip(self.buckets, histogram["buckets"]):
+                        lines.append(f"{name}_bucket{label_text(labels + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{name}_bucket{label_text(labels + (('le', '+Inf'),))} {histogram['count']}")
+                    lines.append(f"{name}_sum{label_text(labels)} {histogram['sum']:g}")
+                    lines.append(f"{name}_count{label_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+_memory_sink = MemorySink()
+_prometheus_sink = PrometheusSink()
+_SINKS = [_memory_sink, _prometheus_sink]
+if EVENTS_JSONL_PATH:
+    _SINKS.append(JSONLSink(EVENTS_JSONL_PATH))
+
+# Per-context event lists opened with capture_events()
+_captures = contextvars.ContextVar("llm_event_captures", default=())
+
+def add_sink(sink: Callable[[LLMEvent], None]) -> None:
+    """Register a sink; sinks are called synchronously with every event."""
+    _SINKS.append(sink)
+
+def remove_sink(sink: Callable[[LLMEvent], None]) -> None:
+    if sink in _SINKS:
+        _SINKS.remove(sink)
+
+def get_memory_sink() -> MemorySink:
+    return _memory_sink
+
+def render_prometheus() -> str:
+    """Metrics for all events so far, in Prometheus text format."""
+    return _prometheus_sink.render()
+
+def emit(kind: str, **fields: Any) -> LLMEvent:
+    """Publish an event to every sink and to any capture_events() block in this context."""
+    event = LLMEvent(kind, fields)
+    for sink in _SINKS:
+        try:
+            sink(event)
+        except Exception:
+            pass  # a broken sink must never fail an LLM call
+    for captured in _captures.get():
+        captured.append(event)
+    return event
+
+@contextlib.contextmanager
+def capture_events():
+    """Collect the events emitted in this context (including tasks it starts) into the yielded list."""
+    captured = []
+    token = _captures.set(_captures.get() + (captured,))
+    try:
+        yield captured
+    finally:
+        _captures.reset(token)
+
+_current_call = contextvars.ContextVar("llm_current_call", default=None)
+_current_request = contextvars.ContextVar("llm_current_request", default=None)
+
+def annotate_call(**fields: Any) -> None:
+    """Add fields (tokens, cost, repair strategy, ...) to the call record of the current llm_call_scope."""
+    record = _current_call.get()
+    if record is not None:
+        record.update(fields)
+
+def call_annotation(field: str) -> Any:
+    """A field of the current llm_call_scope's record (None outside a call)."""
+    record = _current_call.get()
+    return record.get(field) if record is not None else None
+
+@contextlib.contextmanager
+def llm_call_scope(model: str, provider: Optional[str]):
+    """Time one model call and emit its LLM_CALL record when it ends (outcome "ok" or "error")."""
+    record = {
+        "request_id": (_current_request.get() or {}).get("request_id"),
+        "model": model,
+        "provider": provider,
+        "cache_hit": False,
+        "prompt_tokens": None,
+        "completion_tokens": None,
+        "total_tokens": None,
+        "cost": None,
+        "repair_strategy": None,
+        "repairs": None,
+    }
+    token = _current_call.set(record)
+    started = time.perf_counter()
+    try:
+        yield record
+        record["outcome"] = "ok"
+    except BaseException as e:
+        record["outcome"] = "error" if isinstance(e, Exception) else "cancelled"
+        record["error"] = str(e)[:500]
+        raise
+    finally:
+        _current_call.reset(token)
+        record["latency_seconds"] = time.perf_counter() - started
+        emit(LLM_CALL, **record)
+
+@contextlib.contextmanager
+def llm_request_scope(requested_model: str, mode: str):
+    """
+    Track one request through the fallback layer and emit its LLM_REQUEST record.
+
+    The record lists every model hop, the model that answered ("model_used")
+    and whether a hedge won; mode is e.g. "fallback", "stream" or "hedged".
+    """
+    record = {
+        "request_id": uuid.uuid4().hex,
+        "requested_model": requested_model,
+        "mode": mode,
+        "model_used": None,
+        "hops": [],
+        "hedge_fired": False,
+        "hedge_won": False,
+    }
+    token = _current_request.set(record)
+    started = time.perf_counter()
+    try:
+        yield record
+        record["outcome"] = "ok"
+    except BaseException as e:
+        record["outcome"] = "error" if isinstance(e, Exception) else "cancelled"
+        record["error"] = str(e)[:500]
+        raise
+    finally:
+        _current_request.reset(token)
+        record["latency_seconds"] = time.perf_counter() - started
+        emit(LLM_REQUEST, **record)
+
+def note_fallback(from_model: str, to_model: str, reason: str, error: Optional[Exception] = None) -> None:
+    """Record a move to the next model in the current request and emit a FALLBACK event."""
+    request = _current_request.get()
+    if request is not None:
+        request["hops"].append({"from_model": from_model, "to_model": to_model, "reason": reason})
+    emit(FALLBACK, request_id=request["request_id"] if request else None, from_model=from_model,
+         to_model=to_model, reason=reason, error=str(error)[:500] if error is not None else None)
+
+def note_request(**fields: Any) -> None:
+    """Add fields (model_used, hedge_fired, ...) to the current request record."""
+    request = _current_request.get()
+    if request is not None:
+        request.update(fields)
+
+def current_request_id() -> Optional[str]:
+    request = _current_request.get()
+    return request["request_id"] if request else None
@@ -1,38 +1,110 @@
 import os
 import json
-from typing import Dict, Any, Type, Union
+import asyncio
+import weakref
+from typing import Dict, Any, Callable, Type, Union
 from pydantic import BaseModel
 from datetime import datetime
 import re
-
-from litellm import completion
+import logging
+import time
+
+from biomarkers import BiomarkerTable
+from escalation import apply_escalation
+from incremental_json import IncrementalJSONParser
+from hedging import hedge_delay, hedged_race
+from json_repair import repair_json, was_truncated
+from llm_events import annotate_call, call_annotation, llm_call_scope, llm_request_scope, note_fallback, note_request
+from llm_cache import get_response_cache, is_bypassed, make_cache_key
+from mock_provider import get_mock_provider, stream_chunk_builder as mock_stream_chunk_builder
+from prompt_compiler import static_prefix_hash
+from provider_health import CircuitOpenError, provider_scoreboard, rank_models, track_provider_call
+from rate_limiter import (RATE_LIMIT_MAX_WAIT_SECONDS, RateLimitExceeded, estimate_request_tokens, get_rate_limiter,
+                          record_usage, reservation_scope)
+from response_archive import ARCHIVE_ENABLED, get_response_archive
+from result_store import RESULT_STORE_BACKEND, get_result_store, provider_name
+from schema_registry import compiled_schema
+from token_budget import count_tokens, plan_request, section_token_counts
+from tracing import span
+
+logger = logging.getLogger(__name__)
 
 # Model configurations for different providers
+# rpm / tpm / max_concurrency are client-side budgets enforced by rate_limiter (keep them at or below the provider quotas)
+# context_window / max_output_tokens / reasoning_reserve (completion tokens o-series models spend on reasoning) feed token_budget
 MODEL_CONFIGS = {
     "azure/o1": {
         "api_key": "AZURE_OPENAI_API_KEY",
         "api_base": "AZURE_OPENAI_ENDPOINT",
         "api_version": "AZURE_OPENAI_API_VERSION",
         "deployment_name": "AZURE_OPENAI_DEPLOYMENT_NAME",
-        "provider": "azure"
+        "provider": "azure",
+        "rpm": 50,
+        "tpm": 150000,
+        "max_concurrency": 8,
+        "context_window": 200000,
+        "max_output_tokens": 100000,
+        "reasoning_reserve": 20000
     },
     "azure/o4-mini": {
         "api_key": "AZURE_O4_MINI_API_KEY_NEW",
         "api_base": "AZURE_O4_MINI_ENDPOINT_NEW",
         "api_version": "AZURE_O4_MINI_API_VERSION_NEW",
         "deployment_name": "AZURE_O4_MINI_DEPLOYMENT_NAME_NEW",
-        "provider": "azure"
+        "provider": "azure",
+        "rpm": 30,
+        "tpm": 100000,
+        "max_concurrency": 4,
+        "context_window": 200000,
+        "max_output_tokens": 8192,
+        "reasoning_reserve": 2048
     },
     "openai/o3": {
         "api_key": "OPENAI_O3_API_KEY",
         "api_base": "OPENAI_O3_ENDPOINT",
         "api_version": "OPENAI_O3_API_VERSION",
         "deployment_name": "OPENAI_O3_DEPLOYMENT_NAME",
-        "provider": "openai"
+        "provider": "openai",
+        "rpm": 50,
+        "tpm": 200000,
+        "max_concurrency": 8,
+        "context_window": 200000,
+        "max_output_tokens": 100000,
+        "reasoning_reserve": 20000
     },
     "gemini/gemini-2.0-flash": {
         "api_key": "GEMINI_API_KEY",
-        "provider": "gemini"
+        "provider": "gemini",
+        "rpm": 1000,
+        "tpm": 1000000,
+        "max_concurrency": 16,
+        "context_window": 1048576,
+        "max_output_tokens": 8192,
+        "reasoning_reserve": 0
+    },
+    # Local mock provider (see mock_provider): replays llm_results/ offline, never used as a fallback for real models
+    "mock/replay": {
+        "provider": "mock",
+        "context_window": 200000,
+        "max_output_tokens": 100000,
+        "reasoning_reserve": 0,
+        "mock": {"latency": {"distribution": "lognormal", "median": 8.0, "p95": 20.0}}
+    },
+    "mock/flaky": {
+        "provider": "mock",
+        "rpm": 60,
+        "tpm": 600000,
+        "max_concurrency": 8,
+        "context_window": 200000,
+        "max_output_tokens": 100000,
+        "reasoning_reserve": 0,
+        "mock": {
+            "latency": {"distribution": "lognormal", "median": 12.0, "p95": 45.0},
+            "rate_limit_rate": 0.1,
+            "error_rate": 0.05,
+            "truncate_rate": 0.05,
+            "malformed_rate": 0.1
+        }
     }
 }
 
@@ -48,6 +120,9 @@ def get_model_config(model_name: str) -> Dict[str, str]:
         }
 
     config = MODEL_CONFIGS[model_name]
+    if config["provider"] == "mock":
+        return {"api_key": "mock", "provider": "mock"}
+
     result = {
         "api_key": os.getenv(config["api_key"]),
         "provider": config["provider"]
@@ -67,28 +142,22 @@ def get_model_config(model_name: str) -> Dict[str, str]:
 
     return result
 
-def save_response_to_json(response: Union[Dict[str, Any], BaseModel], model_name: str, user_name: str = "Unknown") -> str:
-    """Save the LLM response to a JSON file with metadata."""
+def save_response_to_json(response: Union[Dict[str, Any], BaseModel], model_name: str, user_name: str = "Unknown",
+                          raw_response: Dict[str, Any] = None) -> str:
+    """Save the LLM response to a JSON file with metadata (and the raw completion, see save_response)."""
     try:
         # Create llm_results directory if it doesn't exist
         os.makedirs("llm_results", exist_ok=True)
 
-        # Generate filename with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Generate filename with timestamp (microseconds, so reports saved in the same second don't collide)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
         # Clean model name for filename
         clean_model_name = re.sub(r'[^\w\-_]', '_', model_name.replace('/', '_'))
         clean_user_name = re.sub(r'[^\w\-_]', '_', user_name.replace(' ', '_'))
         filename = f"llm_results/{timestamp}_{clean_model_name}_{clean_user_name}.json"
 
         # Determine provider from model name
-        if "azure" in model_name:
-            provider = "Azure OpenAI"
-        elif "openai" in model_name:
-            provider = "OpenAI"
-        elif "gemini" in model_name:
-            provider = "Google Gemini"
-        else:
-            provider = "Unknown"
+        provider = provider_name(model_name)
 
         # Convert Pydantic model to dict if needed
         if hasattr(response, 'model_dump'):
@@ -106,18 +175,74 @@ def save_response_to_json(response: Union[Dict[str, Any], BaseModel], model_name
             "provider": provider,
             "result": response_data
         }
+        if raw_response is not None:
+            json_data["raw_response"] = raw_response
 
-        # Save to file
-        with open(filename, 'w', encoding='utf-8') as f:
+        # Save to a temporary file and rename, so readers never see a partial report
+        temp_filename = f"{filename}.tmp"
+        with open(temp_filename, 'w', encoding='utf-8') as f:
             json.dump(json_data, f, indent=2, ensure_ascii=False)
+        os.replace(temp_filename, filename)
 
-        print(f"💾 Response saved to: {filename}")
+        logger.info("💾 Response saved to: %s", filename)
         return filename
 
     except Exception as e:
-        print(f"❌ Failed to save response to JSON: {str(e)}")
+        logger.error("❌ Failed to save response to JSON: %s", e)
         return ""
 
+def save_response(response: Union[Dict[str, Any], BaseModel], model_name: str, user_name: str = "Unknown",
+                  raw_response: Dict[str, Any] = None) -> str:
+    """
+    Save a parsed response with the configured backend (RESULT_STORE_BACKEND).
+
+    "sqlite" (default) inserts it into the indexed result store and returns
+    the report id; "json" writes an llm_results/*.json file and returns its path.
+    With RESPONSE_ARCHIVE enabled the response is also appended to the
+    compressed response archive under the same id (the file name for "json").
+
+    raw_response (see _raw_response) is the completion text the response was
+    parsed from, saved alongside it so replay.py can re-run post-processing.
+    """
+    if hasattr(response, 'model_dump'):
+        response_data = response.model_dump()
+    elif hasattr(response, 'dict'):
+        response_data = response.dict()
+    else:
+        response_data = response
+    if raw_response is not None:
+        # The repair strategy is known only now, after parsing
+        raw_response = {**raw_response, "repair_strategy": call_annotation("repair_strategy")}
+
+    if RESULT_STORE_BACKEND == "json" or not isinstance(response_data, dict):
+        saved = save_response_to_json(response, model_name, user_name, raw_response)
+        report_id = os.path.splitext(os.path.basename(saved))[0]
+    else:
+        try:
+            saved = report_id = get_result_store().save(response_data, model_name, user_name, raw_response=raw_response)
+            logger.info("💾 Response saved to result store: %s", report_id)
+        except Exception as e:
+            logger.error("❌ Failed to save response to result store: %s", e)
+            saved = save_response_to_json(response, model_name, user_name, raw_response)
+            report_id = os.path.splitext(os.path.basename(saved))[0]
+
+    if ARCHIVE_ENABLED and report_id:
+        try:
+            document = {
+                "timestamp": datetime.now().isoformat(),
+                "user_name": user_name,
+                "model_name": model_name,
+                "provider": provider_name(model_name),
+                "result": response_data
+            }
+            if raw_response is not None:
+                document["raw_response"] = raw_response
+            get_response_archive().append(report_id, document, model_name, user_name)
+        except Exception as e:
+            logger.error("❌ Failed to archive response: %s", e)
+
+    return saved
+
 def clean_json_content(content: str) -> str:
     """Clean JSON content by removing markdown formatting and extracting valid JSON."""
     # Remove markdown code blocks
@@ -183,48 +308,33 @@ def fix_gemini_json(content: str) -> str:
     return json_part.strip()
 
 def extract_json_from_gemini_response(content: str) -> dict:
-    """Extract and fix JSON from Gemini response with multiple strategies."""
-    print(f"🔍 Attempting to parse Gemini response (length: {len(content)} chars)")
-    print(f"📝 First 200 chars: {content[:200]}")
-
-    strategies = [
-        # Strategy 1: Direct JSON parsing after basic cleaning
-        lambda c: json.loads(fix_gemini_json(c)),
-
-        # Strategy 2: Find JSON between braces (greedy match)
-        lambda c: json.loads(re.search(r'\{.*\}', c, re.DOTALL).group(0)),
-
-        # Strategy 3: Find JSON between braces (non-greedy match)
-        lambda c: json.loads(re.search(r'\{.*?\}', c, re.DOTALL).group(0)),
-
-        # Strategy 4: Progressive brace matching
-        lambda c: extract_progressive_json(c),
-
-        # Strategy 5: Line-by-line reconstruction
-        lambda c: reconstruct_json_from_lines(c),
-
-        # Strategy 6: Extract from markdown code blocks
-        lambda c: extract_json_from_markdown(c),
-
-        # Strategy 7: Aggressive cleaning and reconstruction
-        lambda c: aggressive_json_reconstruction(c),
-
-        # Strategy 8: Field extraction with required field validation
-        lambda c: extract_with_required_fields(c)
-    ]
+    """
+    Extract and fix JSON from Gemini response in a single pass.
 
-    for i, strategy in enumerate(strategies):
-        try:
-            result = strategy(content)
-            if isinstance(result, dict) and result:
-                print(f"✅ Gemini JSON extracted using strategy {i+1}")
-                return result
-        except Exception as e:
-            print(f"❌ Gemini strategy {i+1} failed: {str(e)}")
-            continue
+    Uses the tolerant parser in json_repair, which handles markdown fences,
+    trailing/missing commas, unbalanced braces, truncated tails and unescaped
+    quotes in one linear scan. If the response was truncated, missing required
+    report fields are filled with defaults.
+    """
+    logger.debug("🔍 Attempting to parse Gemini response (length: %s chars)", len(content))
 
-    print(f"❌ All strategies failed. Raw content:\n{content}")
-    raise json.JSONDecodeError("All JSON extraction strategies failed", content, 0)
+    try:
+        result, repairs = repair_json(content)
+    except json.JSONDecodeError:
+        logger.error("❌ No JSON found in Gemini response. First 200 chars: %s", content[:200])
+        raise
+
+    if not isinstance(result, dict) or not result:
+        raise json.JSONDecodeError("Gemini response did not contain a JSON object", content, 0)
+
+    if repairs:
+        logger.info("🔧 Gemini JSON repaired: %s", repairs)
+        annotate_call(repairs=dict(repairs))
+        if was_truncated(repairs):
+            result = fill_required_report_fields(result)
+    else:
+        logger.debug("✅ Gemini JSON parsed without repairs")
+    return result
 
 def extract_progressive_json(content: str) -> dict:
     """Extract JSON by progressively building valid structure."""
@@ -299,7 +409,7 @@ def extract_json_from_markdown(content: str) -> dict:
 
 def aggressive_json_reconstruction(content: str) -> dict:
     """Aggressively reconstruct JSON from partial or malformed content."""
-    print("🔧 Attempting aggressive JSON reconstruction...")
+    logger.debug("🔧 Attempting aggressive JSON reconstruction...")
 
     # Remove all markdown formatting
     content = re.sub(r'```[a-zA-Z]*\s*\n?', '', content, flags=re.IGNORECASE)
@@ -317,12 +427,12 @@ def aggressive_json_reconstruction(content: str) -> dict:
     open_braces = json_content.count('{')
     close_braces = json_content.count('}')
 
-    print(f"🔧 Found {open_braces} opening braces, {close_braces} closing braces")
+    logger.debug("🔧 Found %s opening braces, %s closing braces", open_braces, close_braces)
 
     # If JSON is incomplete, try to close it properly
     if open_braces > close_braces:
         missing_braces = open_braces - close_braces
-        print(f"🔧 Adding {missing_braces} missing closing braces")
+        logger.debug("🔧 Adding %s missing closing braces", missing_braces)
 
         # Find the last complete field and add closing braces
         # Look for the last complete line that ends with a quote or bracket
@@ -336,7 +446,7 @@ def aggressive_json_reconstruction(content: str) -> dict:
 
             # If line looks incomplete (ends with incomplete field name), stop here
             if line.endswith('"') and ':' not in line:
-                print(f"🔧 Stopping at incomplete field: {line}")
+                logger.debug("🔧 Stopping at incomplete field: %s", line)
                 break
 
             # If line has content, add it
@@ -352,17 +462,17 @@ def aggressive_json_reconstruction(content: str) -> dict:
         # Add missing closing braces
         reconstructed += '\n' + '}' * missing_braces
 
-        print(f"🔧 Reconstructed JSON length: {len(reconstructed)} chars")
+        logger.debug("🔧 Reconstructed JSON length: %s chars", len(reconstructed))
 
         try:
             return json.loads(reconstructed)
         except json.JSONDecodeError as e:
-            print(f"🔧 Reconstruction failed: {str(e)}")
+            logger.debug("🔧 Reconstruction failed: %s", e)
             # Fall back to field extraction
             pass
 
     # Fallback: Extract individual fields
-    print("🔧 Falling back to field extraction...")
+    logger.debug("🔧 Falling back to field extraction...")
     json_parts = {}
 
     # Look for quoted key-value pairs
@@ -396,7 +506,7 @@ def aggressive_json_reconstruction(content: str) -> dict:
         except (ValueError, AttributeError):
             json_parts[key] = {}
 
-    print(f"🔧 Extracted {len(json_parts)} fields: {list(json_parts.keys())[:5]}...")
+    logger.debug("🔧 Extracted %s fields: %s...", len(json_parts), list(json_parts.keys())[:5])
 
     if not json_parts:
         raise json.JSONDecodeError("No JSON structure could be reconstructed", content, 0)
@@ -405,37 +515,41 @@ def aggressive_json_reconstruction(content: str) -> dict:
 
 def extract_with_required_fields(content: str) -> dict:
     """Extract JSON and ensure all required fields are present."""
-    print("🔧 Attempting field extraction with required field validation...")
+    logger.debug("🔧 Attempting field extraction with required field validation...")
 
     # First try direct JSON parsing
     try:
         cleaned_content = fix_gemini_json(content)
         result = json.loads(cleaned_content)
-        print("🔧 Direct JSON parsing successful")
+        logger.debug("🔧 Direct JSON parsing successful")
     except Exception as e:
-        print(f"🔧 Direct parsing failed: {e}")
+        logger.debug("🔧 Direct parsing failed: %s", e)
         # Try to extract JSON from markdown blocks
         try:
             import re
             json_match = re.search(r'```json\s*(\{.*?\})\s*```', content, re.DOTALL)
             if json_match:
                 result = json.loads(json_match.group(1))
-                print("🔧 Markdown JSON extraction successful")
+                logger.debug("🔧 Markdown JSON extraction successful")
             else:
                 # Try to find JSON between braces
                 brace_match = re.search(r'\{.*\}', content, re.DOTALL)
                 if brace_match:
                     result = json.loads(brace_match.group(0))
-                    print("🔧 Brace extraction successful")
+                    logger.debug("🔧 Brace extraction successful")
                 else:
                     raise ValueError("No JSON structure found")
         except Exception as e2:
-            print(f"🔧 All parsing methods failed: {e2}")
+            logger.debug("🔧 All parsing methods failed: %s", e2)
             result = {}
-            print("🔧 Starting with empty result")
+            logger.debug("🔧 Starting with empty result")
+
+    return fill_required_report_fields(result)
 
+def fill_required_report_fields(result: dict) -> dict:
+    """Add defaults for required report fields missing from a partially parsed response."""
     # Ensure action_plan exists
-    if 'action_plan' not in result:
+    if not isinstance(result.get('action_plan'), dict):
         result['action_plan'] = {}
 
     action_plan = result['action_plan']
@@ -548,7 +662,7 @@ def create_minimal_valid_response(schema: dict, raw_content: str, user_name: str
 
 def create_enhanced_fallback_response(schema: dict, raw_content: str, user_name: str) -> dict:
     """Create an enhanced fallback response that extracts more content from partial responses."""
-    print("🔧 Creating enhanced fallback response...")
+    logger.debug("🔧 Creating enhanced fallback response...")
 
     # Start with the minimal response
     response = create_minimal_valid_response(schema, raw_content, user_name)
@@ -620,10 +734,10 @@ def create_enhanced_fallback_response(schema: dict, raw_content: str, user_name:
         if longevity_match:
             response['longevity_performance_impact'] = longevity_match.group(1)
 
-        print(f"🔧 Enhanced fallback extracted additional fields: {len([k for k, v in response.items() if v and not k.startswith('_')])}")
+        logger.debug("🔧 Enhanced fallback extracted additional fields: %s", len([k for k, v in response.items() if v and not k.startswith('_')]))
 
     except Exception as e:
-        print(f"🔧 Enhanced extraction failed: {str(e)}")
+        logger.debug("🔧 Enhanced extraction failed: %s", e)
 
     return response
 
@@ -689,77 +803,16 @@ def validate_and_fix_json_fields(data: dict, schema: dict) -> dict:
     
     return data
 
-def validate_escalation_logic(response_data: Dict[str, Any]) -> Dict[str, Any]:
+def validate_escalation_logic(response_data: Dict[str, Any], biomarker_table=None) -> Dict[str, Any]:
     """
     Validate and correct escalation logic based on biomarker values.
     This ensures consistency in escalation decisions.
-    """
-    if not isinstance(response_data, dict):
-        return response_data
-
-    # Get biomarker insights
-    biomarker_insights = response_data.get('biomarker_insights', [])
 
-    # Check for critical biomarker values that require escalation
-    escalation_needed = False
-    escalation_reasons = []
-
-    for biomarker in biomarker_insights:
-        if isinstance(biomarker, dict):
-            biomarker_name = biomarker.get('biomarker_name', '').lower()
-            current_value = biomarker.get('current_value', '')
-            status = biomarker.get('status', '')
-
-            # Extract numeric value from current_value string
-            try:
-                # Handle different formats like "51.5 ml/min", "1.3 mg/dL", etc.
-                numeric_value = float(''.join(filter(lambda x: x.isdigit() or x == '.', current_value.split()[0])))
-
-                # Check critical thresholds
-                if 'egfr' in biomarker_name and numeric_value < 60:
-                    escalation_needed = True
-                    escalation_reasons.append(f"eGFR {current_value} indicates stage-3+ kidney function; clinician review advised.")
-
-                elif 'creatinine' in biomarker_name and numeric_value > 1.5:
-                    escalation_needed = True
-                    escalation_reasons.append(f"Creatinine {current_value} indicates kidney dysfunction; medical evaluation needed.")
-
-                elif ('alt' in biomarker_name or 'ast' in biomarker_name) and numeric_value > 100:
-                    escalation_needed = True
-                    escalation_reasons.append(f"{biomarker_name.upper()} {current_value} indicates severe liver dysfunction; immediate medical attention required.")
-
-                elif 'hba1c' in biomarker_name and numeric_value > 9.0:
-                    escalation_needed = True
-                    escalation_reasons.append(f"HbA1c {current_value} indicates uncontrolled diabetes; urgent medical review needed.")
-
-                elif 'hemoglobin' in biomarker_name and numeric_value < 8.0:
-                    escalation_needed = True
-                    escalation_reasons.append(f"Hemoglobin {current_value} indicates severe anemia; medical evaluation required.")
-
-            except (ValueError, IndexError):
-                # If we can't parse the value, check status
-                if status.lower() == 'red':
-                    # Count red biomarkers for multiple red flag check
-                    pass
-
-    # Count red biomarkers
-    red_count = sum(1 for biomarker in biomarker_insights
-                   if isinstance(biomarker, dict) and biomarker.get('status', '').lower() == 'red')
-
-    if red_count >= 3:
-        escalation_needed = True
-        escalation_reasons.append(f"Multiple critical biomarkers ({red_count} red flags) require comprehensive medical review.")
-
-    # Update escalation fields if needed
-    if escalation_needed:
-        response_data['escalation_needed'] = True
-        response_data['escalation_reason'] = escalation_reasons[0]  # Use the first/most critical reason
-        print(f"🚨 Escalation triggered: {response_data['escalation_reason']}")
-    else:
-        response_data['escalation_needed'] = False
-        response_data['escalation_reason'] = None
-
-    return response_data
+    The rules live in escalation.ESCALATION_RULES and are evaluated on the
+    parsed lab panel (biomarker_table) when it is available, falling back to
+    the values echoed in the report's biomarker_insights.
+    """
+    return apply_escalation(response_data, biomarker_table)
 
 def validate_six_month_timeline(response_data: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -776,7 +829,7 @@ def validate_six_month_timeline(response_data: Dict[str, Any]) -> Dict[str, Any]
 
     # Check if we have exactly 3 timeline blocks
     if len(timeline) != 3:
-        print(f"⚠️ Timeline validation: Found {len(timeline)} blocks, expected 3. Fixing...")
+        logger.warning("⚠️ Timeline validation: Found %s blocks, expected 3. Fixing...", len(timeline))
 
         # Create the required 3 blocks if missing
         required_blocks = [
@@ -823,7 +876,7 @@ def validate_six_month_timeline(response_data: Dict[str, Any]) -> Dict[str, Any]
 
         action_plan['six_month_timeline'] = timeline
         response_data['action_plan'] = action_plan
-        print(f"✅ Timeline validation: Fixed to include all 3 required blocks")
+        logger.info("✅ Timeline validation: Fixed to include all 3 required blocks")
 
     # Validate that we have the correct month ranges
     expected_ranges = ["Months 0-2", "Months 3-4", "Months 5-6"]
@@ -832,77 +885,538 @@ def validate_six_month_timeline(response_data: Dict[str, Any]) -> Dict[str, Any]
     for i, expected_range in enumerate(expected_ranges):
         if i < len(timeline) and timeline[i].get('month_range') != expected_range:
             timeline[i]['month_range'] = expected_range
-            print(f"✅ Timeline validation: Fixed month_range for block {i+1}")
+            logger.info("✅ Timeline validation: Fixed month_range for block %s", i+1)
 
     return response_data
 
-def call_llm_with_fallback(model_name: str, messages: list, response_format: Type[BaseModel] = None, user_context=None) -> Union[Dict[str, Any], BaseModel]:
+# Report items emitted while a response is still streaming (see call_llm_stream)
+STREAM_ITEM_PATHS = [
+    "category_insights[]",
+    "biomarker_insights[]",
+    "action_plan.supplements[]",
+]
+
+# Connection pool sizing for the async clients (shared by all in-flight requests to one endpoint)
+ASYNC_POOL_LIMITS = {
+    "max_connections": int(os.getenv("LLM_ASYNC_MAX_CONNECTIONS", "64")),
+    "max_keepalive_connections": int(os.getenv("LLM_ASYNC_MAX_KEEPALIVE", "16")),
+}
+
+# Pooled async clients, one per MODEL_CONFIGS entry per event loop
+_ASYNC_CLIENTS = weakref.WeakKeyDictionary()
+
+def get_fallback_models(model_name: str) -> list:
     """
-    Call LLM with automatic fallback to alternative models on rate limits.
+    Return the ordered list of models to try, starting with the requested model.
+
+    Fallbacks are the other MODEL_CONFIGS entries ranked by observed success
+    rate and p95 latency; models whose circuit is open are skipped (see
+    provider_health.rank_models).
+    """
+    return rank_models(model_name, _candidate_models(model_name))
+
+def is_mock_model(model_name: str) -> bool:
+    """Whether a model is served by the local mock provider."""
+    return MODEL_CONFIGS.get(model_name, {}).get("provider") == "mock"
+
+def _candidate_models(model_name: str) -> list:
+    """Configured models a request for model_name may use: mock models only stand in for each other."""
+    return [model for model in MODEL_CONFIGS if is_mock_model(model) == is_mock_model(model_name)]
+
+def _litellm():
+    """
+    Import litellm on first use.
+
+    litellm (with the provider SDKs it loads) is the slowest import in the app,
+    and the UI, CLIs and API only need it once a provider is actually called.
+    """
+    import litellm
+    return litellm
+
+def _provider_functions(config: Dict[str, str]) -> tuple:
+    """(completion, acompletion, stream_chunk_builder) for a model's provider: litellm, or the local mock."""
+    if config["provider"] == "mock":
+        provider = get_mock_provider()
+        return provider.completion, provider.acompletion, mock_stream_chunk_builder
+    litellm = _litellm()
+    return litellm.completion, litellm.acompletion, litellm.stream_chunk_builder
+
+def get_provider_scoreboard() -> Dict[str, Dict[str, Any]]:
+    """Rolling health per configured model: circuit state, success rate and latency percentiles."""
+    return provider_scoreboard(list(MODEL_CONFIGS.keys()))
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Check whether an exception looks like a provider rate limit / quota error."""
+    error_str = str(error).lower()
+    return "rate limit" in error_str or "429" in error_str or "quota" in error_str or "exceeded token rate limit" in error_str
+
+def call_llm_with_fallback(model_name: str, messages: list, response_format: Type[BaseModel] = None, user_context=None, save_result: bool = True) -> Union[Dict[str, Any], BaseModel]:
+    """
+    Call LLM with automatic fallback to alternative models on rate limits and errors.
+
+    Models with an open circuit breaker are skipped without a call, and the
+    fallback order follows each model's recent success rate and latency.
 
     Args:
         model_name: The primary model to use
         messages: List of message dictionaries
         response_format: Optional Pydantic model class for structured responses
         user_context: Optional user context for personalization
+        save_result: Whether to save the parsed response (see save_response)
 
     Returns:
         Either a dict response or a Pydantic model instance
     """
-    # Define fallback models for each provider
-    fallback_models = {
-        "azure/o4-mini": ["openai/o3", "gemini/gemini-2.0-flash-exp"],
-        "azure/gpt-4": ["openai/o3", "gemini/gemini-2.0-flash-exp"],
-        "openai/gpt-4": ["openai/o3", "gemini/gemini-2.0-flash-exp"],
-        "openai/o3": ["gemini/gemini-2.0-flash-exp", "azure/o4-mini"],
-        "gemini/gemini-2.0-flash-exp": ["openai/o3", "azure/o4-mini"],
-        "gemini/gemini-pro": ["openai/o3", "azure/o4-mini"]
-    }
+    return _run_with_fallback(
+        model_name,
+        lambda current_model: call_llm(current_model, messages, response_format, user_context, save_result),
+        messages
+    )
+
+def call_llm_stream_with_fallback(model_name: str, messages: list, response_format: Type[BaseModel] = None, user_context=None,
+                                  on_item: Callable[[str, Any], None] = None, save_result: bool = True,
+                                  on_reset: Callable[[], None] = None) -> Union[Dict[str, Any], BaseModel]:
+    """
+    Streaming variant of call_llm_with_fallback (see call_llm_stream).
 
-    models_to_try = [model_name] + fallback_models.get(model_name, ["openai/o3", "gemini/gemini-2.0-flash-exp"])
+    If a model fails after streaming some items and the request moves on to
+    the next model, on_reset() is called before that model starts, so the
+    sink can drop the items of the abandoned answer instead of mixing them
+    with the new one.
+    """
+    delivered = []
+
+    def on_attempt_item(path, item):
+        delivered.append(path)
+        if on_item:
+            on_item(path, item)
+
+    def attempt(current_model):
+        if delivered:
+            logger.info("↩️ Discarding %s streamed items before retrying on %s", len(delivered), current_model)
+            delivered.clear()
+            if on_reset:
+                on_reset()
+        return call_llm_stream(current_model, messages, response_format, user_context, on_attempt_item, save_result)
+
+    return _run_with_fallback(model_name, attempt, messages, mode="stream")
+
+def _run_with_fallback(model_name: str, call: Callable[[str], Any], messages: list, mode: str = "fallback") -> Any:
+    """Run call(model) over the fallback chain for model_name, returning the first successful result."""
+    with llm_request_scope(model_name, mode):
+        estimated_tokens = estimate_request_tokens(messages)
+        models_to_try = _order_by_rate_headroom(get_fallback_models(model_name), estimated_tokens)
+
+        for i, current_model in enumerate(models_to_try):
+            try:
+                if current_model != model_name:  # This is a fallback attempt
+                    logger.info("🔄 Trying fallback model: %s", current_model)
 
-    for i, current_model in enumerate(models_to_try):
-        try:
-            if i > 0:  # This is a fallback attempt
-                print(f"🔄 Trying fallback model: {current_model}")
+                limiter = _rate_limiter(current_model)
+                with span("rate_limit_wait", model=current_model):
+                    reservation = limiter.acquire(estimated_tokens)
+                with reservation_scope(reservation):
+                    result = call(current_model)
 
-            result = call_llm(current_model, messages, response_format, user_context)
+                note_request(model_used=current_model)
+                if current_model != model_name:  # Successfully used fallback
+                    logger.info("✅ Successfully used fallback model: %s", current_model)
 
-            if i > 0:  # Successfully used fallback
-                print(f"✅ Successfully used fallback model: {current_model}")
+                return result
 
-            return result
+            except Exception as e:
+                if not _should_try_next_model(e, current_model, i, len(models_to_try)):
+                    raise e
+                note_fallback(current_model, models_to_try[i + 1], _fallback_reason(e), e)
 
-        except Exception as e:
-            error_str = str(e).lower()
-
-            # Check if this is a rate limit error
-            if "rate limit" in error_str or "429" in error_str or "quota" in error_str or "exceeded token rate limit" in error_str:
-                if i < len(models_to_try) - 1:  # More models to try
-                    print(f"⚠️ Rate limit hit for {current_model}, trying next model...")
-                    continue
-                else:  # No more models to try
-                    raise Exception(f"Rate limit exceeded for all available models. Please try again later.")
-            else:
-                # Non-rate-limit error, try next model if available
-                if i < len(models_to_try) - 1:
-                    print(f"❌ Error with {current_model}: {str(e)}, trying next model...")
-                    continue
-                else:
-                    # Last model failed with non-rate-limit error
+        # Should never reach here, but just in case
+        raise Exception("All models failed")
+
+async def acall_llm_with_fallback(model_name: str, messages: list, response_format: Type[BaseModel] = None, user_context=None, save_result: bool = True) -> Union[Dict[str, Any], BaseModel]:
+    """
+    Async variant of call_llm_with_fallback built on acall_llm.
+
+    Uses the same fallback chain and rate-limit handling, but never blocks a
+    thread while the provider is generating.
+    """
+    with llm_request_scope(model_name, "async"):
+        estimated_tokens = estimate_request_tokens(messages)
+        models_to_try = _order_by_rate_headroom(get_fallback_models(model_name), estimated_tokens)
+
+        for i, current_model in enumerate(models_to_try):
+            try:
+                if current_model != model_name:  # This is a fallback attempt
+                    logger.info("🔄 Trying fallback model: %s", current_model)
+
+                limiter = _rate_limiter(current_model)
+                with span("rate_limit_wait", model=current_model):
+                    reservation = await limiter.aacquire(estimated_tokens)
+                with reservation_scope(reservation):
+                    result = await acall_llm(current_model, messages, response_format, user_context, save_result)
+
+                note_request(model_used=current_model)
+                if current_model != model_name:  # Successfully used fallback
+                    logger.info("✅ Successfully used fallback model: %s", current_model)
+
+                return result
+
+            except Exception as e:
+                if not _should_try_next_model(e, current_model, i, len(models_to_try)):
                     raise e
+                note_fallback(current_model, models_to_try[i + 1], _fallback_reason(e), e)
+
+        # Should never reach here, but just in case
+        raise Exception("All models failed")
+
+async def acall_llm_hedged(model_name: str, messages: list, response_format: Type[BaseModel] = None, user_context=None, save_result: bool = True) -> Union[Dict[str, Any], BaseModel]:
+    """
+    Async call that hedges against tail latency.
+
+    If model_name has not answered within its hedge delay (a percentile of
+    its observed latency, see hedging.hedge_delay), the same request is also
+    sent to the next healthy fallback model; the first valid response wins and
+    the other call is cancelled. Hedges are capped by the shared HedgeBudget.
+    """
+    estimated_tokens = estimate_request_tokens(messages)
+
+    async def attempt(current_model):
+        limiter = _rate_limiter(current_model)
+        with span("rate_limit_wait", model=current_model):
+            reservation = await limiter.aacquire(estimated_tokens)
+        with reservation_scope(reservation):
+            return await acall_llm(current_model, messages, response_format, user_context, save_result)
+
+    def is_valid(result):
+        return response_format is None or isinstance(result, response_format)
+
+    with llm_request_scope(model_name, "hedged"):
+        models_to_try = _order_by_rate_headroom(get_fallback_models(model_name), estimated_tokens)
+        winner, result = await hedged_race(models_to_try, attempt, hedge_delay(models_to_try[0]), is_valid,
+                                           should_try_next=_should_try_next_model, fallback_reason=_fallback_reason)
+        note_request(model_used=winner)
+        return result
+
+def call_llm_hedged(model_name: str, messages: list, response_format: Type[BaseModel] = None, user_context=None, save_result: bool = True) -> Union[Dict[str, Any], BaseModel]:
+    """Blocking wrapper around acall_llm_hedged for sync callers (e.g. Streamlit)."""
+    async def run():
+        try:
+            return await acall_llm_hedged(model_name, messages, response_format, user_context, save_result)
+        finally:
+            await aclose_async_clients()
+
+    return asyncio.run(run())
+
+def get_model_limits() -> Dict[str, Dict[str, Any]]:
+    """Context and output limits per configured model, as used by token_budget."""
+    return {
+        model: {key: config.get(key) for key in ("context_window", "max_output_tokens", "reasoning_reserve")}
+        for model, config in MODEL_CONFIGS.items()
+    }
 
-    # Should never reach here, but just in case
-    raise Exception("All models failed")
+def plan_report_request(model_name: str, messages: list, biomarker_count: int, category_count: int,
+                        response_format: Type[BaseModel] = None, default_chunk_size: int = 12) -> Dict[str, Any]:
+    """
+    Token plan for a report request before dispatch (see token_budget.plan_request).
 
-def call_llm(model_name: str, messages: list, response_format: Type[BaseModel] = None, user_context=None) -> Union[Dict[str, Any], BaseModel]:
+    Accounts for the schema instruction call_llm will add for the model, and
+    includes tokens per prompt section under "sections".
+    """
+    overhead_tokens = 0
+    provider = MODEL_CONFIGS.get(model_name, {}).get("provider", "azure")
+    if response_format and issubclass(response_format, BaseModel):
+        variant = _schema_instruction_variant(model_name, {"provider": provider})
+        overhead_tokens = count_tokens(compiled_schema(response_format).instruction(variant, SCHEMA_INSTRUCTIONS[variant]))
+    candidates = _candidate_models(model_name)
+    model_limits = {model: limits for model, limits in get_model_limits().items() if model in candidates}
+    plan = plan_request(model_name, messages, biomarker_count, category_count, model_limits,
+                        default_chunk_size, overhead_tokens)
+    plan["sections"] = [section for message in messages for section in section_token_counts(message.get("content") or "")]
+    if overhead_tokens:
+        plan["sections"].append({"section": "(schema instruction)", "characters": None, "tokens": overhead_tokens})
+    return plan
+
+def _rate_limiter(model_name: str):
+    """Client-side rate governor for a model (unlimited for models without rpm/tpm config)."""
+    return get_rate_limiter(model_name, MODEL_CONFIGS.get(model_name))
+
+def _order_by_rate_headroom(models_to_try: list, estimated_tokens: int) -> list:
+    """
+    Reroute around models that cannot take the request soon.
+
+    The first model (the requested one) keeps its place while its wait is
+    only client-side capacity refilling within RATE_LIMIT_MAX_WAIT_SECONDS:
+    the request queues on it briefly rather than switching models. It moves
+    back only when it is cooling down after a provider 429 or the wait is
+    longer than that bound. Fallback models that can take the request now
+    keep their order; the others move to the end, soonest available first.
+    """
+    if not models_to_try:
+        return models_to_try
+    first = models_to_try[0]
+    limiter = _rate_limiter(first)
+    first_wait = limiter.wait_time(estimated_tokens)
+    keep_first = limiter.blocked_for() == 0 and first_wait <= RATE_LIMIT_MAX_WAIT_SECONDS
+
+    ready, waiting = [], []
+    for model in models_to_try[1:] if keep_first else models_to_try:
+        wait = first_wait if model == first else _rate_limiter(model).wait_time(estimated_tokens)
+        if wait > 0:
+            waiting.append((wait, model))
+        else:
+            ready.append(model)
+    if not keep_first:
+        logger.info("⏭️ Rerouting around %s (%s)", first,
+                    f"provider cool-down {limiter.blocked_for():.0f}s" if limiter.blocked_for() else f"{first_wait:.1f}s wait")
+    return ([first] if keep_first else []) + ready + [model for _, model in sorted(waiting)]
+
+def get_rate_headroom(model_name: str = None) -> Dict[str, Dict[str, Any]]:
+    """Current client-side rate headroom per configured model (or just model_name)."""
+    models = [model_name] if model_name else list(MODEL_CONFIGS.keys())
+    return {model: _rate_limiter(model).headroom() for model in models}
+
+def _record_rate_usage(model_name: str, response, cache_hit: bool) -> None:
+    """Settle the current rate-limit reservation against the tokens the response actually used."""
+    if cache_hit:
+        record_usage(model_name, 0, made_request=False)
+        return
+    try:
+        usage = response.get("usage") or {}
+        total_tokens = usage.get("total_tokens") if usage else None
+    except Exception:
+        total_tokens = None
+    record_usage(model_name, total_tokens)
+
+def _fallback_reason(error: Exception) -> str:
+    """Short reason code for a fallback hop, for events and metrics."""
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if is_rate_limit_error(error):
+        return "rate_limit"
+    return "error"
+
+def _should_try_next_model(error: Exception, current_model: str, attempt: int, total_models: int) -> bool:
+    """Decide whether to move on to the next fallback model after an error.
+
+    Returns True to continue with the next model, False to re-raise the original
+    error. Raises a dedicated exception when every model has been rate limited.
+    """
+    more_models = attempt < total_models - 1
+
+    # Check if this is a rate limit error
+    if is_rate_limit_error(error):
+        provider_error = error.__cause__ or error
+        if not isinstance(provider_error, RateLimitExceeded):
+            # Provider 429: stop routing requests to this model until it cools down
+            # (the original provider error carries the retry-after hint)
+            _rate_limiter(current_model).note_rate_limited(provider_error)
+        if more_models:
+            logger.warning("⚠️ Rate limit hit for %s, trying next model...", current_model)
+            return True
+        # No more models to try
+        raise Exception(f"Rate limit exceeded for all available models. Please try again later.")
+
+    if isinstance(error, CircuitOpenError):
+        if more_models:
+            logger.warning("⛔ %s, trying next model...", error)
+            return True
+        return False
+
+    # Non-rate-limit error, try next model if available
+    if more_models:
+        logger.error("❌ Error with %s: %s, trying next model...", current_model, error)
+        return True
+
+    # Last model failed with non-rate-limit error
+    return False
+
+def call_llm(model_name: str, messages: list, response_format: Type[BaseModel] = None, user_context=None, save_result: bool = True) -> Union[Dict[str, Any], BaseModel]:
     """
     Calls LLM (Azure OpenAI, Gemini, etc.) and returns the parsed response with enhanced personalization.
     model_name: Model name (e.g. 'azure/o1', 'azure/o4-mini', 'gemini/gemini-2.0-flash')
     messages: list of dicts (role/content)
     response_format: Optional Pydantic model class for structured output
     user_context: Optional dict with user personalization data
+    save_result: Whether to save the parsed response (see save_response)
     """
+    config = _validated_model_config(model_name)
+
+    with llm_call_scope(model_name, config["provider"]), span("call_llm", model=model_name) as call_span:
+        try:
+            with span("build_params"):
+                completion_params = _build_completion_params(model_name, config, messages, response_format, user_context)
+            with span("cache_lookup"):
+                cache_key, response = _cache_lookup(model_name, completion_params, response_format, messages)
+            cache_hit = response is not None
+            annotate_call(cache_hit=cache_hit)
+            if call_span is not None:
+                call_span.set(cache_hit=cache_hit)
+            if not cache_hit:
+                with span("provider_call"), track_provider_call(model_name, ignore=is_rate_limit_error):
+                    response = _provider_functions(config)[0](**completion_params)
+            _record_rate_usage(model_name, response, cache_hit)
+            with span("process_response"):
+                result = _process_completion_response(response, model_name, config, response_format, user_context, save_result)
+            if not cache_hit:
+                with span("cache_store"):
+                    _cache_store(cache_key, model_name, response, result)
+            return result
+        except Exception as e:
+            _raise_llm_error(model_name, e)
+
+def call_llm_stream(model_name: str, messages: list, response_format: Type[BaseModel] = None, user_context=None,
+                    on_item: Callable[[str, Any], None] = None, save_result: bool = True) -> Union[Dict[str, Any], BaseModel]:
+    """
+    Streaming variant of call_llm.
+
+    Tokens are fed into an IncrementalJSONParser as they arrive, and
+    on_item(path, obj) is called for every completed object at one of
+    STREAM_ITEM_PATHS (e.g. each BiomarkerInsight) long before the full
+    response is done. Once the stream ends, the chunks are assembled into a
+    regular response and go through the same parsing and validation as call_llm.
+    """
+    config = _validated_model_config(model_name)
+
+    with llm_call_scope(model_name, config["provider"]), span("call_llm", model=model_name) as call_span:
+        try:
+            with span("build_params"):
+                completion_params = _build_completion_params(model_name, config, messages, response_format, user_context)
+            parser = IncrementalJSONParser(STREAM_ITEM_PATHS)
+
+            with span("cache_lookup"):
+                cache_key, response = _cache_lookup(model_name, completion_params, response_format, messages)
+            cache_hit = response is not None
+            annotate_call(cache_hit=cache_hit)
+            if call_span is not None:
+                call_span.set(cache_hit=cache_hit)
+            if cache_hit:
+                # Replay the cached content through the parser so items still render progressively
+                for path, item in parser.feed(response["choices"][0]["message"]["content"]):
+                    if on_item:
+                        on_item(path, item)
+            else:
+                completion_params["stream"] = True
+                if config["provider"] in ["azure", "openai"]:
+                    completion_params["stream_options"] = {"include_usage": True}
+
+                chunks = []
+                with span("provider_call", stream=True) as provider_span, track_provider_call(model_name, ignore=is_rate_limit_error):
+                    for chunk in _provider_functions(config)[0](**completion_params):
+                        if not chunks and provider_span is not None:
+                            provider_span.set(time_to_first_chunk_ms=round((time.time_ns() - provider_span.start_ns) / 1e6, 1))
+                        chunks.append(chunk)
+                        for path, item in parser.feed(_stream_chunk_text(chunk)):
+                            if on_item:
+                                on_item(path, item)
+
+                logger.info("📡 Stream finished: %s chunks received", len(chunks))
+                response = _provider_functions(config)[2](chunks, messages=completion_params["messages"])
+
+            _record_rate_usage(model_name, response, cache_hit)
+            with span("process_response"):
+                result = _process_completion_response(response, model_name, config, response_format, user_context, save_result)
+            if not cache_hit:
+                with span("cache_store"):
+                    _cache_store(cache_key, model_name, response, result)
+            return result
+        except Exception as e:
+            _raise_llm_error(model_name, e)
+
+def _stream_chunk_text(chunk) -> str:
+    """Get the content delta from a streamed completion chunk."""
+    choices = chunk["choices"] if isinstance(chunk, dict) else getattr(chunk, "choices", None)
+    if not choices:
+        return ""
+    delta = choices[0]["delta"] if isinstance(choices[0], dict) else getattr(choices[0], "delta", None)
+    if delta is None:
+        return ""
+    content = delta.get("content") if isinstance(delta, dict) else getattr(delta, "content", None)
+    return content or ""
+
+async def acall_llm(model_name: str, messages: list, response_format: Type[BaseModel] = None, user_context=None, save_result: bool = True) -> Union[Dict[str, Any], BaseModel]:
+    """
+    Async variant of call_llm built on litellm.acompletion.
+
+    Requests to Azure/OpenAI endpoints go through a pooled HTTP client per
+    MODEL_CONFIGS entry (see get_async_client), so many report generations can
+    be in flight from a single event loop. Prompting, parsing and validation
+    are identical to call_llm.
+    """
+    config = _validated_model_config(model_name)
+
+    with llm_call_scope(model_name, config["provider"]), span("call_llm", model=model_name) as call_span:
+        try:
+            with span("build_params"):
+                completion_params = _build_completion_params(model_name, config, messages, response_format, user_context)
+            with span("cache_lookup"):
+                cache_key, response = _cache_lookup(model_name, completion_params, response_format, messages)
+            cache_hit = response is not None
+            annotate_call(cache_hit=cache_hit)
+            if call_span is not None:
+                call_span.set(cache_hit=cache_hit)
+            if not cache_hit:
+                client = get_async_client(model_name, config)
+                if client is not None:
+                    completion_params["client"] = client
+                with span("provider_call"), track_provider_call(model_name, ignore=is_rate_limit_error):
+                    response = await _provider_functions(config)[1](**completion_params)
+            _record_rate_usage(model_name, response, cache_hit)
+            with span("process_response"):
+                result = _process_completion_response(response, model_name, config, response_format, user_context, save_result)
+            if not cache_hit:
+                with span("cache_store"):
+                    _cache_store(cache_key, model_name, response, result)
+            return result
+        except Exception as e:
+            _raise_llm_error(model_name, e)
+
+def get_async_client(model_name: str, config: Dict[str, str] = None):
+    """
+    Return the pooled async client for a model's endpoint on the running event loop.
+
+    One client (with its own httpx connection pool) is created per MODEL_CONFIGS
+    entry per event loop and reused by every request to that endpoint. Returns
+    None for providers where litellm manages its own pooled async handler (Gemini).
+    """
+    config = config or get_model_config(model_name)
+    if config["provider"] not in ["azure", "openai"]:
+        return None
+
+    loop = asyncio.get_running_loop()
+    loop_clients = _ASYNC_CLIENTS.setdefault(loop, {})
+    client = loop_clients.get(model_name)
+    if client is None:
+        import httpx
+        from openai import AsyncAzureOpenAI, AsyncOpenAI
+
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(**ASYNC_POOL_LIMITS),
+            timeout=httpx.Timeout(600.0, connect=10.0)
+        )
+        if config["provider"] == "azure":
+            client = AsyncAzureOpenAI(
+                api_key=config["api_key"],
+                azure_endpoint=config["api_base"],
+                api_version=config["api_version"],
+                http_client=http_client
+            )
+        else:
+            client = AsyncOpenAI(
+                api_key=config["api_key"],
+                base_url=config["api_base"],
+                http_client=http_client
+            )
+        loop_clients[model_name] = client
+        logger.info("🔌 Created pooled async client for %s", model_name)
+    return client
+
+async def aclose_async_clients() -> None:
+    """Close the pooled async clients bound to the running event loop."""
+    loop_clients = _ASYNC_CLIENTS.pop(asyncio.get_running_loop(), {})
+    for client in loop_clients.values():
+        await client.close()
+
+def _validated_model_config(model_name: str) -> Dict[str, str]:
+    """Get the model configuration and check that credentials are present."""
     # Get model-specific configuration
     config = get_model_config(model_name)
 
@@ -913,70 +1427,11 @@ def call_llm(model_name: str, messages: list, response_format: Type[BaseModel] =
     # Azure and OpenAI models need endpoint validation
     if config["provider"] in ["azure", "openai"] and not config.get("api_base"):
         raise EnvironmentError(f"API endpoint for model {model_name} must be set in environment.")
-    
-    # Add personalization system message if user context is provided
-    if user_context:
-        personalization_prompt = f"""
-PERSONALIZATION CONTEXT: You are responding to {user_context.get('name', 'this user')}. 
-Communication Style: {user_context.get('communication_style', 'encouraging')}
-Focus Areas: {', '.join(user_context.get('focus_areas', []))}
-Interaction #: {user_context.get('interaction_count', 1)}
-Previous Preferences: {user_context.get('preferences_summary', 'None yet')}
-
-Remember to use their name frequently and make every response feel personally crafted for them.
-"""
-        # Insert system message at the beginning
-        personalized_messages = [{"role": "system", "content": personalization_prompt}] + messages
-    else:
-        personalized_messages = messages
-    
-    try:
-        # Configure model-specific parameters
-        # O-Series models (O1, O3, O4) only support temperature=1
-        if "o_series" in model_name or "o4-mini" in model_name or "o1" in model_name or "o3" in model_name:
-            temperature = 1.0
-        else:
-            temperature = 0.7 if user_context else 0.5  # Slightly more creative for personalized responses
 
-        completion_params = {
-            "model": model_name,
-            "messages": personalized_messages,
-            "temperature": temperature
-        }
+    return config
 
-        # Add provider-specific parameters
-        if config["provider"] == "azure":
-            completion_params.update({
-                "api_key": config["api_key"],
-                "api_base": config["api_base"],
-                "api_version": config["api_version"]
-            })
-            # Add max_tokens for o4-mini to ensure complete responses
-            if "o4-mini" in model_name:
-                completion_params["max_tokens"] = 8192  # Reduced to avoid rate limits
-                # Add rate limiting parameters for Azure
-                completion_params["timeout"] = 120  # Increase timeout
-                completion_params["max_retries"] = 3  # Add retries
-        elif config["provider"] == "openai":
-            completion_params.update({
-                "api_key": config["api_key"],
-                "api_base": config["api_base"],
-                "api_version": config["api_version"]
-            })
-        elif config["provider"] == "gemini":
-            completion_params.update({
-                "api_key": config["api_key"],
-                "max_tokens": 8192  # Increase token limit for complex responses
-            })
-
-        # Add structured output format if Pydantic model is provided
-        if response_format and issubclass(response_format, BaseModel):
-            # Enhanced schema instruction with model-specific formatting
-            schema_json = response_format.model_json_schema()
-            
-            if config["provider"] == "gemini":
-                # Enhanced instruction for Gemini with functional medicine requirements
-                schema_instruction = f"""
+# Schema instruction for Gemini, with functional medicine requirements (no native JSON mode)
+GEMINI_SCHEMA_INSTRUCTION = """
 CRITICAL: You must respond with ONLY valid JSON. No markdown, no code blocks, no explanations.
 
 FUNCTIONAL MEDICINE REQUIREMENTS FOR GEMINI:
@@ -998,7 +1453,7 @@ CONTENT REQUIREMENTS:
 Schema to follow:
 
 Required JSON Schema:
-{json.dumps(schema_json, indent=2)}
+{schema_text}
 
 CRITICAL RULES:
 - All string fields must have actual string values, never null
@@ -1016,8 +1471,9 @@ CRITICAL RULES:
 - Provide complete functional medicine analysis in all fields
 - For optional fields that don't apply, use null (not empty string)
 """
-            elif "o4-mini" in model_name or "o_series" in model_name or "o3" in model_name:
-                schema_instruction = f"""
+
+# Schema instruction for o4-mini / o-series models
+O_SERIES_SCHEMA_INSTRUCTION = """
 You must respond with valid JSON matching this exact schema. All fields marked as required must be included with proper values (no null values for strings).
 
 FUNCTIONAL MEDICINE REQUIREMENTS FOR O4-MINI/O-SERIES:
@@ -1040,7 +1496,7 @@ FUNCTIONAL MEDICINE DEPTH REQUIRED:
 DO NOT leave category_insights or biomarker_insights as empty arrays. Generate comprehensive functional medicine insights for all provided data.
 
 Schema:
-{json.dumps(schema_json, indent=2)}
+{schema_text}
 
 CRITICAL RULES:
 - Every string field must contain comprehensive analysis, never null or generic content
@@ -1057,11 +1513,12 @@ CRITICAL RULES:
 - Use functional medicine principles in all analysis
 - For optional fields that don't apply, use null (not empty string)
 """
-            else:
-                schema_instruction = f"""
+
+# Schema instruction for all other models
+DEFAULT_SCHEMA_INSTRUCTION = """
 Please respond with a valid JSON object that matches this exact schema:
 
-{json.dumps(schema_json, indent=2)}
+{schema_text}
 
 CRITICAL REQUIREMENTS:
 - ALL REQUIRED FIELDS MUST BE PRESENT:
@@ -1073,146 +1530,272 @@ CRITICAL REQUIREMENTS:
 - Do not include any markdown formatting or code blocks - just return the raw JSON
 - For optional fields that don't apply, use null (not empty string)
 """
-            
-            # Append schema instruction to the last user message
-            if personalized_messages and personalized_messages[-1]["role"] == "user":
-                personalized_messages[-1]["content"] += "\n\n" + schema_instruction
-            else:
-                personalized_messages.append({"role": "user", "content": schema_instruction})
 
-            # For Azure OpenAI and OpenAI, we can use JSON mode
-            if config["provider"] in ["azure", "openai"]:
-                completion_params["response_format"] = {"type": "json_object"}
+SCHEMA_INSTRUCTIONS = {
+    "gemini": GEMINI_SCHEMA_INSTRUCTION,
+    "o_series": O_SERIES_SCHEMA_INSTRUCTION,
+    "default": DEFAULT_SCHEMA_INSTRUCTION,
+}
 
-        response = completion(**completion_params)
+def _schema_instruction_variant(model_name: str, config: Dict[str, str]) -> str:
+    """Pick the schema instruction variant for a model."""
+    if config["provider"] == "gemini":
+        return "gemini"
+    if "o4-mini" in model_name or "o_series" in model_name or "o3" in model_name:
+        return "o_series"
+    return "default"
 
-        # Enhanced cost and token usage logging to terminal
-        try:
-            user_name = user_context.get("name", "Unknown") if user_context else "Unknown"
-
-            # Try multiple ways to get cost information
-            cost = 0.0
-            if hasattr(response, '_hidden_params') and response._hidden_params:
-                cost = response._hidden_params.get("response_cost", 0.0)
-            elif hasattr(response, 'response_cost'):
-                cost = response.response_cost
-            elif 'response_cost' in response:
-                cost = response['response_cost']
-
-            # Get usage information
-            usage = response.get("usage", {})
-            prompt_tokens = usage.get("prompt_tokens", 0)
-            completion_tokens = usage.get("completion_tokens", 0)
-            total_tokens = usage.get("total_tokens", 0)
-
-            # If no usage in main response, check for it in other locations
-            if not usage and hasattr(response, '_hidden_params') and response._hidden_params:
-                usage = response._hidden_params.get("usage", {})
-                prompt_tokens = usage.get("prompt_tokens", 0)
-                completion_tokens = usage.get("completion_tokens", 0)
-                total_tokens = usage.get("total_tokens", 0)
-
-            # Calculate cost if not provided (rough estimates)
-            if cost == 0.0 and total_tokens > 0:
-                # Rough cost estimates per 1K tokens (these are approximate)
-                cost_per_1k = {
-                    "azure/o1": 0.015,  # GPT-4 pricing
-                    "azure/o4-mini": 0.0015,  # GPT-4 mini pricing
-                    "openai/o3": 0.015,  # GPT-4 pricing
-                    "gemini/gemini-2.0-flash": 0.001,  # Gemini pricing
-                    "gemini/gemini-2.0-flash-exp": 0.001
-                }
+def _build_completion_params(model_name: str, config: Dict[str, str], messages: list, response_format: Type[BaseModel] = None, user_context=None) -> Dict[str, Any]:
+    """Build the litellm completion parameters, including personalization and schema instructions."""
+    # Copy the messages so retries and fallbacks never see instructions appended by an earlier attempt
+    messages = [dict(message) for message in messages]
+
+    # Add personalization system message if user context is provided
+    if user_context:
+        personalization_prompt = f"""
+PERSONALIZATION CONTEXT: You are responding to {user_context.get('name', 'this user')}. 
+Communication Style: {user_context.get('communication_style', 'encouraging')}
+Focus Areas: {', '.join(user_context.get('focus_areas', []))}
+Interaction #: {user_context.get('interaction_count', 1)}
+Previous Preferences: {user_context.get('preferences_summary', 'None yet')}
+
+Remember to use their name frequently and make every response feel personally crafted for them.
+"""
+        # Insert system message at the beginning, but after a static leading system prompt
+        # (see prompt_compiler) so that prefix stays byte-identical across users
+        position = 1 if messages and messages[0]["role"] == "system" else 0
+        personalized_messages = messages[:position] + [{"role": "system", "content": personalization_prompt}] + messages[position:]
+    else:
+        personalized_messages = messages
+
+    # Configure model-specific parameters
+    # O-Series models (O1, O3, O4) only support temperature=1
+    if "o_series" in model_name or "o4-mini" in model_name or "o1" in model_name or "o3" in model_name:
+        temperature = 1.0
+    else:
+        temperature = 0.7 if user_context else 0.5  # Slightly more creative for personalized responses
 
-                base_model = model_name.lower()
-                for model_key, price in cost_per_1k.items():
-                    if model_key in base_model:
-                        cost = (total_tokens / 1000) * price
-                        break
+    completion_params = {
+        "model": model_name,
+        "messages": personalized_messages,
+        "temperature": temperature
+    }
 
-            # Print directly to terminal (bypassing any output redirection)
-            import sys
-            original_stdout = sys.__stdout__
-            original_stderr = sys.__stderr__
+    # Add provider-specific parameters
+    if config["provider"] == "azure":
+        completion_params.update({
+            "api_key": config["api_key"],
+            "api_base": config["api_base"],
+            "api_version": config["api_version"]
+        })
+        # Add max_tokens for o4-mini to ensure complete responses
+        if "o4-mini" in model_name:
+            completion_params["max_tokens"] = MODEL_CONFIGS[model_name]["max_output_tokens"]  # Reduced to avoid rate limits
+            # Add rate limiting parameters for Azure
+            completion_params["timeout"] = 120  # Increase timeout
+            completion_params["max_retries"] = 3  # Add retries
+    elif config["provider"] == "openai":
+        completion_params.update({
+            "api_key": config["api_key"],
+            "api_base": config["api_base"],
+            "api_version": config["api_version"]
+        })
+    elif config["provider"] == "gemini":
+        completion_params.update({
+            "api_key": config["api_key"],
+            "max_tokens": MODEL_CONFIGS.get(model_name, {}).get("max_output_tokens", 8192)  # Increase token limit for complex responses
+        })
+    elif config["provider"] == "mock":
+        completion_params["mock"] = MODEL_CONFIGS[model_name].get("mock", {})
+
+    # Add structured output format if Pydantic model is provided
+    if response_format and issubclass(response_format, BaseModel):
+        # Schema text and instructions are built once per model class and variant
+        schema = compiled_schema(response_format)
+        variant = _schema_instruction_variant(model_name, config)
+        schema_instruction = schema.instruction(variant, SCHEMA_INSTRUCTIONS[variant])
+
+        # The schema is static too: append it to a leading system prompt when there is one,
+        # otherwise to the last user message
+        if messages and messages[0]["role"] == "system":
+            personalized_messages[0]["content"] += "\n\n" + schema_instruction
+        elif personalized_messages and personalized_messages[-1]["role"] == "user":
+            personalized_messages[-1]["content"] += "\n\n" + schema_instruction
+        else:
+            personalized_messages.append({"role": "user", "content": schema_instruction})
 
-            # Temporarily restore original stdout/stderr to ensure terminal output
-            sys.stdout = original_stdout
-            sys.stderr = original_stderr
+        # For Azure OpenAI and OpenAI, we can use JSON mode
+        if config["provider"] in ["azure", "openai"]:
+            completion_params["response_format"] = {"type": "json_object"}
 
-            print(f"💰 LLM Cost: ${cost:.6f} | Model: {model_name} | User: {user_name}")
-            print(f"📊 Tokens - Input: {prompt_tokens}, Output: {completion_tokens}, Total: {total_tokens}")
+    return completion_params
 
-            # Show cost breakdown if we have input/output token counts
-            if prompt_tokens > 0 and completion_tokens > 0:
-                input_cost = (prompt_tokens / 1000) * 0.001  # Rough estimate
-                output_cost = (completion_tokens / 1000) * 0.002  # Rough estimate
-                print(f"💵 Cost Breakdown - Input: ${input_cost:.6f}, Output: ${output_cost:.6f}")
+def _cache_lookup(model_name: str, completion_params: Dict[str, Any], response_format: Type[BaseModel] = None, messages: list = None):
+    """
+    Look up the final completion request in the response cache.
 
-            print("-" * 80)
+    When messages (the caller's messages) start with the static part of a
+    compiled prompt, the key uses its hash instead of the full leading
+    message, so only the per-request part is hashed.
 
-            # Restore whatever stdout/stderr were set to before
-            sys.stdout = sys.stdout
-            sys.stderr = sys.stderr
+    Returns (cache_key, response) where response is a completion-shaped dict
+    built from the cached content, or None on a miss / bypass.
+    """
+    try:
+        schema_hash = compiled_schema(response_format).schema_hash if response_format and issubclass(response_format, BaseModel) else None
+        cache_key = make_cache_key(model_name, completion_params["messages"], schema_hash, static_prefix_hash(messages))
+        if is_bypassed():
+            return cache_key, None
+        content = get_response_cache().get(cache_key)
+    except Exception as e:
+        logger.warning("⚠️ Response cache lookup failed: %s", e)
+        return None, None
 
-        except Exception as e:
-            # Print directly to terminal (bypassing any output redirection)
-            import sys
-            original_stdout = sys.__stdout__
-            original_stderr = sys.__stderr__
-
-            # Temporarily restore original stdout/stderr to ensure terminal output
-            sys.stdout = original_stdout
-            sys.stderr = original_stderr
-
-            print(f"❌ Failed to log LLM cost: {str(e)}")
-            print(f"🔍 Response type: {type(response)}")
-            print(f"🔍 Response keys: {list(response.keys()) if isinstance(response, dict) else 'Not a dict'}")
-            if hasattr(response, '_hidden_params'):
-                print(f"🔍 Hidden params: {response._hidden_params}")
-
-            # Try to extract any available information for debugging
-            try:
-                if isinstance(response, dict):
-                    usage = response.get("usage", {})
-                    if usage:
-                        print(f"🔍 Found usage info: {usage}")
-
-                    # Check for cost in various locations
-                    for key in response.keys():
-                        if 'cost' in key.lower():
-                            print(f"🔍 Found cost-related key '{key}': {response[key]}")
-
-                # Check all attributes of the response object
-                if hasattr(response, '__dict__'):
-                    for attr in dir(response):
-                        if not attr.startswith('_') and 'cost' in attr.lower():
-                            print(f"🔍 Found cost-related attribute '{attr}': {getattr(response, attr, 'N/A')}")
-                        elif not attr.startswith('_') and 'usage' in attr.lower():
-                            print(f"🔍 Found usage-related attribute '{attr}': {getattr(response, attr, 'N/A')}")
-
-            except Exception as debug_e:
-                print(f"🔍 Debug extraction failed: {debug_e}")
-
-            print("-" * 80)
-
-            # Restore whatever stdout/stderr were set to before
-            sys.stdout = sys.stdout
-            sys.stderr = sys.stderr
-
-        # litellm returns a dict with 'choices', get the content from the first choice
-        content = response["choices"][0]["message"]["content"]
-
-        # Enhanced logging for debugging
-        print(f"🔍 Raw LLM Response from {config['provider']}:")
-        print(f"📏 Content length: {len(content)} characters")
-        print(f"📝 Content preview (first 500 chars):\n{content[:500]}")
+    if content is None:
+        return cache_key, None
+
+    logger.info("⚡ Response cache hit for %s (%s)", model_name, cache_key[:12])
+    return cache_key, {
+        "choices": [{"message": {"role": "assistant", "content": content}}],
+        "usage": {},
+        "response_cost": 0.0
+    }
+
+# Repair strategies that substitute placeholder content for the model's answer
+FALLBACK_REPAIR_STRATEGIES = {"json_fragment", "enhanced_fallback", "minimal_fallback", "text_fallback"}
+
+def _cache_store(cache_key: str, model_name: str, response, result) -> None:
+    """
+    Store a fresh completion in the response cache.
+
+    Completions that could not be parsed, were cut off (finish_reason "length"
+    or truncation repairs) or were replaced by a fallback response are not
+    stored, so the next identical request asks the model again.
+    """
+    if cache_key is None:
+        return
+    if isinstance(result, dict) and result.get('_parsing_error'):
+        return
+    if call_annotation("repair_strategy") in FALLBACK_REPAIR_STRATEGIES or was_truncated(call_annotation("repairs") or {}):
+        logger.info("🚫 Not caching repaired response from %s (%s)", model_name, call_annotation("repair_strategy"))
+        return
+    try:
+        choice = response["choices"][0]
+        if choice.get("finish_reason") == "length":
+            logger.info("🚫 Not caching truncated response from %s", model_name)
+            return
+        content = choice["message"]["content"]
+        if content:
+            get_response_cache().put(cache_key, model_name, content)
+    except Exception as e:
+        logger.warning("⚠️ Response cache store failed: %s", e)
+
+def _raise_llm_error(model_name: str, e: Exception):
+    """Re-raise a failed LLM call with a user-facing message."""
+    if isinstance(e, CircuitOpenError):
+        raise e
+
+    # Handle rate limit errors specifically
+    if is_rate_limit_error(e):
+        error_msg = f"Rate limit exceeded for model {model_name}. Please try again in 60 seconds or switch to a different model (like openai/o3 or gemini/gemini-2.0-flash)."
+        logger.error("❌ Rate Limit Error: %s", error_msg)
+        raise Exception(error_msg) from e
+
+    # Handle other errors
+    raise Exception(f"LLM call failed for model {model_name}: {str(e)}") from e
+
+# Rough cost estimates per 1K tokens, used when litellm does not report a cost
+COST_PER_1K_TOKENS = {
+    "azure/o1": 0.015,  # GPT-4 pricing
+    "azure/o4-mini": 0.0015,  # GPT-4 mini pricing
+    "openai/o3": 0.015,  # GPT-4 pricing
+    "gemini/gemini-2.0-flash": 0.001,  # Gemini pricing
+}
+
+def _log_completion_cost(response, model_name: str, user_context=None) -> None:
+    """Record token usage and cost of a completion on the current call record (see llm_events)."""
+    try:
+        # Try multiple ways to get cost information
+        cost = 0.0
+        hidden_params = getattr(response, '_hidden_params', None)
+        if hidden_params:
+            cost = hidden_params.get("response_cost", 0.0) or 0.0
+        elif hasattr(response, 'response_cost'):
+            cost = response.response_cost
+        elif 'response_cost' in response:
+            cost = response['response_cost']
+
+        # Get usage information, falling back to the hidden params
+        usage = response.get("usage", {}) or {}
+        if not usage and hidden_params:
+            usage = hidden_params.get("usage", {}) or {}
+        prompt_tokens = usage.get("prompt_tokens", 0) or 0
+        completion_tokens = usage.get("completion_tokens", 0) or 0
+        total_tokens = usage.get("total_tokens", 0) or 0
+
+        # Calculate cost if not provided (rough estimates)
+        if cost == 0.0 and total_tokens > 0:
+            base_model = model_name.lower()
+            for model_key, price in COST_PER_1K_TOKENS.items():
+                if model_key in base_model:
+                    cost = (total_tokens / 1000) * price
+                    break
+
+        annotate_call(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=total_tokens, cost=cost)
+        logger.info("💰 LLM Cost: $%.6f | Model: %s | User: %s | Tokens - Input: %s, Output: %s, Total: %s",
+                    cost, model_name, user_context.get("name", "Unknown") if user_context else "Unknown",
+                    prompt_tokens, completion_tokens, total_tokens)
+    except Exception as e:
+        logger.warning("❌ Failed to read LLM usage/cost: %s (response type %s)", e, type(response))
+
+def _raw_response(content: str, config: Dict[str, str], user_context=None) -> Dict[str, Any]:
+    """
+    The raw completion text plus what post-processing read from the request:
+    provider (picks the JSON extraction), user name (disclaimer) and the
+    biomarker table (escalation checks), all as JSON.
+    """
+    context = {}
+    if user_context:
+        context["name"] = user_context.get("name")
+        context["interaction_count"] = user_context.get("interaction_count")
+        biomarker_table = user_context.get("biomarker_table")
+        if biomarker_table is not None:
+            context["biomarkers"] = biomarker_table.rows()
+    return {"content": content, "provider": config["provider"], "context": context}
+
+def reprocess_raw_response(raw_response: Dict[str, Any], model_name: str, response_format: Type[BaseModel] = None) -> Union[Dict[str, Any], BaseModel]:
+    """
+    Run a stored raw completion through parsing, repair and validation again,
+    exactly as call_llm would have (nothing is saved). Used by replay.py.
+    """
+    context = dict(raw_response.get("context") or {})
+    if context.get("biomarkers") is not None:
+        context["biomarker_table"] = BiomarkerTable.from_rows(context.pop("biomarkers"))
+    response = {"choices": [{"message": {"role": "assistant", "content": raw_response["content"]}}], "usage": {}, "response_cost": 0.0}
+    return _process_completion_response(response, model_name, {"provider": raw_response.get("provider") or "azure"},
+                                        response_format, context or None, save_result=False)
+
+def _process_completion_response(response, model_name: str, config: Dict[str, str], response_format: Type[BaseModel] = None, user_context=None, save_result: bool = True) -> Union[Dict[str, Any], BaseModel]:
+    """Parse, validate and (optionally) save the content of a completion response."""
+    _log_completion_cost(response, model_name, user_context)
+
+    # litellm returns a dict with 'choices', get the content from the first choice
+    content = response["choices"][0]["message"]["content"]
+    raw_response = _raw_response(content, config, user_context) if save_result else None
+
+    # Enhanced logging for debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("🔍 Raw LLM Response from %s: %s characters", config['provider'], len(content))
+        logger.debug("📝 Content preview (first 500 chars):\n%s", content[:500])
         if len(content) > 500:
-            print(f"📝 Content ending (last 200 chars):\n...{content[-200:]}")
-        print("-" * 80)
+            logger.debug("📝 Content ending (last 200 chars):\n...%s", content[-200:])
 
-        # If we have a Pydantic response format, try to parse into that model
-        if response_format and issubclass(response_format, BaseModel):
-            try:
-                # Clean the content to extract JSON
+    # If we have a Pydantic response format, try to parse into that model
+    if response_format and issubclass(response_format, BaseModel):
+        schema = compiled_schema(response_format)
+        try:
+            # Clean the content to extract JSON
+            with span("parse_json", characters=len(content)):
                 if config["provider"] == "gemini":
                     # Use enhanced Gemini JSON extraction
                     parsed_json = extract_json_from_gemini_response(content)
@@ -1220,157 +1803,166 @@ CRITICAL REQUIREMENTS:
                     cleaned_content = clean_json_content(content)
                     parsed_json = json.loads(cleaned_content)
 
-                # Validate and fix JSON fields to match schema
-                schema_json = response_format.model_json_schema()
-                parsed_json = validate_and_fix_json_fields(parsed_json, schema_json)
+            # Validate and fix JSON fields to match schema
+            with span("fix_fields"):
+                parsed_json = validate_and_fix_json_fields(parsed_json, schema.schema)
 
-                # Apply escalation validation for health reports
-                if 'biomarker_insights' in parsed_json:
-                    parsed_json = validate_escalation_logic(parsed_json)
+            # Apply escalation validation for health reports
+            biomarker_table = user_context.get('biomarker_table') if user_context else None
+            if 'biomarker_insights' in parsed_json:
+                with span("escalation"):
+                    parsed_json = validate_escalation_logic(parsed_json, biomarker_table)
 
-                # Apply 6-month timeline validation for health reports
-                if 'action_plan' in parsed_json:
+            # Apply 6-month timeline validation for health reports
+            if 'action_plan' in parsed_json:
+                with span("timeline"):
                     parsed_json = validate_six_month_timeline(parsed_json)
 
-                # Enhance parsed response with personalization markers if user context exists
-                if user_context and isinstance(parsed_json, dict):
-                    user_name = user_context.get('name', 'User')
-                    # Add personalized disclaimer if it exists in the schema
-                    if 'disclaimer' in parsed_json:
-                        parsed_json['disclaimer'] = f"{user_name}, these recommendations are specifically designed with your goals in mind. These recommendations are for educational purposes only and do not constitute medical advice. Please consult a healthcare provider before starting any new regimen."
-
-                # Create Pydantic model instance
-                model_instance = response_format(**parsed_json)
-
-                # Save to JSON file
-                user_name = user_context.get('name', 'Unknown') if user_context else 'Unknown'
-                save_response_to_json(model_instance, model_name, user_name)
-
-                return model_instance
-
-            except (json.JSONDecodeError, ValueError) as e:
-                # Enhanced fallback for problematic models
-                print(f"❌ JSON parsing failed: {str(e)}")
-                print(f"🔍 Failed content (first 1000 chars): {content[:1000]}")
-                user_name = user_context.get('name', 'User') if user_context else 'User'
-                
-                # Try to extract partial JSON for Gemini with more aggressive methods
-                if config["provider"] == "gemini":
-                    try:
-                        # Try to salvage any valid JSON fragments
-                        content_clean = re.sub(r'```json|```', '', content)
-                        
-                        # Look for any complete JSON objects in the response
-                        json_objects = re.findall(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content_clean, re.DOTALL)
-                        
-                        for json_obj in json_objects:
-                            try:
-                                # Clean and fix the JSON object
-                                fixed_json = fix_gemini_json(json_obj)
-                                parsed_json = json.loads(fixed_json)
-                                
-                                # Validate against schema
-                                schema_json = response_format.model_json_schema()
-                                parsed_json = validate_and_fix_json_fields(parsed_json, schema_json)
-                                
-                                model_instance = response_format(**parsed_json)
-                                save_response_to_json(model_instance, model_name, user_name)
-                                return model_instance
-                            except Exception as inner_e:
-                                print(f"❌ Failed to parse JSON fragment: {str(inner_e)}")
-                                continue
-                        
-                        # If no valid JSON found, create an enhanced fallback response
-                        schema_json = response_format.model_json_schema()
-                        enhanced_response = create_enhanced_fallback_response(schema_json, content, user_name)
-                        model_instance = response_format(**enhanced_response)
-                        save_response_to_json(model_instance, model_name, user_name)
-                        return model_instance
-                        
-                    except Exception as gemini_error:
-                        print(f"❌ Gemini JSON extraction failed: {str(gemini_error)}")
-                
-                # For O4-mini and other models, try simpler fallback
-                elif "o4-mini" in model_name:
-                    try:
-                        # O4-mini sometimes returns empty content
-                        if not content.strip():
-                            print("❌ O4-mini returned empty content")
-                            schema_json = response_format.model_json_schema()
-                            minimal_response = create_minimal_valid_response(schema_json, "Empty response", user_name)
-                            model_instance = response_format(**minimal_response)
-                            save_response_to_json(model_instance, model_name, user_name)
+            # Enhance parsed response with personalization markers if user context exists
+            if user_context and isinstance(parsed_json, dict):
+                user_name = user_context.get('name', 'User')
+                # Add personalized disclaimer if it exists in the schema
+                if 'disclaimer' in parsed_json:
+                    parsed_json['disclaimer'] = f"{user_name}, these recommendations are specifically designed with your goals in mind. These recommendations are for educational purposes only and do not constitute medical advice. Please consult a healthcare provider before starting any new regimen."
+
+            missing_fields = schema.missing_required_fields(parsed_json)
+            if missing_fields:
+                logger.warning("⚠️ Response is missing required fields: %s", ', '.join(missing_fields[:10]))
+
+            # Create Pydantic model instance
+            with span("pydantic_validate"):
+                model_instance = schema.validate(parsed_json)
+            annotate_call(repair_strategy="repair_json" if config["provider"] == "gemini" else "clean_json")
+
+            # Save to JSON file
+            user_name = user_context.get('name', 'Unknown') if user_context else 'Unknown'
+            if save_result:
+                with span("save_response"):
+                    save_response(model_instance, model_name, user_name, raw_response)
+
+            return model_instance
+
+        except (json.JSONDecodeError, ValueError) as e:
+            # Enhanced fallback for problematic models
+            logger.error("❌ JSON parsing failed: %s", e)
+            logger.debug("🔍 Failed content (first 1000 chars): %s", content[:1000])
+            user_name = user_context.get('name', 'User') if user_context else 'User'
+            
+            # Try to extract partial JSON for Gemini with more aggressive methods
+            if config["provider"] == "gemini":
+                try:
+                    # Try to salvage any valid JSON fragments
+                    content_clean = re.sub(r'```json|```', '', content)
+                    
+                    # Look for any complete JSON objects in the response
+                    json_objects = re.findall(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content_clean, re.DOTALL)
+                    
+                    for json_obj in json_objects:
+                        try:
+                            # Clean and fix the JSON object
+                            fixed_json = fix_gemini_json(json_obj)
+                            parsed_json = json.loads(fixed_json)
+                            
+                            # Validate against schema
+                            parsed_json = validate_and_fix_json_fields(parsed_json, schema.schema)
+                            
+                            model_instance = schema.validate(parsed_json)
+                            annotate_call(repair_strategy="json_fragment")
+                            if save_result:
+                                save_response(model_instance, model_name, user_name, raw_response)
                             return model_instance
-                        
-                        # Try basic JSON cleaning
-                        cleaned_content = clean_json_content(content)
-                        parsed_json = json.loads(cleaned_content)
-                        schema_json = response_format.model_json_schema()
-                        parsed_json = validate_and_fix_json_fields(parsed_json, schema_json)
-                        model_instance = response_format(**parsed_json)
-                        save_response_to_json(model_instance, model_name, user_name)
+                        except Exception as inner_e:
+                            logger.error("❌ Failed to parse JSON fragment: %s", inner_e)
+                            continue
+                    
+                    # If no valid JSON found, create an enhanced fallback response
+                    enhanced_response = create_enhanced_fallback_response(schema.schema, content, user_name)
+                    model_instance = schema.validate(enhanced_response)
+                    annotate_call(repair_strategy="enhanced_fallback")
+                    if save_result:
+                        save_response(model_instance, model_name, user_name, raw_response)
+                    return model_instance
+                    
+                except Exception as gemini_error:
+                    logger.error("❌ Gemini JSON extraction failed: %s", gemini_error)
+            
+            # For O4-mini and other models, try simpler fallback
+            elif "o4-mini" in model_name:
+                try:
+                    # O4-mini sometimes returns empty content
+                    if not content.strip():
+                        logger.error("❌ O4-mini returned empty content")
+                        minimal_response = create_minimal_valid_response(schema.schema, "Empty response", user_name)
+                        model_instance = schema.validate(minimal_response)
+                        annotate_call(repair_strategy="minimal_fallback")
+                        if save_result:
+                            save_response(model_instance, model_name, user_name, raw_response)
                         return model_instance
-                    except Exception as o4_error:
-                        print(f"❌ O4-mini fallback failed: {str(o4_error)}")
-                
-                # Final fallback response with proper structure
-                schema_json = response_format.model_json_schema()
-                fallback_response = create_minimal_valid_response(schema_json, content, user_name)
-                
-                # Save fallback response to JSON
-                save_response_to_json(fallback_response, model_name, user_name)
-                return fallback_response
-        else:
-            # No structured format requested, try to parse as JSON or return as string
-            try:
-                # Clean the content to extract JSON
-                if config["provider"] == "gemini":
-                    cleaned_content = fix_gemini_json(content)
-                else:
+                    
+                    # Try basic JSON cleaning
                     cleaned_content = clean_json_content(content)
-                
-                parsed_response = json.loads(cleaned_content)
-
-                # Enhance parsed response with personalization markers if user context exists
-                if user_context and isinstance(parsed_response, dict):
-                    user_name = user_context.get('name', 'User')
-                    # Add personalized disclaimer
-                    if 'disclaimer' in parsed_response:
-                        parsed_response['disclaimer'] = f"{user_name}, these recommendations are specifically designed with your goals in mind. These recommendations are for educational purposes only and do not constitute medical advice. Please consult a healthcare provider before starting any new regimen."
-
-                    # Mark response as personalized
-                    parsed_response['_personalization_applied'] = True
-                    parsed_response['_user_name'] = user_name
-                    parsed_response['_interaction_count'] = user_context.get('interaction_count', 1)
-
-                # Save to JSON file
-                user_name = user_context.get('name', 'Unknown') if user_context else 'Unknown'
-                save_response_to_json(parsed_response, model_name, user_name)
-
-                return parsed_response
-
-            except json.JSONDecodeError:
-                # If JSON parsing fails, return as a structured response
-                user_name = user_context.get('name', 'User') if user_context else 'User'
-                fallback_response = {
-                    "analysis_summary": f"Hi {user_name}, " + content,  # Don't truncate - show full content
-                    "insights": [content],
-                    "recommendations": None,
-                    "disclaimer": f"{user_name}, these recommendations are for educational purposes only and do not constitute medical advice. Please consult a healthcare provider before starting any new regimen.",
-                    "_personalization_applied": bool(user_context)
-                }
+                    parsed_json = json.loads(cleaned_content)
+                    parsed_json = validate_and_fix_json_fields(parsed_json, schema.schema)
+                    model_instance = schema.validate(parsed_json)
+                    annotate_call(repair_strategy="clean_json_retry")
+                    if save_result:
+                        save_response(model_instance, model_name, user_name, raw_response)
+                    return model_instance
+                except Exception as o4_error:
+                    logger.error("❌ O4-mini fallback failed: %s", o4_error)
+            
+            # Final fallback response with proper structure
+            fallback_response = create_minimal_valid_response(schema.schema, content, user_name)
+            annotate_call(repair_strategy="minimal_fallback")
+            
+            # Save fallback response to JSON
+            if save_result:
+                save_response(fallback_response, model_name, user_name, raw_response)
+            return fallback_response
+    else:
+        # No structured format requested, try to parse as JSON or return as string
+        try:
+            # Clean the content to extract JSON
+            if config["provider"] == "gemini":
+                cleaned_content = fix_gemini_json(content)
+            else:
+                cleaned_content = clean_json_content(content)
+            
+            parsed_response = json.loads(cleaned_content)
+            annotate_call(repair_strategy="fix_gemini_json" if config["provider"] == "gemini" else "clean_json")
 
-                # Save fallback response to JSON
-                save_response_to_json(fallback_response, model_name, user_name)
-                return fallback_response
-    except Exception as e:
-        error_str = str(e).lower()
+            # Enhance parsed response with personalization markers if user context exists
+            if user_context and isinstance(parsed_response, dict):
+                user_name = user_context.get('name', 'User')
+                # Add personalized disclaimer
+                if 'disclaimer' in parsed_response:
+                    parsed_response['disclaimer'] = f"{user_name}, these recommendations are specifically designed with your goals in mind. These recommendations are for educational purposes only and do not constitute medical advice. Please consult a healthcare provider before starting any new regimen."
+
+                # Mark response as personalized
+                parsed_response['_personalization_applied'] = True
+                parsed_response['_user_name'] = user_name
+                parsed_response['_interaction_count'] = user_context.get('interaction_count', 1)
+
+            # Save to JSON file
+            user_name = user_context.get('name', 'Unknown') if user_context else 'Unknown'
+            if save_result:
+                save_response(parsed_response, model_name, user_name, raw_response)
 
-        # Handle rate limit errors specifically
-        if "rate limit" in error_str or "429" in error_str or "quota" in error_str or "exceeded token rate limit" in error_str:
-            error_msg = f"Rate limit exceeded for model {model_name}. Please try again in 60 seconds or switch to a different model (like openai/o3 or gemini/gemini-2.0-flash-exp)."
-            print(f"❌ Rate Limit Error: {error_msg}")
-            raise Exception(error_msg)
+            return parsed_response
+
+        except json.JSONDecodeError:
+            # If JSON parsing fails, return as a structured response
+            user_name = user_context.get('name', 'User') if user_context else 'User'
+            annotate_call(repair_strategy="text_fallback")
+            fallback_response = {
+                "analysis_summary": f"Hi {user_name}, " + content,  # Don't truncate - show full content
+                "insights": [content],
+                "recommendations": None,
+                "disclaimer": f"{user_name}, these recommendations are for educational purposes only and do not constitute medical advice. Please consult a healthcare provider before starting any new regimen.",
+                "_personalization_applied": bool(user_context)
+            }
 
-        # Handle other errors
-        raise Exception(f"LLM call failed for model {model_name}: {str(e)}")
\ No newline at end of file
+            # Save fallback response to JSON
+            if save_result:
+                save_response(fallback_response, model_name, user_name, raw_response)
+            return fallback_response
@@ -0,0 +1,228 @@
+"""
+Local stand-in LLM provider for load, latency and failure testing.
+
+MODEL_CONFIGS entries with provider "mock" are served from here instead of
+litellm (see llm_utils). A mock completion replays a recorded report from
+llm_results/ after a simulated latency, and can fail the way real providers
+do: 429s, server errors, truncated output and malformed JSON, at the rates
+set in the entry's "mock" settings. Streaming requests get the same content
+in chunks. Nothing leaves the machine and no quota is used.
+
+Settings (all optional, per MODEL_CONFIGS entry under "mock"):
+    latency             {"distribution": "lognormal", "median": 8.0, "p95": 20.0} seconds,
+                        or {"distribution": "fixed", "seconds": 1.0}
+                        or {"distribution": "uniform", "low": 1.0, "high": 5.0}
+    time_to_first_chunk share of the latency spent before the first streamed chunk (0.2)
+    chunk_characters    characters per streamed chunk (64)
+    rate_limit_rate     share of calls failing with a 429 (with a retry-after hint)
+    retry_after         seconds in that hint (5)
+    error_rate          share of calls failing with a 500
+    truncate_rate       share of responses cut off part-way (finish_reason "length")
+    malformed_rate      share of responses with broken JSON (fences, trailing commas, a missing brace)
+
+Environment: MOCK_LLM_ENABLED=1 offers the mock models in the app and the
+report service (they serve other people's recorded reports, so they are
+for development only; the benchmarks call them directly either way),
+MOCK_LLM_SEED makes fault injection reproducible,
+MOCK_LLM_LATENCY_SCALE scales every latency (0 runs at full speed, e.g. in CI)
+and MOCK_LLM_CORPUS sets the glob of recorded responses to replay.
+"""
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+from token_budget import count_message_tokens, count_tokens
+
+logger = logging.getLogger(__name__)
+
+MOCK_LLM_ENABLED = os.getenv("MOCK_LLM_ENABLED", "").lower() in ("1", "true", "yes")
+MOCK_CORPUS_PATTERN = os.getenv("MOCK_LLM_CORPUS", os.path.join("llm_results", "*.json"))
+MOCK_LATENCY_SCALE = float(os.getenv("MOCK_LLM_LATENCY_SCALE", "1.0"))
+MOCK_SEED = os.getenv("MOCK_LLM_SEED")
+
+DEFAULT_LATENCY = {"distribution": "lognormal", "median": 8.0, "p95": 20.0}
+
+# Standard normal quantile at 0.95, to turn a (median, p95) pair into a lognormal sigma
+_Z95 = 1.6448536269514722
+
+class MockRateLimitError(Exception):
+    """A simulated provider 429."""
+
+class MockServerError(Exception):
+    """A simulated provider 5xx."""
+
+class MockProvider:
+    """Replays recorded responses with simulated latency and faults; thread-safe."""
+
+    def __init__(self, corpus_pattern: str = MOCK_CORPUS_PATTERN, seed: Optional[str] = MOCK_SEED,
+                 latency_scale: float = MOCK_LATENCY_SCALE):
+        self.corpus_pattern = corpus_pattern
+        self.latency_scale = latency_scale
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._corpus = None
+        self.stats = {"calls": 0, "streams": 0, "rate_limited": 0, "errors": 0, "truncated": 0, "malformed": 0}
+
+    def reseed(self, seed: Optional[str]) -> None:
+        """Restart fault injection and latency sampling from seed (for reproducible runs)."""
+        with self._lock:
+            self._random = random.Random(seed)
+
+    def corpus(self) -> List[str]:
+        """Recorded report JSON texts, loaded on first use."""
+        if self._corpus is None:
+            corpus = []
+            for path in sorted(glob.glob(self.corpus_pattern)):
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    continue
+                if isinstance(data, dict) and isinstance(data.get("result"), dict):
+                    corpus.append(json.dumps(data["result"], ensure_ascii=False, indent=2))
+            if not corpus:
+                raise FileNotFoundError(f"No recorded responses to replay in {self.corpus_pattern}")
+            logger.info("🎭 Mock provider loaded %s recorded responses", len(corpus))
+            self._corpus = corpus
+        return self._corpus
+
+    def _uniform(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+
+    def sample_latency(self, settings: Dict[str, Any]) -> float:
+        """Seconds one call takes, drawn from the configured distribution and scaled by latency_scale."""
+        latency = settings.get("latency") or DEFAULT_LATENCY
+        distribution = latency.get("distribution", "lognormal")
+        with self._lock:
+            if distribution == "fixed":
+                seconds = float(latency["seconds"])
+            elif distribution == "uniform":
+                seconds = self._random.uniform(latency["low"], latency["high"])
+            else:
+                median = latency["median"]
+                sigma = math.log(latency["p95"] / median) / _Z95 if latency.get("p95", median) > median else 0.0
+                seconds = self._random.lognormvariate(math.log(median), sigma)
+        return seconds * self.latency_scale
+
+    def _pick_content(self, messages: List[Dict[str, Any]]) -> str:
+        """A recorded response, chosen by prompt so the same request replays the same report."""
+        corpus = self.corpus()
+        digest = hashlib.sha256(json.dumps(messages, sort_keys=True, default=str).encode('utf-8')).digest()
+        return corpus[int.from_bytes(digest[:4], 'big') % len(corpus)]
+
+    def _inject_faults(self, settings: Dict[str, Any]) -> None:
+        """Raise a simulated 429 / 5xx at the configured rates (before any latency, as providers reject early)."""
+        if self._uniform() < settings.get("rate_limit_rate", 0.0):
+            self._count("rate_limited")
+            raise MockRateLimitError(f"429 Rate limit exceeded (mock). Please retry after {settings.get('retry_after', 5)} seconds.")
+        if self._uniform() < settings.get("error_rate", 0.0):
+            self._count("errors")
+            raise MockServerError("500 Internal server error (mock)")
+
+    def _damage(self, content: str, settings: Dict[str, Any]) -> tuple:
+        """Apply truncation / malformation at the configured rates; returns (content, finish_reason)."""
+        if self._uniform() < settings.get("truncate_rate", 0.0):
+            self._count("truncated")
+            cut = int(len(content) * (0.3 + 0.65 * self._uniform()))
+            return content[:cut], "length"
+        if self._uniform() < settings.get("malformed_rate", 0.0):
+            self._count("malformed")
+            damage = self._uniform()
+            if damage < 1 / 3:
+                content = f"Here is the personalized report:\n```json\n{content}\n```"
+            elif damage < 2 / 3:
+                content = re.sub(r'(["\d\]}])(\s*\n\s*[\]}])', r'\1,\2', content)
+            else:
+                content = content[:content.rstrip().rfind("}")]
+        return content, "stop"
+
+    def _response(self, model: str, messages: List[Dict[str, Any]], content: str, finish_reason: str) -> Dict[str, Any]:
+        prompt_tokens = count_message_tokens(messages)
+        completion_tokens = count_tokens(content)
+        return {
+            "id": f"mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+            "response_cost": 0.0,
+        }
+
+    def _prepare(self, params: Dict[str, Any]) -> tuple:
+        settings = params.get("mock") or {}
+        self._count("calls")
+        latency = self.sample_latency(settings)
+        content, finish_reason = self._damage(self._pick_content(params["messages"]), settings)
+        return settings, latency, content, finish_reason
+
+    def completion(self, **params: Any):
+        """litellm.completion stand-in: a completion dict, or an iterator of chunks when stream=True."""
+        settings, latency, content, finish_reason = self._prepare(params)
+        self._inject_faults(settings)
+        if params.get("stream"):
+            self._count("streams")
+            return self._stream(params, settings, latency, content, finish_reason)
+        time.sleep(latency)
+        return self._response(params["model"], params["messages"], content, finish_reason)
+
+    async def acompletion(self, **params: Any) -> Dict[str, Any]:
+        """litellm.acompletion stand-in (streaming is only supported through completion)."""
+        settings, latency, content, finish_reason = self._prepare(params)
+        self._inject_faults(settings)
+        await asyncio.sleep(latency)
+        return self._response(params["model"], params["messages"], content, finish_reason)
+
+    def _stream(self, params: Dict[str, Any], settings: Dict[str, Any], latency: float, content: str,
+                finish_reason: str) -> Iterator[Dict[str, Any]]:
+        time_to_first_chunk = latency * settings.get("time_to_first_chunk", 0.2)
+        time.sleep(time_to_first_chunk)
+
+        size = max(1, settings.get("chunk_characters", 64))
+        pieces = [content[i:i + size] for i in range(0, len(content), size)]
+        delay = (latency - time_to_first_chunk) / max(1, len(pieces))
+        for index, piece in enumerate(pieces):
+            if index:
+                time.sleep(delay)
+            yield {"choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+        final = self._response(params["model"], params["messages"], content, finish_reason)
+        yield {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}], "usage": final["usage"]}
+
+def stream_chunk_builder(chunks: List[Dict[str, Any]], messages: Optional[list] = None) -> Dict[str, Any]:
+    """litellm.stream_chunk_builder stand-in: assemble mock stream chunks into one completion dict."""
+    content = "".join((chunk["choices"][0]["delta"].get("content") or "") for chunk in chunks if chunk.get("choices"))
+    finish_reason = next((chunk["choices"][0]["finish_reason"] for chunk in reversed(chunks)
+                          if chunk.get("choices") and chunk["choices"][0].get("finish_reason")), "stop")
+    usage = next((chunk["usage"] for chunk in reversed(chunks) if chunk.get("usage")), {})
+    return {
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+        "usage": usage,
+        "response_cost": 0.0,
+    }
+
+_default_provider = None
+_default_provider_lock = threading.Lock()
+
+def get_mock_provider() -> MockProvider:
+    """Return the process-wide mock provider."""
+    global _default_provider
+    with _default_provider_lock:
+        if _default_provider is None:
+            _default_provider = MockProvider()
+        return _default_provider
@@ -0,0 +1,141 @@
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+# LiteLLM-compatible Pydantic models with non-empty object schemas for Gemini/VertexAI
+
+class SupplementRecommendation(BaseModel):
+    supplement_name: str = Field(..., description="Name of the supplement being recommended")
+    rationale: str = Field(..., description="Rationale for recommending this supplement based on user profile and biomarkers")
+    dosage: str = Field(..., description="Recommended dose using educational language (e.g., 'Studies suggest 500mg may support...')")
+    timing: str = Field(..., description="When to take (morning, evening, with meals, etc.)")
+    food_timing: str = Field(..., description="Before/with/after food instructions")
+    purpose: str = Field(..., description="Purpose and how it helps the user - what it does for you")
+    biomarker_connection: str = Field(..., description="How this connects to user's biomarker data and health goals")
+    longevity_performance_benefit: str = Field(..., description="How this supports longevity and performance goals")
+    duration: str = Field(..., description="How long to take the supplement")
+    retest_timing: str = Field(..., description="When to retest biomarkers")
+    evidence_source: str = Field(..., description="Scientific evidence source from approved knowledge sources")
+    cautions: Optional[str] = Field(None, description="Side effects, cautions, or things to avoid")
+    interactions: Optional[str] = Field(None, description="Any interactions with other supplements or medications")
+    indian_availability: Optional[str] = Field(None, description="Notes on availability in India or Indian brands if relevant")
+
+class NutritionRecommendation(BaseModel):
+    nutrition_name: str = Field(..., description="Name of the nutrition recommendation")
+    rationale: str = Field(..., description="Why this is recommended based on biomarker data and personalization data")
+    priority_rank: int = Field(..., description="Priority ranking (1-5)")
+    evidence_strength: str = Field(..., description="Strength of evidence (High/Medium/Low)")
+    biomarker_connection: str = Field(..., description="How this connects to specific biomarker data")
+    implementation_tips: List[str] = Field(default_factory=list, description="3-4 practical tips for implementation with Indian context")
+    foods_to_include: List[str] = Field(default_factory=list, description="Specific foods to eat more of (Indian foods when possible)")
+    foods_to_avoid: List[str] = Field(default_factory=list, description="Foods to avoid or limit")
+    meal_timing_guidance: Optional[str] = Field(None, description="Meal timing recommendations if relevant")
+    indian_food_examples: List[str] = Field(default_factory=list, description="Examples using Indian cuisine and locally available foods")
+    female_specific_notes: Optional[str] = Field(None, description="Special considerations for female users based on cycle status")
+    evidence_source: str = Field(..., description="Scientific evidence source with links")
+
+class ExerciseRecommendation(BaseModel):
+    exercise_name: str = Field(..., description="Name of the exercise/lifestyle recommendation")
+    rationale: str = Field(..., description="Why this is recommended based on biomarker data and personalization data")
+    workout_type: str = Field(..., description="Type of workout (strength, cardio, flexibility, etc.)")
+    frequency: str = Field(..., description="How often per week")
+    duration: str = Field(..., description="Duration per session")
+    intensity: str = Field(..., description="Intensity level recommendations")
+    volume: str = Field(..., description="Volume recommendations")
+    rest_periods: str = Field(..., description="Rest period recommendations")
+    biomarker_connection: str = Field(..., description="How this connects to biomarker data and goals")
+    current_optimization: Optional[str] = Field(None, description="What user is doing right and how to optimize further")
+    athlete_specific_notes: Optional[str] = Field(None, description="Training periodization or protocols for competitive athletes")
+    female_specific_notes: Optional[str] = Field(None, description="Recommendations based on cycle status for female users")
+    no_intervention_note: Optional[str] = Field(None, description="Note if no intervention needed (e.g., 'well-balanced, no critical changes needed')")
+    evidence_source: str = Field(..., description="Scientific evidence source with links")
+
+class CategoryInsight(BaseModel):
+    category_name: str = Field(..., description="Name of the health category with emoji (e.g., '💪 Strength & Endurance')")
+    score: str = Field(..., description="Category score (e.g., '75/100')")
+    summary: str = Field(..., description="Comprehensive 3-4 sentence summary explaining the category's current state, key biomarker patterns, and overall assessment. Should identify multi-marker patterns (e.g., HPA axis fatigue) and explain the functional medicine significance")
+    whats_working_well: Optional[str] = Field(None, description="Specific biomarkers and values that are optimal, with exact values and why they support the user's goals")
+    what_needs_work: Optional[str] = Field(None, description="Specific biomarkers that are amber/red with exact values and status, explaining the functional implications")
+    behavioral_contributors: List[str] = Field(default_factory=list, description="Specific lifestyle factors from user metadata that contribute to this category's performance")
+    priority_actions: List[str] = Field(default_factory=list, description="Specific, actionable interventions to improve this category (supplements, lifestyle changes, etc.)")
+    how_this_links_to_goals: Optional[str] = Field(None, description="Clear explanation of how optimizing this category directly impacts the user's stated health goals and lifestyle")
+    relevance_to_goals: str = Field(..., description="Why this category matters for the user's goals")
+    impact_on_goals: str = Field(..., description="How this category impacts user's goals")
+    performance_longevity_impact: str = Field(..., description="Why this score matters for performance or longevity")
+    biomarker_connections: List[str] = Field(default_factory=list, description="Connected biomarkers")
+    interrelated_categories: List[str] = Field(default_factory=list, description="Other categories that are interrelated")
+    what_to_continue: Optional[str] = Field(None, description="What's working well to continue (for green categories)")
+
+class BiomarkerInsight(BaseModel):
+    biomarker_name: str = Field(..., description="Name of the biomarker")
+    status: str = Field(..., description="Status (Red/Amber/Green/Optimal)")
+    current_value: str = Field(..., description="Current biomarker value")
+    reference_range: str = Field(..., description="Normal reference range")
+    what_it_is_why_matters: str = Field(..., description="Explain the biomarker in plain language (2-3 sentences). What does it measure? Why is it important for the user's health goals, longevity, or performance?")
+    your_result: str = Field(..., description="State the user's actual value, whether it is in the optimal, yellow, amber, or red range, and what that means for their health")
+    likely_contributors: str = Field(..., description="Use user metadata and known lifestyle associations to infer what may be contributing to the value. Be explicit and tie it back to the user's behaviors or reported symptoms")
+    health_implications: str = Field(..., description="Explain what happens if this marker remains out of range. Use credible, non-alarmist language to outline risks")
+    recommended_next_steps: str = Field(..., description="Suggest 1-2 specific, actionable interventions that can help. Make it practical and tied to this biomarker")
+    deviation_severity: Optional[str] = Field(None, description="Mild/Moderate/Severe based on % deviation from optimal")
+    what_to_continue: Optional[str] = Field(None, description="What's working well (for Green/Optimal)")
+    trend_analysis: Optional[str] = Field(None, description="Trend compared to past data if available")
+    related_biomarkers: List[str] = Field(default_factory=list, description="Other biomarkers that are related or show consistent patterns")
+    evidence_source: str = Field(..., description="Scientific evidence source")
+
+class TopPriority(BaseModel):
+    priority_number: int = Field(..., description="Priority ranking (1, 2, or 3)")
+    priority_name: str = Field(..., description="Name of the priority area (e.g., 'Rebuild Adrenal Resilience')")
+    detailed_narrative: str = Field(default="", description="Comprehensive narrative paragraph integrating biomarker evidence, lifestyle factors, functional medicine insights, and impact on user's goals")
+    # Legacy fields for backward compatibility
+    biomarker_evidence: List[str] = Field(default_factory=list, description="Specific biomarkers and their values that support this priority")
+    lifestyle_evidence: List[str] = Field(default_factory=list, description="User's lifestyle factors, symptoms, or behaviors that support this priority")
+    functional_significance: str = Field(default="", description="Explanation of the functional medicine significance and patterns identified")
+    impact_statement: str = Field(default="", description="Why addressing this priority is essential for the user's goals, energy, health, etc.")
+
+class MonthlyPlan(BaseModel):
+    month_range: str = Field(..., description="Month range (e.g., 'Months 0-2')")
+    focus_areas: List[str] = Field(default_factory=list, description="Key focus areas for this period")
+    supplement_adjustments: List[str] = Field(default_factory=list, description="Supplement plan for this period")
+    nutrition_focus: List[str] = Field(default_factory=list, description="Nutrition focus for this period")
+    exercise_goals: List[str] = Field(default_factory=list, description="Exercise goals for this period")
+    lifestyle_targets: List[str] = Field(default_factory=list, description="Lifestyle targets")
+    retest_schedule: List[str] = Field(default_factory=list, description="When to retest biomarkers")
+
+class ActionPlan(BaseModel):
+    supplements: List[SupplementRecommendation] = Field(default_factory=list, description="Supplement recommendations (max 5, no duplicates)")
+    supplement_schedule_summary: str = Field(..., description="Daily supplement schedule organized by time of day for easy reading")
+    supplement_disclaimer: str = Field(default="These suggestions are for educational purposes only and do not constitute medical advice. Please consult a healthcare provider before beginning any supplement regimen.", description="Supplement disclaimer")
+    nutrition: List[NutritionRecommendation] = Field(default_factory=list, description="Nutrition recommendations (max 5, ranked by priority)")
+    exercise_lifestyle: List[ExerciseRecommendation] = Field(default_factory=list, description="Exercise and lifestyle recommendations (max 5)")
+    six_month_timeline: List[MonthlyPlan] = Field(default_factory=list, description="6-month action plan timeline with logical progression")
+
+class HealthVizorResponse(BaseModel):
+    # A) Overall Health Summary & Personalization
+    overall_health_summary: str = Field(..., description="Warm, celebratory 5-6 sentence paragraph in second person that commends the user for taking charge of their health, personalizes using age, gender, health goals, habits, or activity level, reflects overall impression based on biomarkers, reinforces hope and actionability")
+    congratulations_message: str = Field(..., description="Congratulate user on taking this step")
+    wins_to_celebrate: List[str] = Field(default_factory=list, description="What's Working Well - highlight key green biomarkers and high-performing categories, reinforce positive behaviors")
+    what_to_continue: List[str] = Field(default_factory=list, description="What the user should continue doing - encourage to continue or double down on these habits")
+    what_needs_work: List[str] = Field(default_factory=list, description="What Needs Attention - flag notable amber/red biomarkers or risk patterns with constructive language")
+    top_3_priorities_detailed: List[TopPriority] = Field(default_factory=list, description="Detailed breakdown of top 3 health priorities with comprehensive narrative format integrating biomarker evidence, lifestyle factors, and impact statements")
+    biomarker_snapshot: str = Field(..., description="Simple count of red, amber, and green biomarkers with encouraging message (e.g., 'You have 4 red, 6 amber, and 12 green biomarkers. That's a strong foundation — and a great place to start.')")
+    goal_relevance: str = Field(..., description="How this relates to the user's goals")
+    longevity_performance_impact: str = Field(..., description="What this means for overall longevity and performance")
+
+    # B) Category Level Insights & Personalization
+    category_insights: List[CategoryInsight] = Field(default_factory=list, description="Detailed insights for each health category")
+
+    # C) Biomarker Level Findings & Personalization
+    biomarker_insights: List[BiomarkerInsight] = Field(default_factory=list, description="Detailed insights for each biomarker")
+    biomarker_pattern_analysis: Optional[str] = Field(None, description="Analysis of biomarker patterns across multiple systems")
+
+    # D) Personalized Action Plan
+    action_plan: ActionPlan = Field(default_factory=ActionPlan, description="Comprehensive personalized action plan")
+
+    # Escalation flags
+    escalation_needed: bool = Field(default=False, description="Whether escalation is needed (under 18, pregnant, critical biomarkers)")
+    escalation_reason: Optional[str] = Field(None, description="Reason for escalation if needed")
+
+    # Disclaimer
+    disclaimer: str = Field(
+        default="These recommendations are for educational purposes only and do not constitute medical advice. Please consult a healthcare provider before starting any new regimen.",
+        description="Medical disclaimer"
+    )
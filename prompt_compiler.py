@@ -0,0 +1,87 @@
+import hashlib
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+_HEADING = re.compile(r'^# ', re.MULTILINE)
+# "{name}" but not the escaped "{{name}}"
+_PLACEHOLDER = re.compile(r'(?<!\{)\{([A-Za-z_][A-Za-z0-9_]*)\}(?!\})')
+
+# Static prompt text -> its hash, for every compiled prompt (see static_prefix_hash)
+_STATIC_PREFIX_HASHES = {}
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def _split_template(template: str) -> Tuple[str, str, str, Tuple[str, ...]]:
+    """
+    Split a str.format template into (head, dynamic, tail, fields).
+
+    The dynamic part is the run of "# " sections that contains every
+    placeholder; head and tail hold no placeholders.
+    """
+    placeholders = [(match.start(), match.group(1)) for match in _PLACEHOLDER.finditer(template)]
+    if not placeholders:
+        return template, "", "", ()
+
+    first, last = placeholders[0][0], placeholders[-1][0]
+    starts = [match.start() for match in _HEADING.finditer(template)]
+    start = max([s for s in starts if s <= first], default=0)
+    end = min([s for s in starts if s > last], default=len(template))
+    fields = tuple(dict.fromkeys(field for _, field in placeholders))
+    return template[:start], template[start:end], template[end:], fields
+
+class CompiledPrompt:
+    """
+    A prompt template split into a static prefix and a per-request suffix.
+
+    The static part (every instruction section without placeholders, in
+    template order) becomes a fixed leading system message, so it is
+    byte-identical across requests and provider-side prompt caching can hit.
+    The sections that hold placeholders (user profile, biomarkers, ...)
+    become the trailing user message.
+    """
+
+    def __init__(self, template: str):
+        head, dynamic, tail, fields = _split_template(template)
+        # The static sections carry no placeholders; format() only unescapes their {{ }}
+        self.static_text = (head.rstrip() + "\n\n" + tail.strip()).strip().format()
+        self.static_hash = _sha256(self.static_text)
+        self.dynamic_template = dynamic.strip()
+        self.fields = fields
+        _STATIC_PREFIX_HASHES[self.static_text] = self.static_hash
+
+    def render_dynamic(self, **values: Any) -> str:
+        """Fill the per-request sections."""
+        return self.dynamic_template.format(**values)
+
+    def parts(self, **values: Any) -> Dict[str, str]:
+        """Both parts of the prompt with their hashes."""
+        dynamic_text = self.render_dynamic(**values)
+        return {
+            "static_text": self.static_text,
+            "static_hash": self.static_hash,
+            "dynamic_text": dynamic_text,
+            "dynamic_hash": _sha256(dynamic_text),
+        }
+
+    def messages(self, **values: Any) -> List[Dict[str, str]]:
+        """Chat messages: the static system message followed by the per-request user message."""
+        return [
+            {"role": "system", "content": self.static_text},
+            {"role": "user", "content": self.render_dynamic(**values)},
+        ]
+
+_COMPILED_PROMPTS = {}
+
+def compiled_prompt(template: str) -> CompiledPrompt:
+    """Return the compiled form of a prompt template, building it on first use."""
+    compiled = _COMPILED_PROMPTS.get(template)
+    if compiled is None:
+        compiled = _COMPILED_PROMPTS[template] = CompiledPrompt(template)
+    return compiled
+
+def static_prefix_hash(messages: list) -> Optional[str]:
+    """Hash of the leading system message if it is the static part of a compiled prompt, else None."""
+    if not messages or messages[0].get("role") != "system":
+        return None
+    return _STATIC_PREFIX_HASHES.get(messages[0].get("content"))
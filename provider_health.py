@@ -0,0 +1,224 @@
+import collections
+import contextlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from llm_events import CIRCUIT, emit
+
+logger = logging.getLogger(__name__)
+
+# Open a circuit after this many consecutive failures...
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+# ...or when at least this share of the recent window failed (once the window has CIRCUIT_MIN_CALLS outcomes)
+CIRCUIT_FAILURE_RATE = float(os.getenv("LLM_CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_MIN_CALLS = int(os.getenv("LLM_CIRCUIT_MIN_CALLS", "10"))
+
+# How long an open circuit rejects calls before letting one probe through; doubles after each failed probe
+CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("LLM_CIRCUIT_COOLDOWN_SECONDS", "30"))
+CIRCUIT_MAX_COOLDOWN_SECONDS = float(os.getenv("LLM_CIRCUIT_MAX_COOLDOWN_SECONDS", "300"))
+
+# Rolling scoreboard window: the most recent outcomes, no older than HEALTH_WINDOW_SECONDS
+HEALTH_WINDOW_SIZE = 50
+HEALTH_WINDOW_SECONDS = 600.0
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused because the model's circuit is open (or its probe is already running)."""
+
+class ProviderUnavailable(Exception):
+    """Raised when every candidate model has an open circuit."""
+
+class ProviderHealth:
+    """
+    Circuit breaker and rolling health record for one model endpoint.
+
+    Closed: calls pass and outcomes are recorded. Too many consecutive
+    failures, or a high failure rate over the window, opens the circuit.
+    Open: calls are refused until the cool-down ends. Half-open: one probe
+    call is let through; success closes the circuit, failure re-opens it
+    with a longer cool-down.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.cooldown = CIRCUIT_COOLDOWN_SECONDS
+        self.opened_until = 0.0
+        self.probe_in_flight = False
+        self.last_error = None
+        # (finished_at, succeeded, latency_seconds)
+        self.outcomes = collections.deque(maxlen=HEALTH_WINDOW_SIZE)
+        self._lock = threading.Lock()
+
+    def _window(self, now: float) -> List[tuple]:
+        return [outcome for outcome in self.outcomes if now - outcome[0] <= HEALTH_WINDOW_SECONDS]
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """Whether a call could be attempted now (closed, or open with the cool-down over and no probe running)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            return now >= self.opened_until and not self.probe_in_flight
+
+    def before_call(self) -> None:
+        """Admit a call or raise CircuitOpenError; moves an expired open circuit to half-open and claims its probe."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if now < self.opened_until or self.probe_in_flight:
+                raise CircuitOpenError(f"Circuit open for {self.model_name}; retry in {max(0.0, self.opened_until - now):.0f}s")
+            self.state = HALF_OPEN
+            self.probe_in_flight = True
+            logger.info("🩺 Probing %s (circuit half-open)", self.model_name)
+            emit(CIRCUIT, model=self.model_name, state=HALF_OPEN)
+
+    def record_success(self, latency: float) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.outcomes.append((now, True, latency))
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                logger.info("✅ Circuit closed for %s", self.model_name)
+                emit(CIRCUIT, model=self.model_name, state=CLOSED)
+            self.state = CLOSED
+            self.cooldown = CIRCUIT_COOLDOWN_SECONDS
+            self.probe_in_flight = False
+
+    def record_failure(self, latency: float, error: Exception) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.outcomes.append((now, False, latency))
+            self.consecutive_failures += 1
+            self.last_error = str(error)[:200]
+            if self.state == HALF_OPEN:
+                self.cooldown = min(self.cooldown * 2, CIRCUIT_MAX_COOLDOWN_SECONDS)
+                self._open(now)
+                return
+            window = self._window(now)
+            failures = sum(1 for _, succeeded, _ in window if not succeeded)
+            if (self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD
+                    or (len(window) >= CIRCUIT_MIN_CALLS and failures / len(window) >= CIRCUIT_FAILURE_RATE)):
+                self._open(now)
+
+    def release_probe(self) -> None:
+        """Give back a half-open probe whose call ended without a health verdict (e.g. a rate limit)."""
+        with self._lock:
+            if self.state == HALF_OPEN and self.probe_in_flight:
+                self.probe_in_flight = False
+                self.state = OPEN
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self.probe_in_flight = False
+        self.opened_until = now + self.cooldown
+        logger.warning("⛔ Circuit opened for %s for %.0fs after %s consecutive failures", self.model_name, self.cooldown, self.consecutive_failures)
+        emit(CIRCUIT, model=self.model_name, state=OPEN, cooldown_seconds=self.cooldown,
+             consecutive_failures=self.consecutive_failures, last_error=self.last_error)
+
+    def latency_percentile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """Latency (seconds) at quantile q of recent successful calls, or None with fewer than min_samples."""
+        now = time.monotonic()
+        with self._lock:
+            latencies = sorted(latency for _, succeeded, latency in self._window(now) if succeeded)
+        return _percentile(latencies, q) if len(latencies) >= min_samples else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Scoreboard row: circuit state, window call count, success rate and latency percentiles (seconds)."""
+        now = time.monotonic()
+        with self._lock:
+            window = self._window(now)
+            latencies = sorted(latency for _, succeeded, latency in window if succeeded)
+            return {
+                "state": self.state,
+                "calls": len(window),
+                "success_rate": (sum(1 for _, succeeded, _ in window if succeeded) / len(window)) if window else None,
+                "p50_latency": _percentile(latencies, 0.50),
+                "p95_latency": _percentile(latencies, 0.95),
+                "consecutive_failures": self.consecutive_failures,
+                "retry_in_seconds": round(max(0.0, self.opened_until - now), 1) if self.state != CLOSED else 0.0,
+                "last_error": self.last_error,
+            }
+
+def _percentile(sorted_values: Sequence[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+_HEALTH = {}
+_HEALTH_LOCK = threading.Lock()
+
+def get_provider_health(model_name: str) -> ProviderHealth:
+    """Return the health record / circuit breaker for a model, created on first use."""
+    with _HEALTH_LOCK:
+        health = _HEALTH.get(model_name)
+        if health is None:
+            health = _HEALTH[model_name] = ProviderHealth(model_name)
+        return health
+
+@contextlib.contextmanager
+def track_provider_call(model_name: str, ignore: Optional[Callable[[Exception], bool]] = None):
+    """
+    Guard one provider call with the model's circuit breaker and record its outcome.
+
+    Raises CircuitOpenError instead of calling when the circuit is open.
+    Errors for which ignore(error) is true (e.g. rate limits) are re-raised
+    without counting against the provider's health.
+    """
+    health = get_provider_health(model_name)
+    health.before_call()
+    started = time.monotonic()
+    try:
+        yield health
+    except Exception as e:
+        if ignore is not None and ignore(e):
+            health.release_probe()
+        else:
+            health.record_failure(time.monotonic() - started, e)
+        raise
+    except BaseException:
+        # Cancelled (e.g. the losing side of a hedged request): no verdict either way
+        health.release_probe()
+        raise
+    else:
+        health.record_success(time.monotonic() - started)
+
+def _ranking_key(snapshot: Dict[str, Any]):
+    # Untried models count as healthy so they get a chance; among equally reliable models the faster p95 wins
+    calls = snapshot["calls"]
+    successes = (snapshot["success_rate"] or 0.0) * calls
+    smoothed_success = (successes + 2) / (calls + 2)
+    p95 = snapshot["p95_latency"]
+    return (-round(smoothed_success, 2), p95 if p95 is not None else float("inf"))
+
+def rank_models(model_name: str, candidates: Sequence[str]) -> List[str]:
+    """
+    Order models to try for a request.
+
+    The requested model goes first unless its circuit is open; the remaining
+    candidates follow by observed success rate, then p95 latency. Models
+    whose circuit is open are left out. Raises ProviderUnavailable if no
+    candidate is available.
+    """
+    now = time.monotonic()
+    others = [m for m in candidates if m != model_name]
+    ranked = sorted(others, key=lambda m: _ranking_key(get_provider_health(m).snapshot()))
+    ordered = [model_name] + ranked
+    available = [m for m in ordered if get_provider_health(m).available(now)]
+    skipped = [m for m in ordered if m not in available]
+    if skipped:
+        logger.warning("⛔ Skipping models with open circuits: %s", ', '.join(skipped))
+    if not available:
+        retry_in = min(get_provider_health(m).snapshot()["retry_in_seconds"] for m in ordered)
+        raise ProviderUnavailable(f"All models are temporarily unavailable (circuits open). Please try again in {retry_in:.0f} seconds.")
+    return available
+
+def provider_scoreboard(models: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    """Current health snapshot per model."""
+    return {model: get_provider_health(model).snapshot() for model in models}
@@ -0,0 +1,249 @@
+import asyncio
+import contextlib
+import contextvars
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from token_budget import count_message_tokens
+
+# How long a request may queue for capacity on its last candidate model before giving up
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT_SECONDS", "30"))
+
+# Output tokens assumed per request when reserving tokens-per-minute budget and
+# the caller did not predict them (see expected_output_scope)
+DEFAULT_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "8192"))
+
+# Cool-down applied after a provider 429 that does not say when to retry
+DEFAULT_RETRY_AFTER_SECONDS = 20.0
+
+_RETRY_AFTER = re.compile(r'retry after (\d+(?:\.\d+)?)\s*(?:second|sec|s\b)', re.IGNORECASE)
+
+def _retry_after_seconds(error: Exception) -> float:
+    """Cool-down for a provider 429: its Retry-After header, a "retry after N seconds" hint, or the default."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        if headers and headers.get("retry-after"):
+            return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        pass
+    match = _RETRY_AFTER.search(str(error))
+    return float(match.group(1)) if match else DEFAULT_RETRY_AFTER_SECONDS
+
+class RateLimitExceeded(Exception):
+    """Raised when no capacity frees up for a model within the allowed wait."""
+
+_expected_output_tokens = contextvars.ContextVar("llm_expected_output_tokens", default=None)
+
+@contextlib.contextmanager
+def expected_output_scope(tokens: Optional[int]):
+    """Reserve tokens (a predicted completion size, see token_budget) for the output of requests made in this block."""
+    token = _expected_output_tokens.set(tokens)
+    try:
+        yield
+    finally:
+        _expected_output_tokens.reset(token)
+
+def estimate_request_tokens(messages: list, expected_output_tokens: Optional[int] = None) -> int:
+    """
+    Estimate the tokens a request will consume: prompt size plus the expected completion.
+
+    The completion defaults to the prediction of the enclosing
+    expected_output_scope, or DEFAULT_EXPECTED_OUTPUT_TOKENS outside one.
+    """
+    if expected_output_tokens is None:
+        expected_output_tokens = _expected_output_tokens.get() or DEFAULT_EXPECTED_OUTPUT_TOKENS
+    return count_message_tokens(messages) + expected_output_tokens
+
+class TokenBucket:
+    """Bucket holding up to capacity units that refills continuously at capacity per minute."""
+
+    def __init__(self, capacity_per_minute: float):
+        self.capacity = float(capacity_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now: float) -> float:
+        self._refill(now)
+        return self.tokens
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount units are available (requests larger than capacity only need a full bucket)."""
+        self._refill(now)
+        needed = min(amount, self.capacity) - self.tokens
+        return 0.0 if needed <= 0 else needed / self.rate
+
+    def consume(self, amount: float, now: float) -> None:
+        """Take amount units; may go negative so oversized requests are paid back over time."""
+        self._refill(now)
+        self.tokens -= amount
+
+    def refund(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class Reservation:
+    """Capacity held by one in-flight request."""
+
+    def __init__(self, limiter: "ModelRateLimiter", tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.actual_tokens = None
+        self.requests = 1
+        self.released = False
+
+class ModelRateLimiter:
+    """
+    Client-side rate governor for one model.
+
+    Tracks requests per minute and tokens per minute with token buckets and
+    caps concurrent requests. Requests reserve their estimated tokens up front
+    and settle against actual usage when they finish. Any of rpm / tpm /
+    max_concurrency may be None to leave that dimension unlimited.
+    """
+
+    def __init__(self, model_name: str, rpm: Optional[int] = None, tpm: Optional[int] = None, max_concurrency: Optional[int] = None):
+        self.model_name = model_name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _wait_time_locked(self, tokens: int, now: float) -> float:
+        wait = max(0.0, self.blocked_until - now)
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            # Unknown until a request finishes; poll again shortly
+            wait = max(wait, 0.25)
+        return wait
+
+    def wait_time(self, tokens: int) -> float:
+        """Seconds until a request of this size could start (0 if it can start now)."""
+        with self._lock:
+            return self._wait_time_locked(tokens, time.monotonic())
+
+    def blocked_for(self) -> float:
+        """Seconds left of the cool-down after a provider 429 (0 if none)."""
+        with self._lock:
+            return max(0.0, self.blocked_until - time.monotonic())
+
+    def try_acquire(self, tokens: int) -> Optional[Reservation]:
+        """Reserve capacity for a request if it is available right now, else return None."""
+        with self._lock:
+            now = time.monotonic()
+            if self._wait_time_locked(tokens, now) > 0:
+                return None
+            if self.requests:
+                self.requests.consume(1, now)
+            if self.tokens:
+                self.tokens.consume(tokens, now)
+            self.in_flight += 1
+            return Reservation(self, tokens)
+
+    def acquire(self, tokens: int, timeout: float = RATE_LIMIT_MAX_WAIT_SECONDS) -> Reservation:
+        """Reserve capacity, waiting up to timeout seconds for it to free up."""
+        deadline = time.monotonic() + timeout
+        while True:
+            reservation = self.try_acquire(tokens)
+            if reservation is not None:
+                return reservation
+            wait = self.wait_time(tokens)
+            if time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(f"Client rate limit reached for {self.model_name}; no capacity within {timeout:.0f}s")
+            time.sleep(min(wait, 1.0))
+
+    async def aacquire(self, tokens: int, timeout: float = RATE_LIMIT_MAX_WAIT_SECONDS) -> Reservation:
+        """Async variant of acquire that yields to the event loop while queued."""
+        deadline = time.monotonic() + timeout
+        while True:
+            reservation = self.try_acquire(tokens)
+            if reservation is not None:
+                return reservation
+            wait = self.wait_time(tokens)
+            if time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(f"Client rate limit reached for {self.model_name}; no capacity within {timeout:.0f}s")
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, reservation: Reservation) -> None:
+        """Finish a request, settling the token budget against actual usage when it is known."""
+        with self._lock:
+            if reservation.released:
+                return
+            reservation.released = True
+            now = time.monotonic()
+            self.in_flight = max(0, self.in_flight - 1)
+            if self.requests and reservation.requests == 0:
+                self.requests.refund(1, now)
+            if self.tokens and reservation.actual_tokens is not None:
+                difference = reservation.tokens - reservation.actual_tokens
+                if difference > 0:
+                    self.tokens.refund(difference, now)
+                else:
+                    self.tokens.consume(-difference, now)
+
+    def note_rate_limited(self, error: Exception) -> None:
+        """Pause this model after a provider 429, honouring a retry-after hint in the error if present."""
+        delay = _retry_after_seconds(error)
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+    def headroom(self) -> Dict[str, Any]:
+        """Current capacity: requests and tokens available now, in-flight count and any cool-down."""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "requests_available": int(self.requests.available(now)) if self.requests else None,
+                "requests_per_minute": int(self.requests.capacity) if self.requests else None,
+                "tokens_available": int(self.tokens.available(now)) if self.tokens else None,
+                "tokens_per_minute": int(self.tokens.capacity) if self.tokens else None,
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "blocked_for_seconds": round(max(0.0, self.blocked_until - now), 1),
+            }
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+def get_rate_limiter(model_name: str, config: Optional[Dict[str, Any]] = None) -> ModelRateLimiter:
+    """Return the limiter for a model, created from its rpm / tpm / max_concurrency config on first use."""
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(model_name)
+        if limiter is None:
+            config = config or {}
+            limiter = _LIMITERS[model_name] = ModelRateLimiter(
+                model_name, config.get("rpm"), config.get("tpm"), config.get("max_concurrency"))
+        return limiter
+
+_current_reservation = contextvars.ContextVar("llm_rate_reservation", default=None)
+
+@contextlib.contextmanager
+def reservation_scope(reservation: Reservation):
+    """Make reservation the target of record_usage for calls made inside this block, releasing it at the end."""
+    token = _current_reservation.set(reservation)
+    try:
+        yield reservation
+    finally:
+        _current_reservation.reset(token)
+        reservation.limiter.release(reservation)
+
+def record_usage(model_name: str, total_tokens: Optional[int], made_request: bool = True) -> None:
+    """Report actual usage of the request running under the current reservation (no-op outside one)."""
+    reservation = _current_reservation.get()
+    if reservation is None or reservation.limiter.model_name != model_name:
+        return
+    if total_tokens is not None:
+        reservation.actual_tokens = total_tokens
+    if not made_request:
+        reservation.requests = 0
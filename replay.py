@@ -0,0 +1,212 @@
+"""
+Replay stored raw LLM responses through the post-processing pipeline.
+
+Every saved report keeps the raw completion text it was parsed from (see
+llm_utils.save_response). This re-runs parsing, repair, field fixing,
+escalation and timeline validation on those texts with the current code,
+in parallel, and compares each new result with the stored one. Use it
+before changing validate_and_fix_json_fields, validate_six_month_timeline
+or the repair strategies to see exactly which past reports would change.
+
+    python replay.py                                  # every report in the result store
+    python replay.py --model azure/o1 --since 2025-08-01 --limit 2000
+    python replay.py --json 'llm_results/*.json'      # reports saved with RESULT_STORE_BACKEND=json
+    python replay.py --workers 8 --output replay.json --show 20
+
+Exits with status 1 if any report now fails to parse (or errors) where the
+stored run did not.
+"""
+import argparse
+import collections
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+from llm_events import llm_call_scope
+from llm_utils import reprocess_raw_response
+from models import HealthVizorResponse
+from result_store import RESULT_STORE_PATH, ResultStore
+
+# Repair strategies that mean the response could not really be parsed
+FALLBACK_STRATEGIES = ("enhanced_fallback", "minimal_fallback", "text_fallback")
+
+# Replay outcomes
+UNCHANGED = "unchanged"
+CHANGED = "changed"
+FIXED = "fixed"              # stored run fell back, replay parses
+NEW_FAILURE = "new_failure"  # stored run parsed, replay falls back
+ERROR = "error"              # replay raised
+
+_INDEX = re.compile(r'\[\d+\]')
+
+def _normalize(value: Any) -> Any:
+    if hasattr(value, 'model_dump'):
+        value = value.model_dump()
+    return json.loads(json.dumps(value, ensure_ascii=False, default=str))
+
+def diff_values(old: Any, new: Any, path: str = "", limit: int = 50) -> List[Dict[str, str]]:
+    """
+    Paths where new differs from old ("added", "removed" or "changed"), at
+    most limit of them. A None field and a missing one count as equal (the
+    result store does not keep None fields).
+    """
+    diffs = []
+
+    def walk(a, b, here):
+        if len(diffs) >= limit:
+            return
+        if isinstance(a, dict) and isinstance(b, dict):
+            for key in list(a) + [key for key in b if key not in a]:
+                child = f"{here}.{key}" if here else key
+                if a.get(key) is None and b.get(key) is None:
+                    continue
+                if key not in b:
+                    diffs.append({"path": child, "kind": "removed"})
+                elif key not in a:
+                    diffs.append({"path": child, "kind": "added"})
+                else:
+                    walk(a[key], b[key], child)
+        elif isinstance(a, list) and isinstance(b, list):
+            for i in range(max(len(a), len(b))):
+                child = f"{here}[{i}]"
+                if i >= len(b):
+                    diffs.append({"path": child, "kind": "removed"})
+                elif i >= len(a):
+                    diffs.append({"path": child, "kind": "added"})
+                else:
+                    walk(a[i], b[i], child)
+        elif a != b:
+            diffs.append({"path": here, "kind": "changed"})
+
+    walk(old, new, path)
+    return diffs
+
+def _is_fallback(result: Any, strategy: Optional[str]) -> bool:
+    return strategy in FALLBACK_STRATEGIES or (isinstance(result, dict) and bool(result.get("_parsing_error")))
+
+def replay_one(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Replay one stored report; returns its outcome, repair strategies, diffs and timing."""
+    raw = item["raw_response"]
+    record = {"id": item["id"], "model": item["model"], "old_strategy": raw.get("repair_strategy")}
+    started = time.perf_counter()
+    try:
+        with llm_call_scope(item["model"], raw.get("provider")) as call:
+            result = reprocess_raw_response(raw, item["model"], HealthVizorResponse)
+        record["new_strategy"] = call.get("repair_strategy")
+    except Exception as e:
+        record.update(status=ERROR, error=f"{type(e).__name__}: {e}", seconds=time.perf_counter() - started)
+        return record
+    record["seconds"] = time.perf_counter() - started
+
+    new_result = _normalize(result)
+    old_result = _normalize(item["result"])
+    failed_before = _is_fallback(old_result, record["old_strategy"])
+    failed_now = _is_fallback(new_result, record["new_strategy"])
+    record["diffs"] = diff_values(old_result, new_result)
+    if failed_now and not failed_before:
+        record["status"] = NEW_FAILURE
+    elif failed_before and not failed_now:
+        record["status"] = FIXED
+    else:
+        record["status"] = CHANGED if record["diffs"] else UNCHANGED
+    return record
+
+def _store_items(store_path: str, model_name: Optional[str], since: Optional[str], limit: Optional[int]) -> Iterator[Dict[str, Any]]:
+    for report in ResultStore(store_path).iter_raw_responses(model_name, since, limit):
+        yield {"id": report["id"], "model": report["ai_model_used"], "raw_response": report["raw_response"],
+               "result": report["result"]}
+
+def _json_items(pattern: str, model_name: Optional[str], since: Optional[str]) -> Iterator[Dict[str, Any]]:
+    for path in sorted(glob.glob(pattern)):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if not isinstance(data, dict) or not data.get("raw_response") or "result" not in data:
+            continue
+        if model_name is not None and data.get("model_name") != model_name:
+            continue
+        if since is not None and (data.get("timestamp") or "") < since:
+            continue
+        yield {"id": os.path.basename(path), "model": data.get("model_name") or "unknown",
+               "raw_response": data["raw_response"], "result": data["result"]}
+
+def _quiet_worker() -> None:
+    # Repairs log at INFO/ERROR for every replayed response; keep worker output to the summary
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+def run_replay(items: List[Dict[str, Any]], workers: int) -> List[Dict[str, Any]]:
+    """Replay items over a process pool (post-processing is CPU-bound), preserving order."""
+    if workers <= 1:
+        _quiet_worker()
+        return [replay_one(item) for item in items]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_quiet_worker) as executor:
+        return list(executor.map(replay_one, items, chunksize=max(1, min(16, len(items) // (workers * 4)))))
+
+def summarize_replay(records: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """Throughput, outcome counts, strategy transitions and the most frequently changed fields."""
+    timings = sorted(record["seconds"] for record in records)
+    changed_paths = collections.Counter(_INDEX.sub("[]", diff["path"])
+                                        for record in records for diff in record.get("diffs", []))
+    return {
+        "replayed": len(records),
+        "wall_seconds": round(wall_seconds, 2),
+        "replays_per_second": round(len(records) / wall_seconds, 1) if wall_seconds > 0 else None,
+        "p50_ms": round(timings[len(timings) // 2] * 1000, 2) if timings else None,
+        "p95_ms": round(timings[min(len(timings) - 1, int(0.95 * len(timings)))] * 1000, 2) if timings else None,
+        "outcomes": dict(collections.Counter(record["status"] for record in records)),
+        "strategy_changes": dict(collections.Counter(
+            f"{record['old_strategy']} -> {record.get('new_strategy')}" for record in records
+            if record["status"] != ERROR and record["old_strategy"] != record.get("new_strategy"))),
+        "changed_fields": dict(changed_paths.most_common(20)),
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay stored raw LLM responses through post-processing.")
+    parser.add_argument("--store", default=RESULT_STORE_PATH, help="result store to read (default: %(default)s)")
+    parser.add_argument("--json", metavar="GLOB", help="read llm_results-style JSON files instead of the result store")
+    parser.add_argument("--model", help="only replay reports from this model")
+    parser.add_argument("--since", help="only replay reports generated on or after this ISO date")
+    parser.add_argument("--limit", type=int, help="replay at most this many reports")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--show", type=int, default=10, help="reports to list per notable outcome")
+    parser.add_argument("--output", help="also write every replay record as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if args.json:
+        items = list(_json_items(args.json, args.model, args.since))[:args.limit]
+    else:
+        items = list(_store_items(args.store, args.model, args.since, args.limit))
+    if not items:
+        print("No stored raw responses to replay")
+        return 0
+    print(f"Replaying {len(items)} responses on {args.workers} worker(s)...", flush=True)
+
+    started = time.perf_counter()
+    records = run_replay(items, args.workers)
+    summary = summarize_replay(records, time.perf_counter() - started)
+    print(json.dumps(summary, indent=2))
+
+    for status in (NEW_FAILURE, ERROR, FIXED, CHANGED):
+        matching = [record for record in records if record["status"] == status]
+        if not matching:
+            continue
+        print(f"\n{status} ({len(matching)}):")
+        for record in matching[:args.show]:
+            detail = record.get("error") or ", ".join(f"{diff['kind']} {diff['path']}" for diff in record["diffs"][:5])
+            print(f"  {record['id']} [{record['model']}] {record['old_strategy']} -> {record.get('new_strategy')}: {detail}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"summary": summary, "records": records}, f, indent=2, ensure_ascii=False)
+    return 1 if summary["outcomes"].get(NEW_FAILURE) or summary["outcomes"].get(ERROR) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
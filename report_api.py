@@ -0,0 +1,134 @@
+"""
+Headless HTTP API for report generation.
+
+    uvicorn report_api:app --workers 1 --port 8000
+
+POST /reports                 queue a report (ReportRequest body), returns the job id
+GET  /reports/{job_id}        job status, and the HealthVizorResponse once finished
+GET  /reports/{job_id}/events server-sent events: each insight as it arrives ("reset" drops those
+                              received so far after a fallback), then "done" or "error"
+POST /reports/{job_id}/update regenerate only the sections of a finished report whose inputs changed
+GET  /health                  job queue and provider circuit state
+GET  /metrics                 LLM metrics in Prometheus text format
+
+Jobs run on the in-process worker pool of report_jobs, so run one worker
+process per instance (scale out with more instances behind a load
+balancer; set REPORT_JOBS_DB per instance to survive restarts).
+"""
+import asyncio
+import json
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from llm_events import render_prometheus
+from llm_utils import get_provider_scoreboard
+from report_jobs import SUCCEEDED, get_job_queue
+from report_service import ReportRequest, submit_report, submit_report_update, validate_report
+
+# Seconds between job polls of an open event stream
+EVENT_POLL_SECONDS = 0.5
+
+app = FastAPI(title="HealthVizor report API")
+
+def _job_or_404(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None or job.kind != "report":
+        raise HTTPException(status_code=404, detail=f"Unknown report job {job_id}")
+    return job
+
+def _job_status(job) -> dict:
+    status = {
+        "job_id": job.id,
+        "status": job.status,
+        "model": job.params.get("model"),
+        "elapsed_seconds": round(job.elapsed_seconds, 1),
+        "items": len(job.items),
+        "error": job.error,
+        "notes": {key: value for key, value in job.notes.items() if key != "stage_timings"},
+    }
+    if job.status == SUCCEEDED:
+        status["result"] = validate_report(job.result).model_dump()
+    return status
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@app.post("/reports", status_code=202)
+async def create_report(request: ReportRequest):
+    # Prompt building and token planning are CPU work; keep them off the event loop
+    try:
+        job, plan = await asyncio.to_thread(submit_report, request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "deduplicated": plan is None,
+        "strategy": job.params.get("strategy"),
+        "prompt_tokens": plan["prompt_tokens"] if plan else None,
+        "predicted_output_tokens": plan["predicted_output_tokens"] if plan else None,
+        "position": get_job_queue().position(job),
+    }
+
+@app.get("/reports/{job_id}")
+async def get_report(job_id: str):
+    return _job_status(_job_or_404(job_id))
+
+@app.get("/reports/{job_id}/events")
+async def report_events(job_id: str):
+    job = _job_or_404(job_id)
+
+    async def stream():
+        sent = 0
+        resets = 0
+        last_status = None
+        while True:
+            if job.status != last_status:
+                last_status = job.status
+                yield _sse("status", {"status": job.status})
+            job_resets, items = job.item_updates(sent, resets)
+            if job_resets != resets:
+                # The model streaming the items failed over: the client drops what it has received
+                resets, sent = job_resets, 0
+                yield _sse("reset", {})
+            for path, item in items:
+                sent += 1
+                yield _sse("item", {"path": path, "item": item})
+            if job.done:
+                if job.status == SUCCEEDED:
+                    yield _sse("done", _job_status(job))
+                else:
+                    yield _sse("error", {"error": job.error})
+                return
+            await asyncio.sleep(EVENT_POLL_SECONDS)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/reports/{job_id}/update", status_code=202)
+async def update_report(job_id: str, request: ReportRequest):
+    previous = _job_or_404(job_id)
+    if previous.status != SUCCEEDED or not previous.params.get("inputs"):
+        raise HTTPException(status_code=409, detail=f"Report job {job_id} has no finished report to update")
+    previous_request = ReportRequest.model_validate(previous.params["inputs"])
+    try:
+        job, plan = await asyncio.to_thread(submit_report_update, previous_request, previous.result, request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "job_id": job.id if job else None,
+        "status": job.status if job else "unchanged",
+        "strategy": job.params.get("strategy") if job else None,
+        "reasons": plan["reasons"],
+        "calls": 0 if job is None else plan["calls"],
+        "full_calls": plan["full_calls"],
+        "position": get_job_queue().position(job) if job else None,
+    }
+
+@app.get("/health")
+async def health():
+    return {"jobs": get_job_queue().stats(), "providers": get_provider_scoreboard()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,427 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from biomarkers import parse_biomarkers
+from incremental import regenerate_report
+from llm_cache import cache_bypass
+from llm_events import LLM_CALL, LLM_REQUEST, capture_events
+from llm_utils import call_llm_hedged, call_llm_stream_with_fallback, call_llm_with_fallback
+from models import HealthVizorResponse
+from rate_limiter import expected_output_scope
+from report_sections import DEFAULT_BIOMARKER_CHUNK_SIZE, generate_sectioned_report
+from token_budget import predict_output_tokens
+from tracing import start_trace
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "2"))
+# Optional SQLite file that makes the queue persistent: unfinished jobs are resumed when the process restarts
+REPORT_JOBS_DB = os.getenv("REPORT_JOBS_DB")
+# Finished jobs are dropped from memory after this long (they stay in REPORT_JOBS_DB)
+JOB_RETENTION_SECONDS = int(os.getenv("REPORT_JOB_RETENTION_SECONDS", "3600"))
+
+def job_key(kind: str, inputs: Any) -> str:
+    """Deduplication key: SHA-256 over the job kind and its canonical JSON inputs."""
+    digest = hashlib.sha256(kind.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+class Job:
+    """
+    One unit of background work.
+
+    params must be JSON-serializable so the job can be persisted and resumed.
+    Handlers report progress through add_item() (partial results such as
+    streamed insights, kept in memory only) and notes (small JSON facts
+    such as the model that answered, stored with the result).
+    """
+
+    def __init__(self, kind: str, params: Dict[str, Any], key: Optional[str] = None, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.key = key or job_key(kind, params)
+        self.params = params
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.notes = {}
+        self.items = []
+        self.item_resets = 0
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.status not in ACTIVE_STATES
+
+    @property
+    def elapsed_seconds(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def add_item(self, path: str, item: Any) -> None:
+        """Publish a partial result (e.g. one streamed BiomarkerInsight) to pollers."""
+        if hasattr(item, 'model_dump'):
+            item = item.model_dump()
+        with self._lock:
+            self.items.append((path, item))
+
+    def reset_items(self) -> None:
+        """Drop the partial results published so far (the call that produced them failed over to another model)."""
+        with self._lock:
+            self.items = []
+            self.item_resets += 1
+
+    def items_since(self, start: int = 0) -> List[Any]:
+        with self._lock:
+            return list(self.items[start:])
+
+    def item_updates(self, start: int, resets: int) -> Tuple[int, List[Any]]:
+        """
+        Partial results a poller has not seen yet, as (resets, items).
+
+        start is how many items the poller has received and resets the reset
+        count it last saw. If the items were reset since, the new reset count
+        is returned with all current items, and the poller starts over.
+        """
+        with self._lock:
+            if resets != self.item_resets:
+                return self.item_resets, list(self.items)
+            return resets, list(self.items[start:])
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "key": self.key,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "notes": self.notes,
+            "items": len(self.items),
+        }
+
+# Job kind -> handler(job) returning a JSON-serializable result
+_HANDLERS: Dict[str, Callable[[Job], Any]] = {}
+
+def register_handler(kind: str, handler: Callable[[Job], Any]) -> None:
+    """Register the function that runs jobs of the given kind."""
+    _HANDLERS[kind] = handler
+
+_STOP = object()
+
+class JobQueue:
+    """
+    In-process worker pool fed from a FIFO queue, optionally persisted to SQLite.
+
+    Jobs run on worker threads, independent of any Streamlit script run, so
+    they survive reruns and reconnects; pollers look them up by id. Submitting
+    a job whose key matches a queued or running job returns that job instead
+    of starting a duplicate.
+    """
+
+    def __init__(self, workers: int = REPORT_JOB_WORKERS, db_path: Optional[str] = REPORT_JOBS_DB):
+        self.db_path = db_path
+        self._jobs: Dict[str, Job] = {}
+        self._queue = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._initialized = False
+        if db_path:
+            self._resume()
+        self.set_workers(workers)
+
+    # Persistence
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    result TEXT,
+                    error TEXT,
+                    notes TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs(key, status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def _persist(self, job: Job) -> None:
+        if not self.db_path:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO jobs (id, kind, key, params, status, created_at, started_at, finished_at, result, error, notes) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job.id, job.kind, job.key, json.dumps(job.params, ensure_ascii=False, default=str), job.status,
+                     job.created_at, job.started_at, job.finished_at,
+                     json.dumps(job.result, ensure_ascii=False, default=str) if job.result is not None else None,
+                     job.error, json.dumps(job.notes, ensure_ascii=False, default=str))
+                )
+        except sqlite3.Error as e:
+            logger.error("❌ Failed to persist job %s: %s", job.id, e)
+        finally:
+            conn.close()
+
+    def _job_from_row(self, row) -> Job:
+        job_id, kind, key, params, status, created_at, started_at, finished_at, result, error, notes = row
+        job = Job(kind, json.loads(params), key, job_id)
+        job.status = status
+        job.created_at, job.started_at, job.finished_at = created_at, started_at, finished_at
+        job.result = json.loads(result) if result else None
+        job.error = error
+        job.notes = json.loads(notes) if notes else {}
+        return job
+
+    def _resume(self) -> None:
+        """Re-queue jobs that were queued or running when the process stopped."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, kind, key, params, status, created_at, started_at, finished_at, result, error, notes "
+                "FROM jobs WHERE status IN (?, ?) ORDER BY created_at", ACTIVE_STATES
+            ).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            job = self._job_from_row(row)
+            job.status, job.started_at = QUEUED, None
+            self._jobs[job.id] = job
+            self._queue.put(job)
+        if rows:
+            logger.info("♻️ Resumed %s unfinished job(s)", len(rows))
+
+    # Workers
+
+    def set_workers(self, workers: int) -> None:
+        """Grow or shrink the worker pool (shrinking lets running jobs finish first)."""
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for _ in range(workers - len(self._threads)):
+                thread = threading.Thread(target=self._work, name=f"report-job-worker-{len(self._threads) + 1}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            for _ in range(len(self._threads) - workers):
+                self._queue.put(_STOP)
+
+    @property
+    def workers(self) -> int:
+        return sum(1 for thread in self._threads if thread.is_alive())
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: Job) -> None:
+        handler = _HANDLERS.get(job.kind)
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._persist(job)
+        logger.info("⚙️ Job %s (%s) started", job.id, job.kind)
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind '{job.kind}'")
+            job.result = handler(job)
+            job.status = SUCCEEDED
+            logger.info("✅ Job %s finished in %.1fs", job.id, time.time() - job.started_at)
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+            logger.error("❌ Job %s failed: %s", job.id, e)
+        job.finished_at = time.time()
+        self._persist(job)
+        self._prune()
+
+    def _prune(self) -> None:
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.done and job.finished_at < cutoff]:
+                del self._jobs[job_id]
+
+    # Public API
+
+    def active_job(self, key: str) -> Optional[Job]:
+        """The queued or running job with this key, if any."""
+        with self._lock:
+            return next((job for job in self._jobs.values() if job.key == key and not job.done), None)
+
+    def submit(self, kind: str, params: Dict[str, Any], key: Optional[str] = None) -> Job:
+        """Queue a job, or return the queued / running job with the same key."""
+        key = key or job_key(kind, params)
+        with self._lock:
+            for job in self._jobs.values():
+                if job.key == key and not job.done:
+                    logger.info("🔁 Job %s already %s, not starting a duplicate", job.id, job.status)
+                    return job
+            job = Job(kind, params, key)
+            self._jobs[job.id] = job
+        self._persist(job)
+        self._queue.put(job)
+        logger.info("📥 Queued job %s (%s), %s ahead", job.id, kind, self._queue.qsize() - 1)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """The job with this id, from memory or (for older jobs) from REPORT_JOBS_DB."""
+        job = self._jobs.get(job_id)
+        if job is not None or not self.db_path:
+            return job
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT id, kind, key, params, status, created_at, started_at, finished_at, result, error, notes FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return self._job_from_row(row) if row else None
+
+    def position(self, job: Job) -> int:
+        """Number of queued jobs ahead of this one (0 once it is running)."""
+        if job.status != QUEUED:
+            return 0
+        with self._lock:
+            return sum(1 for other in self._jobs.values() if other.status == QUEUED and other.created_at < job.created_at)
+
+    def jobs(self, status: Optional[str] = None) -> List[Job]:
+        """Jobs held in memory, oldest first."""
+        with self._lock:
+            return sorted((job for job in self._jobs.values() if status is None or job.status == status),
+                          key=lambda job: job.created_at)
+
+    def stats(self) -> Dict[str, Any]:
+        counts = {state: 0 for state in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+        for job in self.jobs():
+            counts[job.status] += 1
+        return {"workers": self.workers, **counts}
+
+_default_queue = None
+_default_queue_lock = threading.Lock()
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue (shared by every Streamlit session)."""
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            _default_queue = JobQueue()
+        return _default_queue
+
+def summarize_llm_events(events: list, requested_model: str) -> Dict[str, Any]:
+    """Fallbacks, hedge wins and token / cost totals from the LLM events of one report."""
+    requests_done = [event for event in events if event.kind == LLM_REQUEST]
+    calls = [event for event in events if event.kind == LLM_CALL and event.get("outcome") == "ok"]
+    return {
+        "fallback_models": sorted({event.get("model_used") for event in requests_done
+                                   if event.get("model_used") != requested_model and not event.get("hedge_won")} - {None}),
+        "fallback_reasons": sorted({hop["reason"] for event in requests_done for hop in event.get("hops", [])}),
+        "hedge_winners": sorted({event.get("model_used") for event in requests_done if event.get("hedge_won")} - {None}),
+        "calls": len(calls),
+        "total_tokens": sum(event.get("total_tokens") or 0 for event in calls),
+        "cost": sum(event.get("cost") or 0 for event in calls),
+    }
+
+def run_report_job(job: Job) -> Dict[str, Any]:
+    """
+    Generate a HealthVizorResponse for a "report" job.
+
+    params: model, messages, user_context (without the biomarker table),
+    biomarkers_data, strategy ("sectioned", "hedged", "stream", "single" or
+    "incremental"), chunk_size, bypass_cache and trace (record stage
+    timings). Incremental jobs also carry previous_report and the
+    incremental plan (see incremental.plan_incremental).
+    """
+    params = job.params
+    model_name = params["model"]
+    messages = params["messages"]
+    biomarker_table = parse_biomarkers(params.get("biomarkers_data", ""))
+    user_context = {**params.get("user_context", {}), "biomarker_table": biomarker_table}
+    strategy = params.get("strategy", "single")
+
+    def on_section(label, result):
+        section_data = result.model_dump() if hasattr(result, 'model_dump') else result
+        for insight in section_data.get('category_insights', []) or []:
+            job.add_item("category_insights[]", insight)
+        for insight in section_data.get('biomarker_insights', []) or []:
+            job.add_item("biomarker_insights[]", insight)
+        for supp in (section_data.get('action_plan') or {}).get('supplements', []) or []:
+            job.add_item("action_plan.supplements[]", supp)
+
+    trace = start_trace("report_job", model=model_name, strategy=strategy) if params.get("trace") else None
+    try:
+        # Full-report calls reserve rate-limit budget for the predicted report size (section calls set their own)
+        expected_output = predict_output_tokens(len(biomarker_table), len(biomarker_table.all_categories()))
+        with capture_events() as llm_events, cache_bypass(params.get("bypass_cache", False)), expected_output_scope(expected_output):
+            if strategy == "sectioned":
+                report = generate_sectioned_report(model_name, messages, biomarker_table.names, HealthVizorResponse, user_context,
+                                                   chunk_size=params.get("chunk_size") or DEFAULT_BIOMARKER_CHUNK_SIZE,
+                                                   on_section=on_section)
+            elif strategy == "incremental":
+                report = regenerate_report(model_name, messages, params["previous_report"], params["incremental_plan"],
+                                           HealthVizorResponse, user_context,
+                                           chunk_size=params.get("chunk_size") or DEFAULT_BIOMARKER_CHUNK_SIZE,
+                                           on_section=on_section)
+            elif strategy == "hedged":
+                report = call_llm_hedged(model_name, messages, HealthVizorResponse, user_context)
+            elif strategy == "stream":
+                report = call_llm_stream_with_fallback(model_name, messages, HealthVizorResponse, user_context, on_item=job.add_item,
+                                                       on_reset=job.reset_items)
+            else:
+                report = call_llm_with_fallback(model_name, messages, HealthVizorResponse, user_context)
+    finally:
+        if trace is not None:
+            trace.finish()
+            job.notes["trace_paths"] = trace.write()
+            job.notes["stage_timings"] = trace.summary()
+
+    job.notes.update(summarize_llm_events(llm_events, model_name))
+    if hasattr(report, 'model_dump'):
+        return report.model_dump()
+    if hasattr(report, 'dict'):
+        return report.dict()
+    return report
+
+register_handler("report", run_report_job)
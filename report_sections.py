@@ -0,0 +1,267 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Type
+
+from pydantic import BaseModel, create_model
+
+from llm_events import LLM_REQUEST, capture_events
+from llm_utils import (
+    acall_llm_with_fallback,
+    aclose_async_clients,
+    get_rate_headroom,
+    save_response,
+    validate_and_fix_json_fields,
+    validate_escalation_logic,
+    validate_six_month_timeline,
+)
+from models import HealthVizorResponse
+from rate_limiter import expected_output_scope
+from schema_registry import compiled_schema
+from token_budget import predict_section_output_tokens
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Number of biomarkers generated per biomarker_insights section call
+DEFAULT_BIOMARKER_CHUNK_SIZE = 12
+
+# Independent report sections and the HealthVizorResponse fields each one produces
+REPORT_SECTIONS = {
+    "overview": {
+        "fields": [
+            "overall_health_summary",
+            "congratulations_message",
+            "wins_to_celebrate",
+            "what_to_continue",
+            "what_needs_work",
+            "top_3_priorities_detailed",
+            "biomarker_snapshot",
+            "goal_relevance",
+            "longevity_performance_impact",
+            "biomarker_pattern_analysis",
+        ],
+        "instruction": "Generate ONLY the overall health summary part of the report: the summary, congratulations message, wins, what to continue, what needs work, the detailed top 3 priorities, the biomarker snapshot, goal relevance, longevity/performance impact and the multi-marker biomarker pattern analysis. Base them on ALL biomarkers and categories provided.",
+    },
+    "categories": {
+        "fields": ["category_insights"],
+        "instruction": "Generate ONLY category_insights, with a comprehensive insight for EACH health category provided.",
+        "subset_instruction": "Generate ONLY category_insights, with one comprehensive insight for EACH of these health categories and no others: {category_names}.",
+    },
+    "biomarkers": {
+        "fields": ["biomarker_insights"],
+        "instruction": "Generate ONLY biomarker_insights, with one detailed insight for EACH of these biomarkers and no others: {biomarker_names}.",
+    },
+    "action_plan": {
+        "fields": ["action_plan"],
+        "instruction": "Generate ONLY the action_plan: supplements, supplement schedule summary, nutrition, exercise & lifestyle and the 6-month timeline.",
+    },
+}
+
+SECTION_PREAMBLE = """
+# SECTIONED GENERATION
+This request is one part of a report that is generated in parallel sections and merged afterwards.
+Ignore any instruction above that asks for the other report sections - they are generated separately.
+{instruction}
+Respond with a JSON object containing ONLY the fields in the schema below.
+"""
+
+_SECTION_MODELS = {}
+
+def get_section_model(section: str, response_format: Type[BaseModel] = HealthVizorResponse) -> Type[BaseModel]:
+    """Build (once) a Pydantic model holding only the fields of one report section."""
+    key = (response_format, section)
+    if key not in _SECTION_MODELS:
+        fields = {
+            name: (response_format.model_fields[name].annotation, response_format.model_fields[name])
+            for name in REPORT_SECTIONS[section]["fields"]
+        }
+        model_name = f"{response_format.__name__}{section.title().replace('_', '')}Section"
+        _SECTION_MODELS[key] = create_model(model_name, **fields)
+    return _SECTION_MODELS[key]
+
+def chunk_biomarker_names(biomarker_names: List[str], chunk_size: int = DEFAULT_BIOMARKER_CHUNK_SIZE) -> List[List[str]]:
+    """Split biomarker names into chunks of at most chunk_size."""
+    chunk_size = max(1, chunk_size)
+    return [biomarker_names[i:i + chunk_size] for i in range(0, len(biomarker_names), chunk_size)]
+
+def build_section_requests(messages: list, biomarker_names: List[str], chunk_size: int = DEFAULT_BIOMARKER_CHUNK_SIZE,
+                           sections: Optional[List[str]] = None,
+                           category_names: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Build one request per report section.
+
+    Returns a list of dicts with the section key, a label for progress display,
+    the messages to send (the original messages with the section
+    instruction appended to the last user message) and the number of
+    biomarkers / categories it covers ("item_count", None for all
+    categories). If category_names is given, the categories section only
+    covers those categories.
+    """
+    sections = sections or list(REPORT_SECTIONS.keys())
+    requests = []
+    for section in sections:
+        if section == "biomarkers":
+            chunks = chunk_biomarker_names(biomarker_names, chunk_size)
+            for index, chunk in enumerate(chunks):
+                instruction = REPORT_SECTIONS[section]["instruction"].format(biomarker_names=", ".join(chunk))
+                requests.append({
+                    "section": section,
+                    "label": f"biomarkers {index + 1}/{len(chunks)}",
+                    "messages": _with_section_instruction(messages, instruction),
+                    "item_count": len(chunk),
+                })
+        elif section == "categories" and category_names:
+            instruction = REPORT_SECTIONS[section]["subset_instruction"].format(category_names=", ".join(category_names))
+            requests.append({
+                "section": section,
+                "label": section,
+                "messages": _with_section_instruction(messages, instruction),
+                "item_count": len(category_names),
+            })
+        else:
+            requests.append({
+                "section": section,
+                "label": section,
+                "messages": _with_section_instruction(messages, REPORT_SECTIONS[section]["instruction"]),
+                "item_count": None,
+            })
+    return requests
+
+def _with_section_instruction(messages: list, instruction: str) -> list:
+    """Return a copy of messages with the section instruction appended to the last user message."""
+    messages = [dict(message) for message in messages]
+    preamble = SECTION_PREAMBLE.format(instruction=instruction)
+    if messages and messages[-1]["role"] == "user":
+        messages[-1]["content"] += "\n\n" + preamble
+    else:
+        messages.append({"role": "user", "content": preamble})
+    return messages
+
+def merge_section_results(section_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge section responses (in request order) into a single report dict."""
+    merged = {"category_insights": [], "biomarker_insights": []}
+    for item in section_results:
+        result = item["result"]
+        if hasattr(result, 'model_dump'):
+            data = result.model_dump()
+        else:
+            data = dict(result)
+        for field in REPORT_SECTIONS[item["section"]]["fields"]:
+            if field not in data:
+                continue
+            if field in ("category_insights", "biomarker_insights"):
+                merged[field].extend(data[field] or [])
+            else:
+                merged[field] = data[field]
+    return merged
+
+async def arun_section_requests(model_name: str, requests: List[Dict[str, Any]],
+                                response_format: Type[BaseModel] = HealthVizorResponse, user_context=None,
+                                on_section: Optional[Callable[[str, Any], None]] = None) -> List[Dict[str, Any]]:
+    """
+    Run build_section_requests() output concurrently, each through acall_llm_with_fallback.
+
+    Returns {"section", "label", "result", "model"} per request, in request
+    order, where model is the model that answered the section, and raises if
+    any section failed. Each call reserves rate-limit budget for its predicted
+    output, and at most the model's max_concurrency sections run at once, so
+    sections queue on the requested model instead of spilling over to
+    fallback models. on_section(label, result) is called as each section
+    completes.
+    """
+    biomarker_table = user_context.get('biomarker_table') if user_context else None
+    category_count = len(biomarker_table.all_categories()) if biomarker_table is not None else 0
+    max_concurrency = get_rate_headroom(model_name)[model_name]["max_concurrency"] or len(requests) or 1
+    slots = asyncio.Semaphore(max_concurrency)
+
+    async def run_section(request):
+        section_model = get_section_model(request["section"], response_format)
+        item_count = request.get("item_count")
+        expected_output = predict_section_output_tokens(request["section"], item_count if item_count is not None else category_count)
+        async with slots:
+            with span("section", label=request["label"]), capture_events() as events:
+                with expected_output_scope(expected_output or None):
+                    result = await acall_llm_with_fallback(model_name, request["messages"], section_model, user_context, save_result=False)
+        answered = next((event.get("model_used") for event in reversed(events) if event.kind == LLM_REQUEST), None) or model_name
+        logger.info("✅ Section complete: %s (%s)", request['label'], answered)
+        if on_section:
+            on_section(request["label"], result)
+        return {"section": request["section"], "label": request["label"], "result": result, "model": answered}
+
+    outcomes = await asyncio.gather(*[run_section(request) for request in requests], return_exceptions=True)
+
+    failures = [(request["label"], outcome) for request, outcome in zip(requests, outcomes) if isinstance(outcome, Exception)]
+    if failures:
+        label, error = failures[0]
+        raise Exception(f"Sectioned generation failed for section '{label}': {str(error)}")
+    return outcomes
+
+def sections_model_name(model_name: str, outcomes: List[Dict[str, Any]]) -> str:
+    """
+    Model name to save a merged report under.
+
+    The requested model when it answered every section, otherwise the models
+    that did (in order of first section, e.g. "azure/o1 + azure/o4-mini"), so
+    a mixed report is never attributed to a single model.
+    """
+    models = list(dict.fromkeys(outcome.get("model") or model_name for outcome in outcomes))
+    if not models or models == [model_name]:
+        return model_name
+    logger.warning("🔀 Report sections requested from %s were answered by %s", model_name, ", ".join(models))
+    return " + ".join(models)
+
+async def agenerate_sectioned_report(model_name: str, messages: list, biomarker_names: List[str],
+                                     response_format: Type[BaseModel] = HealthVizorResponse, user_context=None,
+                                     chunk_size: int = DEFAULT_BIOMARKER_CHUNK_SIZE,
+                                     on_section: Optional[Callable[[str, Any], None]] = None) -> BaseModel:
+    """
+    Generate a report as concurrent section calls and merge them into one validated response.
+
+    Each section goes through acall_llm_with_fallback on its own, so wall-clock
+    time is roughly that of the slowest section. on_section(label, result) is
+    called as each section completes.
+    """
+    requests = build_section_requests(messages, biomarker_names, chunk_size)
+    logger.info("⚡ Sectioned generation: %s parallel section calls with %s", len(requests), model_name)
+    outcomes = await arun_section_requests(model_name, requests, response_format, user_context, on_section)
+
+    with span("merge_sections", sections=len(outcomes)):
+        merged = merge_section_results(outcomes)
+
+    return finalize_report(merged, sections_model_name(model_name, outcomes), response_format, user_context)
+
+def finalize_report(merged: Dict[str, Any], model_name: str, response_format: Type[BaseModel] = HealthVizorResponse,
+                    user_context=None) -> BaseModel:
+    """Run the whole-report validations on a merged report dict, add the disclaimer, validate and save it."""
+    with span("validate_merged"):
+        schema = compiled_schema(response_format)
+        merged = validate_and_fix_json_fields(merged, schema.schema)
+        merged = validate_escalation_logic(merged, user_context.get('biomarker_table') if user_context else None)
+        merged = validate_six_month_timeline(merged)
+
+    if user_context:
+        user_name = user_context.get('name', 'User')
+        merged['disclaimer'] = f"{user_name}, these recommendations are specifically designed with your goals in mind. These recommendations are for educational purposes only and do not constitute medical advice. Please consult a healthcare provider before starting any new regimen."
+
+    with span("pydantic_validate"):
+        model_instance = schema.validate(merged)
+
+    user_name = user_context.get('name', 'Unknown') if user_context else 'Unknown'
+    with span("save_response"):
+        save_response(model_instance, model_name, user_name)
+
+    return model_instance
+
+def generate_sectioned_report(model_name: str, messages: list, biomarker_names: List[str],
+                              response_format: Type[BaseModel] = HealthVizorResponse, user_context=None,
+                              chunk_size: int = DEFAULT_BIOMARKER_CHUNK_SIZE,
+                              on_section: Optional[Callable[[str, Any], None]] = None) -> BaseModel:
+    """Blocking wrapper around agenerate_sectioned_report for sync callers (e.g. Streamlit)."""
+    async def run():
+        try:
+            return await agenerate_sectioned_report(model_name, messages, biomarker_names, response_format,
+                                                    user_context, chunk_size, on_section)
+        finally:
+            await aclose_async_clients()
+
+    return asyncio.run(run())
@@ -0,0 +1,251 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from pydantic import BaseModel, Field
+
+from biomarkers import parse_biomarkers
+from incremental import count_incremental_calls, plan_incremental
+from llm_utils import is_mock_model, plan_report_request
+from mock_provider import MOCK_LLM_ENABLED
+from models import HealthVizorResponse
+from prompt import PROMPT
+from prompt_compiler import compiled_prompt
+from report_jobs import Job, JobQueue, get_job_queue, job_key
+from report_sections import DEFAULT_BIOMARKER_CHUNK_SIZE, chunk_biomarker_names
+from tracing import span
+
+DEFAULT_MODEL = "azure/o1"
+
+# metadata key -> label in the "personal details" section of the prompt
+PERSONAL_DETAIL_FIELDS = (
+    ("name", "Name"),
+    ("age", "Age"),
+    ("gender", "Gender"),
+    ("body_weight", "Body Weight"),
+    ("height", "Height"),
+    ("body_fat_percentage", "Body Fat%"),
+    ("waist_circumference", "Waist Circumference"),
+    ("diet_type", "Diet Type"),
+    ("known_medical_conditions", "Known Medical Conditions"),
+    ("open_to_supplements", "Open to Supplements"),
+    ("current_supplements_medications", "Supplements & Medications"),
+    ("activity_level", "Activity Level"),
+    ("competitive_athlete", "Competitive Athlete"),
+    ("average_sleep_hours", "Average Hours of Sleep/Night"),
+    ("wake_up_time", "Wake Up Time"),
+    ("smoker", "Smoker"),
+    ("sun_exposure", "Sun Exposure"),
+    ("alcohol_intake", "Alcohol Intake"),
+    ("caffeine", "Caffeine"),
+)
+
+class BiomarkerEntry(BaseModel):
+    """One lab result; rendered into the "Name: value unit (ranges, flag) - Categories: ..." line format."""
+    name: str
+    value: Union[float, str]
+    unit: str = ""
+    clinical_range: Optional[str] = None
+    optimal_range: Optional[str] = None
+    flag: Optional[str] = None
+    categories: List[str] = Field(default_factory=list)
+
+    def to_line(self) -> str:
+        line = f"{self.name}: {self.value} {self.unit}".rstrip()
+        if self.clinical_range or self.optimal_range or self.flag:
+            line += f" (Clinical range: {self.clinical_range or ''}, Optimal range: {self.optimal_range or ''}, Flag: {self.flag or ''})"
+        if self.categories:
+            line += f" - Categories: {', '.join(self.categories)}"
+        return line
+
+class ReportRequest(BaseModel):
+    """Everything needed to generate one report, independent of the Streamlit session."""
+    model: str = DEFAULT_MODEL
+    metadata: Dict[str, Any] = Field(default_factory=dict, description="Onboarding details (name, age, gender, health_goals, ...)")
+    biomarkers: Union[str, List[BiomarkerEntry]] = Field(..., description="Biomarker lines as text, or structured entries")
+    onboarding_conversation: str = ""
+    category_scores: str = ""
+    recommendations: str = ""
+    user_history: Dict[str, Any] = Field(default_factory=dict, description="Interaction count, previous reports and preferences")
+    sectioned: bool = False
+    hedge: bool = False
+    stream: bool = True
+    bypass_cache: bool = False
+    trace: bool = False
+
+    def biomarkers_text(self) -> str:
+        if isinstance(self.biomarkers, str):
+            return self.biomarkers
+        return "\n".join(entry.to_line() for entry in self.biomarkers)
+
+def format_personal_details(metadata: Dict[str, Any]) -> str:
+    """The "personal details" block of the prompt."""
+    lines = [f"{label}: {metadata.get(key, '')}" for key, label in PERSONAL_DETAIL_FIELDS]
+    lines.append(f"Health Goals: {', '.join(metadata.get('health_goals', []))}")
+    return "\n" + "\n".join(lines) + "\n"
+
+def format_user_history(user_history: Dict[str, Any]) -> str:
+    """The "user history" block of the prompt."""
+    return f"""
+Interaction Count: {user_history.get('interaction_count', 0)}
+Previous Reports Generated: {len(user_history.get('previous_reports', []))}
+Preferred Supplements from Past: {', '.join(user_history.get('preferred_supplements', []))}
+Lifestyle Preferences: {', '.join(user_history.get('lifestyle_preferences', []))}
+Nutrition Preferences: {', '.join(user_history.get('nutrition_preferences', []))}
+Last Interaction: {user_history.get('last_interaction_date', 'First time')}
+"""
+
+def build_user_context(metadata: Dict[str, Any], user_history: Dict[str, Any]) -> Dict[str, Any]:
+    """User context for the personalized LLM call (the report job adds the parsed biomarker table)."""
+    return {
+        "name": metadata.get('name', 'User'),
+        "interaction_count": user_history.get('interaction_count', 1),
+        "preferences_summary": f"Supplements: {', '.join(user_history.get('preferred_supplements', [])[:3])}; Lifestyle: {', '.join(user_history.get('lifestyle_preferences', [])[:3])}; Nutrition: {', '.join(user_history.get('nutrition_preferences', [])[:3])}",
+    }
+
+def build_report_messages(request: ReportRequest) -> List[Dict[str, str]]:
+    """Static instructions in a fixed leading system message, the user's data in a trailing user message."""
+    with span("build_prompt"):
+        return compiled_prompt(PROMPT).messages(
+            onboarding_questions=request.onboarding_conversation,
+            personal_details=format_personal_details(request.metadata),
+            biomarkers_data=request.biomarkers_text(),
+            category_scores=request.category_scores,
+            recommendations=request.recommendations,
+            user_history=format_user_history(request.user_history)
+        )
+
+def report_job_key(request: ReportRequest) -> str:
+    """Deduplication key over the inputs that define the report (not the volatile interaction history)."""
+    return job_key("report", {
+        "model": request.model,
+        "options": [request.sectioned, request.hedge, request.stream, request.bypass_cache],
+        "metadata": request.metadata,
+        "conversation": request.onboarding_conversation,
+        "biomarkers": request.biomarkers_text(),
+        "category_scores": request.category_scores,
+        "recommendations": request.recommendations,
+    })
+
+def plan_report(request: ReportRequest, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """
+    Token plan for the request plus the dispatch decision.
+
+    Adds "dispatch_strategy" (sectioned / hedged / stream / single),
+    "dispatch_chunk_size" and "note" (set when the report has to be
+    sectioned because it would not fit the model's output budget).
+    """
+    biomarker_table = parse_biomarkers(request.biomarkers_text())
+    with span("token_plan"):
+        plan = plan_report_request(request.model, messages, len(biomarker_table), len(biomarker_table.all_categories()),
+                                   HealthVizorResponse, DEFAULT_BIOMARKER_CHUNK_SIZE)
+    use_sections = request.sectioned or plan["strategy"] == "sectioned"
+    chunk_size = plan["chunk_size"] or DEFAULT_BIOMARKER_CHUNK_SIZE
+    note = None
+    if plan["strategy"] == "sectioned" and not request.sectioned:
+        note = (f"📐 The full report (~{plan['predicted_output_tokens']:,} tokens) would exceed {request.model}'s "
+                f"output budget of {plan['output_budget']:,} tokens, so it will be generated in sections "
+                f"({chunk_size} biomarkers per call).")
+        if plan["alternative_models"]:
+            note += f" Models that fit it in one call: {', '.join(plan['alternative_models'])}."
+    plan["dispatch_strategy"] = "sectioned" if use_sections else "hedged" if request.hedge else "stream" if request.stream else "single"
+    plan["dispatch_chunk_size"] = chunk_size
+    plan["note"] = note
+    return plan
+
+def check_report_model(model_name: str) -> None:
+    """Raise ValueError for models reports must not be generated with (the mock models unless MOCK_LLM_ENABLED)."""
+    if is_mock_model(model_name) and not MOCK_LLM_ENABLED:
+        raise ValueError(f"{model_name} replays recorded reports and is only available with MOCK_LLM_ENABLED=1")
+
+def submit_report(request: ReportRequest, job_queue: Optional[JobQueue] = None) -> Tuple[Job, Optional[Dict[str, Any]]]:
+    """
+    Queue a report job for the request; returns (job, token plan).
+
+    If a job with the same inputs is already queued or running, that job is
+    returned with no plan and nothing new is queued. Raises ValueError for a
+    model that is not allowed (see check_report_model).
+    """
+    check_report_model(request.model)
+    job_queue = job_queue or get_job_queue()
+    key = report_job_key(request)
+    active = job_queue.active_job(key)
+    if active is not None:
+        return active, None
+
+    messages = build_report_messages(request)
+    plan = plan_report(request, messages)
+    with span("submit_job", strategy=plan["dispatch_strategy"]):
+        job = job_queue.submit("report", {
+            "model": request.model,
+            "messages": messages,
+            "user_context": build_user_context(request.metadata, request.user_history),
+            "biomarkers_data": request.biomarkers_text(),
+            "strategy": plan["dispatch_strategy"],
+            "chunk_size": plan["dispatch_chunk_size"],
+            "bypass_cache": request.bypass_cache,
+            "trace": request.trace,
+            "inputs": request.model_dump(),
+        }, key=key)
+    return job, plan
+
+def plan_report_update(previous_request: ReportRequest, previous_report: Dict[str, Any],
+                       request: ReportRequest) -> Dict[str, Any]:
+    """
+    Incremental plan for regenerating previous_report from the changed request.
+
+    Adds "calls" (section calls the update makes) and "full_calls" (section
+    calls of a full sectioned report) to incremental.plan_incremental().
+    """
+    plan = plan_incremental(previous_request, request, previous_report)
+    biomarker_names = parse_biomarkers(request.biomarkers_text()).names
+    plan["full_calls"] = 3 + len(chunk_biomarker_names(biomarker_names, DEFAULT_BIOMARKER_CHUNK_SIZE))
+    plan["calls"] = plan["full_calls"] if plan["full"] else count_incremental_calls(plan)
+    return plan
+
+def submit_report_update(previous_request: ReportRequest, previous_report: Dict[str, Any], request: ReportRequest,
+                         job_queue: Optional[JobQueue] = None) -> Tuple[Optional[Job], Dict[str, Any]]:
+    """
+    Queue a job that regenerates only the sections of previous_report whose inputs changed; returns (job, plan).
+
+    Falls back to a full report (submit_report) when the plan needs one, and
+    returns no job when nothing changed.
+    """
+    check_report_model(request.model)
+    plan = plan_report_update(previous_request, previous_report, request)
+    if plan["unchanged"]:
+        return None, plan
+    if plan["full"]:
+        job, _ = submit_report(request, job_queue)
+        return job, plan
+
+    job_queue = job_queue or get_job_queue()
+    key = job_key("incremental", {"previous": report_job_key(previous_request), "current": report_job_key(request)})
+    messages = build_report_messages(request)
+    with span("submit_job", strategy="incremental"):
+        job = job_queue.submit("report", {
+            "model": request.model,
+            "messages": messages,
+            "user_context": build_user_context(request.metadata, request.user_history),
+            "biomarkers_data": request.biomarkers_text(),
+            "strategy": "incremental",
+            "chunk_size": DEFAULT_BIOMARKER_CHUNK_SIZE,
+            "previous_report": previous_report,
+            "incremental_plan": plan,
+            "bypass_cache": request.bypass_cache,
+            "trace": request.trace,
+            "inputs": request.model_dump(),
+        }, key=key)
+    return job, plan
+
+def validate_report(result: Dict[str, Any]) -> HealthVizorResponse:
+    """A finished job's result as a HealthVizorResponse."""
+    return HealthVizorResponse.model_validate(result)
+
+def history_entry(model_name: str, result: Any) -> Dict[str, Any]:
+    """The user_history["previous_reports"] entry for a generated report."""
+    summary = str(result)
+    return {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "model_used": model_name,
+        "report_summary": summary[:200] + "..." if len(summary) > 200 else summary
+    }
@@ -0,0 +1,363 @@
+"""
+Append-only, compressed archive of LLM responses.
+
+Responses are appended to segment files as compressed frames and located
+through an SQLite offset index, so any record can be read back by report id
+with a single seek. Compression uses zstandard when it is installed and zlib
+otherwise, both with a preset dictionary trained on our own reports, so
+the schema keys and phrasing shared by every report compress well even
+though each record is compressed on its own.
+
+    python response_archive.py train            # train a dictionary on llm_results/
+    python response_archive.py import           # archive llm_results/*.json
+    python response_archive.py get <report_id>
+    python response_archive.py stats
+"""
+import argparse
+import collections
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # optional: fall back to zlib with a preset dictionary
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("RESPONSE_ARCHIVE_DIR", os.path.join("llm_results", "archive"))
+# Archive every saved response in addition to the result store (see llm_utils.save_response)
+ARCHIVE_ENABLED = os.getenv("RESPONSE_ARCHIVE", "").lower() in ("1", "true", "yes")
+SEGMENT_MAX_BYTES = int(os.getenv("RESPONSE_ARCHIVE_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+ZSTD_LEVEL = 19
+ZLIB_LEVEL = 9
+# zlib can only use the last 32 KB of a preset dictionary
+ZLIB_DICT_SIZE = 32 * 1024
+ZSTD_DICT_SIZE = 110 * 1024
+
+CORPUS_GLOBS = [
+    os.path.join("llm_results", "*.json"),
+    os.path.join("llm_results", "old", "*.json"),
+]
+
+# Frame: magic, header length, payload length, then the JSON header and the compressed payload
+FRAME_MAGIC = b"HVA1"
+_FRAME = struct.Struct(">4sII")
+
+# JSON strings (keys with their colon), the unit repeated across reports
+_DICT_TOKEN = re.compile(r'"(?:[^"\\]|\\.){1,300}"\s*:?')
+
+class ArchiveError(Exception):
+    """Raised when a record is missing or its frame is corrupt."""
+
+def _codec() -> str:
+    return "zstd" if zstandard is not None else "zlib"
+
+def train_dictionary(samples: List[bytes], codec: Optional[str] = None) -> bytes:
+    """
+    Build a compression dictionary from sample documents.
+
+    With zstandard this is its own trainer. For zlib the dictionary ends with
+    the JSON keys and strings found in several samples (most valuable last,
+    where zlib reaches them at the shortest distance) and is filled up with
+    the tail of the newest sample, which carries the report's structure.
+    """
+    codec = codec or _codec()
+    if codec == "zstd":
+        try:
+            return zstandard.train_dictionary(ZSTD_DICT_SIZE, samples).as_bytes()
+        except Exception as e:  # too few / too small samples
+            logger.warning("⚠️ zstd dictionary training failed (%s), using the token dictionary", e)
+
+    document_counts = collections.Counter()
+    for sample in samples:
+        document_counts.update(set(_DICT_TOKEN.findall(sample.decode('utf-8', errors='ignore'))))
+    ranked = sorted(((token, count) for token, count in document_counts.items() if count >= 2),
+                    key=lambda item: item[1] * len(item[0]), reverse=True)
+    parts, size = [], 0
+    for token, _ in ranked:
+        encoded = token.encode('utf-8')
+        if size + len(encoded) > ZLIB_DICT_SIZE:
+            break
+        parts.append(encoded)
+        size += len(encoded)
+    tokens = b"".join(reversed(parts))
+    filler = samples[-1][-(ZLIB_DICT_SIZE - len(tokens)):] if samples and len(tokens) < ZLIB_DICT_SIZE else b""
+    return filler + tokens
+
+def _compress(data: bytes, codec: str, dictionary: Optional[bytes]) -> bytes:
+    if codec == "zstd":
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data).compress(data)
+    compressor = zlib.compressobj(ZLIB_LEVEL, zdict=dictionary) if dictionary else zlib.compressobj(ZLIB_LEVEL)
+    return compressor.compress(data) + compressor.flush()
+
+def _decompress(data: bytes, codec: str, dictionary: Optional[bytes]) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise ArchiveError("record is zstd-compressed but zstandard is not installed")
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data)
+    decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+    return decompressor.decompress(data) + decompressor.flush()
+
+class ResponseArchive:
+    """
+    Segment files plus an SQLite index (report id -> segment, offset, length).
+
+    Records are only ever appended; a segment is closed once it passes
+    segment_max_bytes. Dictionaries are stored next to the segments under
+    their hash and every record names the one it was compressed with, so
+    retraining never breaks older records.
+    """
+
+    def __init__(self, directory: str = ARCHIVE_DIR, segment_max_bytes: int = SEGMENT_MAX_BYTES):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.index_path = os.path.join(directory, "index.sqlite3")
+        self._dictionaries = {}
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(self.index_path, timeout=10)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS records (
+                    report_id TEXT PRIMARY KEY,
+                    segment TEXT NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    codec TEXT NOT NULL,
+                    dict_id TEXT,
+                    raw_size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    model_name TEXT,
+                    user_name TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_records_user ON records(user_name, created_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS dictionaries (dict_id TEXT PRIMARY KEY, codec TEXT NOT NULL, active INTEGER NOT NULL, created_at REAL NOT NULL)")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    # Dictionaries
+
+    def _dictionary_path(self, dict_id: str) -> str:
+        return os.path.join(self.directory, f"dict-{dict_id}.bin")
+
+    def _load_dictionary(self, dict_id: Optional[str]) -> Optional[bytes]:
+        if dict_id is None:
+            return None
+        dictionary = self._dictionaries.get(dict_id)
+        if dictionary is None:
+            with open(self._dictionary_path(dict_id), 'rb') as f:
+                dictionary = self._dictionaries[dict_id] = f.read()
+        return dictionary
+
+    def _active_dictionary(self, conn: sqlite3.Connection, codec: str) -> Optional[str]:
+        row = conn.execute("SELECT dict_id FROM dictionaries WHERE codec = ? AND active = 1", (codec,)).fetchone()
+        return row[0] if row else None
+
+    def train(self, samples: Iterable[bytes]) -> str:
+        """Train a dictionary on the samples and use it for new records; returns its id."""
+        codec = _codec()
+        dictionary = train_dictionary(list(samples), codec)
+        dict_id = hashlib.sha256(dictionary).hexdigest()[:16]
+        conn = self._connect()
+        try:
+            path = self._dictionary_path(dict_id)
+            if not os.path.exists(path):
+                with open(f"{path}.tmp", 'wb') as f:
+                    f.write(dictionary)
+                os.replace(f"{path}.tmp", path)
+            with conn:
+                conn.execute("UPDATE dictionaries SET active = 0 WHERE codec = ?", (codec,))
+                conn.execute("INSERT OR REPLACE INTO dictionaries (dict_id, codec, active, created_at) VALUES (?, ?, 1, ?)",
+                             (dict_id, codec, time.time()))
+        finally:
+            conn.close()
+        self._dictionaries[dict_id] = dictionary
+        logger.info("📚 Trained %s dictionary %s (%s bytes)", codec, dict_id, len(dictionary))
+        return dict_id
+
+    # Records
+
+    def _current_segment(self, conn: sqlite3.Connection) -> str:
+        row = conn.execute("SELECT segment FROM records ORDER BY created_at DESC, offset DESC LIMIT 1").fetchone()
+        segment = row[0] if row else "segment-000001.arc"
+        path = os.path.join(self.directory, segment)
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_max_bytes:
+            number = int(re.search(r'(\d+)', segment).group(1)) + 1
+            segment = f"segment-{number:06d}.arc"
+        return segment
+
+    def append(self, report_id: str, document: Union[str, bytes, Dict[str, Any]], model_name: Optional[str] = None,
+               user_name: Optional[str] = None) -> Dict[str, Any]:
+        """Compress a document (text, bytes or a JSON-serializable dict) and append it under report_id."""
+        if isinstance(document, dict):
+            document = json.dumps(document, ensure_ascii=False, separators=(',', ':'), default=str)
+        data = document.encode('utf-8') if isinstance(document, str) else document
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                codec = _codec()
+                dict_id = self._active_dictionary(conn, codec)
+                payload = _compress(data, codec, self._load_dictionary(dict_id))
+                header = json.dumps({"id": report_id, "codec": codec, "dict_id": dict_id}).encode('utf-8')
+                frame = _FRAME.pack(FRAME_MAGIC, len(header), len(payload)) + header + payload
+
+                segment = self._current_segment(conn)
+                with open(os.path.join(self.directory, segment), 'ab') as f:
+                    offset = f.tell()
+                    f.write(frame)
+                    f.flush()
+                    os.fsync(f.fileno())
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO records (report_id, segment, offset, length, codec, dict_id, raw_size, sha256, model_name, user_name, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (report_id, segment, offset, len(frame), codec, dict_id, len(data),
+                         hashlib.sha256(data).hexdigest(), model_name, user_name, time.time())
+                    )
+            finally:
+                conn.close()
+        return {"report_id": report_id, "segment": segment, "offset": offset, "raw_size": len(data), "stored_size": len(frame)}
+
+    def read_bytes(self, report_id: str) -> bytes:
+        """The document stored under report_id, verified against its checksum."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT segment, offset, length, codec, dict_id, sha256 FROM records WHERE report_id = ?",
+                               (report_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            raise ArchiveError(f"No archived record for {report_id}")
+
+        segment, offset, length, codec, dict_id, digest = row
+        with open(os.path.join(self.directory, segment), 'rb') as f:
+            f.seek(offset)
+            frame = f.read(length)
+        magic, header_length, payload_length = _FRAME.unpack_from(frame)
+        if magic != FRAME_MAGIC or _FRAME.size + header_length + payload_length != length:
+            raise ArchiveError(f"Corrupt frame for {report_id} in {segment} at {offset}")
+        data = _decompress(frame[_FRAME.size + header_length:], codec, self._load_dictionary(dict_id))
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ArchiveError(f"Checksum mismatch for {report_id}")
+        return data
+
+    def read(self, report_id: str) -> str:
+        return self.read_bytes(report_id).decode('utf-8')
+
+    def read_json(self, report_id: str) -> Any:
+        return json.loads(self.read_bytes(report_id))
+
+    def __contains__(self, report_id: str) -> bool:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT 1 FROM records WHERE report_id = ?", (report_id,)).fetchone() is not None
+        finally:
+            conn.close()
+
+    def report_ids(self, user_name: Optional[str] = None) -> List[str]:
+        """Archived report ids, oldest first (optionally for one user)."""
+        conn = self._connect()
+        try:
+            if user_name is None:
+                rows = conn.execute("SELECT report_id FROM records ORDER BY created_at").fetchall()
+            else:
+                rows = conn.execute("SELECT report_id FROM records WHERE user_name = ? ORDER BY created_at", (user_name,)).fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        """Record count, raw and stored bytes and the compression ratio."""
+        conn = self._connect()
+        try:
+            count, raw_bytes, stored_bytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(raw_size), 0), COALESCE(SUM(length), 0) FROM records").fetchone()
+            dict_id = self._active_dictionary(conn, _codec())
+        finally:
+            conn.close()
+        return {
+            "records": count,
+            "raw_bytes": raw_bytes,
+            "stored_bytes": stored_bytes,
+            "ratio": round(raw_bytes / stored_bytes, 2) if stored_bytes else None,
+            "codec": _codec(),
+            "dictionary": dict_id,
+        }
+
+_default_archive = None
+
+def get_response_archive() -> ResponseArchive:
+    """Return the process-wide response archive."""
+    global _default_archive
+    if _default_archive is None:
+        _default_archive = ResponseArchive()
+    return _default_archive
+
+def _corpus_files() -> List[str]:
+    return sorted(path for pattern in CORPUS_GLOBS for path in glob.glob(pattern))
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Append-only, compressed archive of LLM responses.")
+    parser.add_argument("--directory", default=ARCHIVE_DIR, help="archive directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("train", help="train a dictionary on the saved reports in llm_results/")
+    commands.add_parser("import", help="archive the saved reports in llm_results/ (keyed by file name)")
+    get_command = commands.add_parser("get", help="print an archived document")
+    get_command.add_argument("report_id")
+    commands.add_parser("stats", help="print record count and compression ratio")
+    args = parser.parse_args(argv)
+
+    archive = ResponseArchive(args.directory)
+    if args.command == "train":
+        samples = []
+        for path in _corpus_files():
+            with open(path, 'rb') as f:
+                samples.append(json.dumps(json.load(f), ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        if not samples:
+            print("No saved reports found to train on")
+            return 1
+        print(f"Trained dictionary {archive.train(samples)} on {len(samples)} reports")
+    elif args.command == "import":
+        for path in _corpus_files():
+            report_id = os.path.splitext(os.path.basename(path))[0]
+            if report_id in archive:
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                document = json.load(f)
+            archive.append(report_id, document, document.get("model_name"), document.get("user_name"))
+        print(json.dumps(archive.stats(), indent=2))
+    elif args.command == "get":
+        try:
+            print(archive.read(args.report_id))
+        except ArchiveError as e:
+            print(str(e))
+            return 1
+    else:
+        print(json.dumps(archive.stats(), indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+import glob
+import json
+import os
+import sqlite3
+import uuid
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+# "sqlite" stores reports in the indexed result store, "json" keeps writing one file per report to llm_results/
+RESULT_STORE_BACKEND = os.getenv("RESULT_STORE_BACKEND", "sqlite").lower()
+RESULT_STORE_PATH = os.getenv("RESULT_STORE_PATH", os.path.join("llm_results", "results.sqlite3"))
+
+# Report fields stored as JSON columns, after AI_USER_HEALTH_REPORT in db.erd
+JSON_FIELDS = (
+    "wins_to_celebrate",
+    "what_to_continue",
+    "what_needs_work",
+    "top_priority_categories",
+    "category_insights",
+    "biomarker_insights",
+    "action_plan",
+)
+# Report fields stored as text columns
+TEXT_FIELDS = (
+    "overall_health_summary",
+    "congratulations_message",
+    "goal_relevance",
+    "longevity_performance_impact",
+    "biomarker_pattern_analysis",
+    "escalation_reason",
+)
+
+# Columns returned by history queries (everything but the large report bodies)
+SUMMARY_COLUMNS = ("id", "user_id", "user_name", "report_name", "report_type", "generation_date", "ai_model_used",
+                   "provider", "processing_time_seconds", "escalation_needed", "escalation_reason", "user_rating", "size")
+
+def _compact_json(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+
+def provider_name(model_name: str) -> str:
+    """Display name of the provider behind a model name."""
+    if "azure" in model_name:
+        return "Azure OpenAI"
+    if "openai" in model_name:
+        return "OpenAI"
+    if "gemini" in model_name:
+        return "Google Gemini"
+    return "Unknown"
+
+def _raw_response_from_row(row) -> Dict[str, Any]:
+    return {
+        "content": zlib.decompress(row["content"]).decode('utf-8'),
+        "provider": row["provider"],
+        "repair_strategy": row["repair_strategy"],
+        "context": json.loads(row["context"]) if row["context"] else {},
+    }
+
+class ResultStore:
+    """
+    SQLite store of generated reports, one row per report.
+
+    Rows follow AI_USER_HEALTH_REPORT: scalar fields are columns, list and
+    object fields are compact JSON columns, and any field the table does not
+    model (biomarker_snapshot, disclaimer, ...) goes into extra_fields, so
+    get() returns the report exactly as saved. History and lookup queries go
+    through indexes on user, model, generation date and escalation flag.
+
+    The raw completion text each report was parsed from is kept in a side
+    table (zlib-compressed, with the context post-processing needs), so the
+    report rows stay small for history scans.
+    """
+
+    def __init__(self, path: str = RESULT_STORE_PATH):
+        self.path = path
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS ai_user_health_report (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT,
+                    user_name TEXT NOT NULL,
+                    report_name TEXT,
+                    report_type TEXT,
+                    generation_date TEXT NOT NULL,
+                    ai_model_used TEXT NOT NULL,
+                    provider TEXT,
+                    model_version TEXT,
+                    processing_time_seconds INTEGER,
+                    {", ".join(f"{field} TEXT" for field in TEXT_FIELDS + JSON_FIELDS)},
+                    extra_fields TEXT,
+                    escalation_needed INTEGER,
+                    user_rating INTEGER,
+                    user_feedback TEXT,
+                    viewed_at TEXT,
+                    source_file TEXT UNIQUE,
+                    size INTEGER NOT NULL
+                )
+            """)
+            for name, columns in (
+                ("user", "user_name, generation_date"),
+                ("user_id", "user_id, generation_date"),
+                ("model", "ai_model_used, generation_date"),
+                ("date", "generation_date"),
+                ("escalation", "escalation_needed, generation_date"),
+            ):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_report_{name} ON ai_user_health_report({columns})")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ai_report_raw_response (
+                    report_id TEXT PRIMARY KEY REFERENCES ai_user_health_report(id),
+                    provider TEXT,
+                    repair_strategy TEXT,
+                    context TEXT,
+                    content BLOB NOT NULL,
+                    size INTEGER NOT NULL
+                )
+            """)
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def save(self, report: Dict[str, Any], model_name: str, user_name: str = "Unknown", user_id: Optional[str] = None,
+             report_type: str = "comprehensive", processing_time_seconds: Optional[float] = None,
+             generation_date: Optional[str] = None, source_file: Optional[str] = None,
+             raw_response: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Insert a report (a dict in the HealthVizorResponse shape) in one transaction; returns its id.
+
+        raw_response ({"content", "provider", "repair_strategy", "context"}, see
+        llm_utils.save_response) is stored with it when given.
+        """
+        report_id = uuid.uuid4().hex
+        generation_date = generation_date or datetime.now().isoformat()
+        row = {
+            "id": report_id,
+            "user_id": user_id,
+            "user_name": user_name,
+            "report_name": f"{user_name} - {generation_date[:10]}",
+            "report_type": report_type,
+            "generation_date": generation_date,
+            "ai_model_used": model_name,
+            "provider": provider_name(model_name),
+            "model_version": model_name.split('/', 1)[-1],
+            "processing_time_seconds": round(processing_time_seconds) if processing_time_seconds is not None else None,
+            "escalation_needed": None if report.get("escalation_needed") is None else int(bool(report["escalation_needed"])),
+            "source_file": source_file,
+        }
+        for field in TEXT_FIELDS:
+            row[field] = report.get(field)
+        for field in JSON_FIELDS:
+            row[field] = _compact_json(report.get(field))
+        known = set(TEXT_FIELDS + JSON_FIELDS) | {"escalation_needed"}
+        row["extra_fields"] = _compact_json({key: value for key, value in report.items() if key not in known})
+        row["size"] = sum(len(value.encode('utf-8')) for value in row.values() if isinstance(value, str))
+
+        columns = ", ".join(row)
+        placeholders = ", ".join("?" for _ in row)
+        conn = self._connect()
+        try:
+            with conn:  # commits or rolls back the whole row
+                conn.execute(f"INSERT INTO ai_user_health_report ({columns}) VALUES ({placeholders})", tuple(row.values()))
+                if raw_response is not None and raw_response.get("content") is not None:
+                    content = raw_response["content"].encode('utf-8')
+                    conn.execute(
+                        "INSERT INTO ai_report_raw_response (report_id, provider, repair_strategy, context, content, size) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (report_id, raw_response.get("provider"), raw_response.get("repair_strategy"),
+                         _compact_json(raw_response.get("context")), zlib.compress(content, 6), len(content))
+                    )
+        finally:
+            conn.close()
+        return report_id
+
+    def get(self, report_id: str) -> Optional[Dict[str, Any]]:
+        """A stored report: its metadata columns plus the full report under "result"."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM ai_user_health_report WHERE id = ?", (report_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+
+        row = dict(row)
+        report = {}
+        for field in TEXT_FIELDS:
+            value = row.pop(field)
+            if value is not None:
+                report[field] = value
+        for field in JSON_FIELDS:
+            value = row.pop(field)
+            if value is not None:
+                report[field] = json.loads(value)
+        if row["escalation_needed"] is not None:
+            report["escalation_needed"] = bool(row["escalation_needed"])
+        extra = row.pop("extra_fields")
+        if extra:
+            report.update(json.loads(extra))
+        row["result"] = report
+        return row
+
+    def raw_response(self, report_id: str) -> Optional[Dict[str, Any]]:
+        """The raw completion a report was parsed from ({"content", "provider", "repair_strategy", "context"}), or None."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM ai_report_raw_response WHERE report_id = ?", (report_id,)).fetchone()
+        finally:
+            conn.close()
+        return _raw_response_from_row(row) if row else None
+
+    def iter_raw_responses(self, model_name: Optional[str] = None, since: Optional[str] = None,
+                           limit: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yield every stored report that has its raw completion, oldest first:
+        the get() columns plus "raw_response". Rows are read lazily.
+        """
+        conditions, params = [], []
+        if model_name is not None:
+            conditions.append("ai_model_used = ?")
+            params.append(model_name)
+        if since is not None:
+            conditions.append("generation_date >= ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"SELECT id FROM ai_user_health_report JOIN ai_report_raw_response ON report_id = id {where} "
+                f"ORDER BY generation_date LIMIT ?", (*params, -1 if limit is None else limit)
+            )
+            report_ids = [row["id"] for row in cursor]
+        finally:
+            conn.close()
+        for report_id in report_ids:
+            report = self.get(report_id)
+            raw = self.raw_response(report_id)
+            if report is not None and raw is not None:
+                report["raw_response"] = raw
+                yield report
+
+    def history(self, user_name: Optional[str] = None, user_id: Optional[str] = None, model_name: Optional[str] = None,
+                escalation_needed: Optional[bool] = None, since: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Newest-first report summaries (no report bodies) matching every given filter."""
+        conditions, params = [], []
+        for column, value in (("user_name", user_name), ("user_id", user_id), ("ai_model_used", model_name)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if escalation_needed is not None:
+            conditions.append("escalation_needed = ?")
+            params.append(int(escalation_needed))
+        if since is not None:
+            conditions.append("generation_date >= ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM ai_user_health_report {where} ORDER BY generation_date DESC LIMIT ?",
+                (*params, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def latest(self, user_name: str) -> Optional[Dict[str, Any]]:
+        """The most recent report for a user, or None."""
+        summaries = self.history(user_name=user_name, limit=1)
+        return self.get(summaries[0]["id"]) if summaries else None
+
+    def users(self) -> List[Dict[str, Any]]:
+        """Every user with a stored report, with report count and latest generation date."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT user_name, COUNT(*) AS reports, MAX(generation_date) AS latest "
+                "FROM ai_user_health_report GROUP BY user_name ORDER BY latest DESC"
+            ).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def record_feedback(self, report_id: str, user_rating: Optional[int] = None, user_feedback: Optional[str] = None) -> None:
+        """Store a rating and / or feedback text for a report."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "UPDATE ai_user_health_report SET user_rating = COALESCE(?, user_rating), "
+                    "user_feedback = COALESCE(?, user_feedback) WHERE id = ?",
+                    (user_rating, user_feedback, report_id)
+                )
+        finally:
+            conn.close()
+
+    def mark_viewed(self, report_id: str) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("UPDATE ai_user_health_report SET viewed_at = ? WHERE id = ?", (datetime.now().isoformat(), report_id))
+        finally:
+            conn.close()
+
+    def import_json_files(self, pattern: str = os.path.join("llm_results", "*.json")) -> int:
+        """Import reports saved as llm_results/*.json files (skipping files already imported); returns the number added."""
+        added = 0
+        for path in sorted(glob.glob(pattern)):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            if not isinstance(data, dict) or not isinstance(data.get("result"), dict):
+                continue
+            try:
+                self.save(data["result"], data.get("model_name") or "unknown", data.get("user_name") or "Unknown",
+                          generation_date=data.get("timestamp"), source_file=os.path.abspath(path),
+                          raw_response=data.get("raw_response"))
+                added += 1
+            except sqlite3.IntegrityError:
+                pass  # already imported
+        return added
+
+    def stats(self) -> Dict[str, Any]:
+        """Report count and total stored bytes, and the same for raw responses (uncompressed / on disk)."""
+        conn = self._connect()
+        try:
+            count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ai_user_health_report").fetchone()
+            raw_count, raw_bytes, raw_stored = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(content)), 0) FROM ai_report_raw_response"
+            ).fetchone()
+        finally:
+            conn.close()
+        return {"reports": count, "bytes": total_bytes,
+                "raw_responses": raw_count, "raw_bytes": raw_bytes, "raw_stored_bytes": raw_stored}
+
+_default_store = None
+
+def get_result_store() -> ResultStore:
+    """Return the process-wide result store."""
+    global _default_store
+    if _default_store is None:
+        _default_store = ResultStore()
+    return _default_store
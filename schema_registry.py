@@ -0,0 +1,96 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Tuple, Type
+
+from pydantic import BaseModel
+
+class CompiledSchema:
+    """
+    Schema artifacts for one response_format model, built once and reused.
+
+    Holds the JSON schema, its prompt-ready text (indent=2, as sent to the
+    model), a stable hash for cache keys, an index of required fields per
+    nesting path and the model's validator. Formatted schema instructions are
+    cached per prompt variant.
+    """
+
+    def __init__(self, response_format: Type[BaseModel]):
+        self.model = response_format
+        self.schema = response_format.model_json_schema()
+        self.schema_text = json.dumps(self.schema, indent=2)
+        self.schema_hash = hashlib.sha256(json.dumps(self.schema, sort_keys=True).encode('utf-8')).hexdigest()
+        self.required_index = _index_required_fields(self.schema)
+        self._instructions = {}
+
+    def instruction(self, variant: str, template: str) -> str:
+        """Return template formatted with the schema text, cached per variant."""
+        if variant not in self._instructions:
+            self._instructions[variant] = template.format(schema_text=self.schema_text)
+        return self._instructions[variant]
+
+    def validate(self, data: Dict[str, Any]) -> BaseModel:
+        """Build the model instance from parsed data (raises ValidationError, a ValueError)."""
+        return self.model.model_validate(data)
+
+    def missing_required_fields(self, data: Any) -> List[str]:
+        """List required fields (dotted paths, "[]" for list items) missing from data."""
+        missing = []
+        for path, required in self.required_index.items():
+            for container, location in _containers_at(data, path):
+                for field in required:
+                    if field not in container:
+                        missing.append(f"{location}.{field}" if location else field)
+        return missing
+
+_COMPILED_SCHEMAS = {}
+
+def compiled_schema(response_format: Type[BaseModel]) -> CompiledSchema:
+    """Return the compiled schema for a response_format model, building it on first use."""
+    compiled = _COMPILED_SCHEMAS.get(response_format)
+    if compiled is None:
+        compiled = _COMPILED_SCHEMAS[response_format] = CompiledSchema(response_format)
+    return compiled
+
+def _index_required_fields(schema: Dict[str, Any]) -> Dict[Tuple[str, ...], Tuple[str, ...]]:
+    """Map each object path in the schema (resolving $defs references) to its required fields."""
+    definitions = schema.get('$defs', {})
+    index = {}
+
+    def resolve(node):
+        while isinstance(node, dict) and '$ref' in node:
+            node = definitions.get(node['$ref'].rsplit('/', 1)[-1], {})
+        return node
+
+    def visit(node, path, seen):
+        node = resolve(node)
+        if not isinstance(node, dict):
+            return
+        if 'properties' in node:
+            if id(node) in seen:
+                return
+            seen = seen | {id(node)}
+            if node.get('required'):
+                index[path] = tuple(node['required'])
+            for name, child in node['properties'].items():
+                visit(child, path + (name,), seen)
+        if 'items' in node:
+            visit(node['items'], path + ('[]',), seen)
+        for option in node.get('anyOf', []):
+            visit(option, path, seen)
+
+    visit(schema, (), frozenset())
+    return index
+
+def _containers_at(data: Any, path: Tuple[str, ...], location: str = ""):
+    """Yield (dict, dotted location) for every object found at path in data."""
+    if not path:
+        if isinstance(data, dict):
+            yield data, location
+        return
+    head, rest = path[0], path[1:]
+    if head == '[]':
+        if isinstance(data, list):
+            for i, item in enumerate(data):
+                yield from _containers_at(item, rest, f"{location}[{i}]")
+    elif isinstance(data, dict) and head in data:
+        yield from _containers_at(data[head], rest, f"{location}.{head}" if location else head)
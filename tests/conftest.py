@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+import llm_cache
+import llm_utils
+import rate_limiter
+from llm_cache import ResponseCache
+
+REPORT = json.dumps({"overall_health_summary": "Your results look good.", "insights": ["Keep it up."]})
+
+def completion(content, finish_reason="stop"):
+    return {
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+        "response_cost": 0.0,
+    }
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite3"))
+    monkeypatch.setattr(llm_cache, "_default_cache", cache)
+    return cache
+
+@pytest.fixture
+def provider(monkeypatch):
+    """Serve completions (or raise errors) from a list and count the calls that reach the provider."""
+    responses = []
+    calls = []
+
+    def complete(**params):
+        calls.append(params)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(llm_utils, "_provider_functions", lambda config: (complete, None, None))
+    return responses, calls
+
+@pytest.fixture(autouse=True)
+def rate_limiters(monkeypatch):
+    """Start every test with fresh per-model rate limiters."""
+    monkeypatch.setattr(rate_limiter, "_LIMITERS", {})
+
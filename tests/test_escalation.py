@@ -0,0 +1,46 @@
+import pytest
+
+from biomarkers import parse_biomarkers
+from escalation import evaluate_escalation, get_escalation_engine
+
+@pytest.mark.parametrize("name, rule_id", [
+    ("Creatinine", "creatinine_high"),
+    ("Creatinine, Serum", "creatinine_high"),
+    ("Serum Creatinine", "creatinine_high"),
+    ("eGFR", "egfr_low"),
+    ("eGFR CKD-EPI", "egfr_low"),
+    ("GFR, estimated", "egfr_low"),
+    ("Estimated GFR", "egfr_low"),
+    ("ALT", "alt_high"),
+    ("ALT (SGPT)", "alt_high"),
+    ("ALT/SGPT", "alt_high"),
+    ("SGPT/ALT", "alt_high"),
+    ("AST/SGOT", "ast_high"),
+    ("Hemoglobin", "hemoglobin_low"),
+    ("Hemoglobin, Whole Blood", "hemoglobin_low"),
+    ("Haemoglobin", "hemoglobin_low"),
+    ("HbA1c", "hba1c_high"),
+    ("Hemoglobin A1c", "hba1c_high"),
+    ("Glycated Haemoglobin", "hba1c_high"),
+    # Names that must not fall under a safety rule
+    ("Alkaline Phosphatase", None),
+    ("Creatine Kinase", None),
+    ("Urine Creatinine", None),
+    ("Creatinine, Urine", None),
+    ("Creatinine Clearance", None),
+    ("BUN/Creatinine Ratio", None),
+    ("AST/ALT Ratio", None),
+    ("Mean Corpuscular Hemoglobin", None),
+    ("Salt intake", None),
+])
+def test_rule_matching_name_variants(name, rule_id):
+    assert get_escalation_engine().match_rule(name) == rule_id
+
+def test_lab_spellings_escalate():
+    table = parse_biomarkers("Creatinine, Serum: 2.1 mg/dL\nALT/SGPT: 140 U/L\nAlkaline Phosphatase: 250 U/L")
+    result = evaluate_escalation(table)
+    assert result["triggered_rules"] == ["creatinine_high", "alt_high"]
+
+def test_excluded_names_do_not_escalate():
+    table = parse_biomarkers("Urine Creatinine: 120 mg/dL\nCreatine Kinase: 300 U/L")
+    assert evaluate_escalation(table)["escalation_needed"] is False
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+import llm_utils
+from hedging import HedgeBudget, hedged_race
+from llm_events import llm_request_scope
+from mock_provider import MockRateLimitError
+
+def race(outcomes, **kwargs):
+    """Run hedged_race over the models in outcomes, each returning or raising its outcome; returns (winner, result, started)."""
+    started = []
+
+    async def start(model):
+        started.append(model)
+        outcome = outcomes[model]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def run():
+        return await hedged_race(list(outcomes), start, delay=60, is_valid=lambda result: result != "invalid",
+                                 budget=HedgeBudget(), **kwargs)
+
+    winner, result = asyncio.run(run())
+    return winner, result, started
+
+def test_invalid_result_tries_queued_models():
+    winner, result, started = race({"a": "invalid", "b": "valid", "c": "unused"})
+    assert (winner, result) == ("b", "valid")
+    assert started == ["a", "b"]
+
+def test_invalid_result_returned_when_no_model_is_left():
+    winner, result, started = race({"a": "invalid", "b": "invalid"})
+    assert (winner, result) == ("a", "invalid")
+    assert started == ["a", "b"]
+
+def test_failure_that_should_not_fall_back_is_raised():
+    with pytest.raises(ValueError):
+        race({"a": ValueError("bad request"), "b": "valid"}, should_try_next=lambda error, model, attempt, total: False)
+
+def test_provider_rate_limit_is_recorded_before_falling_back():
+    outcomes = {"mock/replay": MockRateLimitError("429 Rate limit exceeded (mock). Please retry after 300 seconds."),
+                "mock/flaky": "valid"}
+
+    with llm_request_scope("mock/replay", "hedged") as request:
+        winner, result, started = race(outcomes, should_try_next=llm_utils._should_try_next_model,
+                                       fallback_reason=llm_utils._fallback_reason)
+
+    assert winner == "mock/flaky"
+    assert request["hops"] == [{"from_model": "mock/replay", "to_model": "mock/flaky", "reason": "rate_limit"}]
+    assert llm_utils._rate_limiter("mock/replay").blocked_for() == pytest.approx(300, abs=5)
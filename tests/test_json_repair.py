@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from json_repair import repair_json, was_truncated
+
+@pytest.mark.parametrize("content, expected", [
+    ('{"a": ["x", "y"]}', {"a": ["x", "y"]}),
+    ('```json\n{"a": ["x", "y"]}\n```', {"a": ["x", "y"]}),
+    ('Here you go:\n{"a": 1, "b": [1, 2,],}\nThanks!', {"a": 1, "b": [1, 2]}),
+    ('{"a": "say "hi" now", "b": 2}', {"a": 'say "hi" now', "b": 2}),
+    ('{"a": ["x", "y"', {"a": ["x", "y"]}),
+    ('{"a": "trunc', {"a": "trunc"}),
+    # Fenced, unbalanced JSON ends at the closing fence; the fence and prose after it are not data
+    ('```json\n{"a": ["x", "y"\n```\nHope this helps', {"a": ["x", "y"]}),
+    ('```json\n{"a": "abc\n```\nHope this helps', {"a": "abc"}),
+    ('Sure:\n```json\n{"a": {"b": 1}\n  ```\nLet me know if you need more.', {"a": {"b": 1}}),
+])
+def test_repair_json(content, expected):
+    value, _ = repair_json(content)
+    assert value == expected
+
+def test_fenced_unbalanced_json_reports_truncation_and_trailing_text():
+    _, repairs = repair_json('```json\n{"a": ["x", "y"\n```\nHope this helps')
+    assert was_truncated(repairs)
+    assert repairs["markdown_fence"] == 1
+    assert repairs["trailing_text"] == 1
+
+@pytest.mark.parametrize("content", [
+    "[" * 100000,
+    '{"a": ' + "[" * 100000 + "1,",
+])
+def test_deeply_nested_input_raises_decode_error(content):
+    with pytest.raises(json.JSONDecodeError):
+        repair_json(content)
+
+def test_no_json_raises_decode_error():
+    with pytest.raises(json.JSONDecodeError):
+        repair_json("I could not generate a report.")
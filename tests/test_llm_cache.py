@@ -0,0 +1,40 @@
+import pytest
+
+import llm_utils
+from conftest import REPORT, completion
+from llm_events import annotate_call, llm_call_scope
+
+def ask(model_name="mock/replay"):
+    return llm_utils.call_llm(model_name, [{"role": "user", "content": "Summarize my labs"}], save_result=False)
+
+def test_complete_response_is_cached(cache, provider):
+    responses, calls = provider
+    responses.append(completion(REPORT))
+
+    assert ask()["overall_health_summary"] == "Your results look good."
+    assert ask()["overall_health_summary"] == "Your results look good."
+    assert len(calls) == 1
+    assert cache.stats()["entries"] == 1
+
+def test_truncated_response_is_not_cached(cache, provider):
+    responses, calls = provider
+    responses.append(completion(REPORT, finish_reason="length"))
+    responses.append(completion(REPORT))
+
+    ask()
+    assert cache.stats()["entries"] == 0
+    ask()
+    assert len(calls) == 2
+    assert cache.stats()["entries"] == 1
+
+@pytest.mark.parametrize("annotation", [
+    {"repairs": {"unclosed_object": 1}},
+    {"repair_strategy": "json_fragment"},
+    {"repair_strategy": "enhanced_fallback"},
+    {"repair_strategy": "minimal_fallback"},
+])
+def test_repaired_response_is_not_cached(cache, annotation):
+    with llm_call_scope("gemini/gemini-2.0-flash", "gemini"):
+        annotate_call(**annotation)
+        llm_utils._cache_store("key", "gemini/gemini-2.0-flash", completion(REPORT), {})
+    assert cache.stats()["entries"] == 0
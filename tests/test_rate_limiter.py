@@ -0,0 +1,16 @@
+import pytest
+
+import llm_utils
+from conftest import REPORT, completion
+from mock_provider import MockRateLimitError
+
+def test_provider_retry_after_hint_blocks_model(cache, provider):
+    responses, calls = provider
+    responses.append(MockRateLimitError("429 Rate limit exceeded (mock). Please retry after 300 seconds."))
+    responses.append(completion(REPORT))
+
+    result = llm_utils.call_llm_with_fallback("mock/flaky", [{"role": "user", "content": "Summarize my labs"}], save_result=False)
+
+    assert result["overall_health_summary"] == "Your results look good."
+    assert [call["model"] for call in calls][0].endswith("flaky")
+    assert llm_utils._rate_limiter("mock/flaky").blocked_for() == pytest.approx(300, abs=5)
@@ -0,0 +1,41 @@
+import json
+
+import llm_utils
+from mock_provider import MockServerError, stream_chunk_builder
+from report_jobs import Job
+
+def chunk(text):
+    return {"choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+
+def test_failed_over_stream_resets_job_items(cache, monkeypatch):
+    report = json.dumps({"biomarker_insights": [{"biomarker_name": "Ferritin"}, {"biomarker_name": "Vitamin D"}]})
+    calls = []
+
+    def complete(**params):
+        calls.append(params["model"])
+        if len(calls) == 1:
+            yield chunk('{"biomarker_insights": [{"biomarker_name": "Glucose"}, {"biomarker_name": "Ins')
+            raise MockServerError("500 Internal server error (mock)")
+        for start in range(0, len(report), 16):
+            yield chunk(report[start:start + 16])
+
+    monkeypatch.setattr(llm_utils, "_provider_functions", lambda config: (complete, None, stream_chunk_builder))
+    job = Job("report", {})
+
+    result = llm_utils.call_llm_stream_with_fallback("mock/replay", [{"role": "user", "content": "Summarize my labs"}],
+                                                     on_item=job.add_item, save_result=False, on_reset=job.reset_items)
+
+    assert len(calls) == 2
+    assert result["biomarker_insights"][0]["biomarker_name"] == "Ferritin"
+    assert job.item_resets == 1
+    assert [item["biomarker_name"] for _, item in job.items_since(0)] == ["Ferritin", "Vitamin D"]
+
+def test_item_updates_restart_after_reset():
+    job = Job("report", {})
+    job.add_item("biomarker_insights[]", {"biomarker_name": "Glucose"})
+    assert job.item_updates(0, 0) == (0, [("biomarker_insights[]", {"biomarker_name": "Glucose"})])
+
+    job.reset_items()
+    job.add_item("biomarker_insights[]", {"biomarker_name": "Ferritin"})
+    assert job.item_updates(1, 0) == (1, [("biomarker_insights[]", {"biomarker_name": "Ferritin"})])
+    assert job.item_updates(1, 1) == (1, [])
@@ -0,0 +1,149 @@
+import functools
+import logging
+import math
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Tokenizer used for counting. o200k_base is exact for the o-series models and a
+# close approximation for Gemini, which has no local tokenizer.
+TOKENIZER_ENCODING = "o200k_base"
+
+# Characters per token when tiktoken is not installed (slightly pessimistic for English prose)
+FALLBACK_CHARS_PER_TOKEN = 3.5
+
+# Output size model, calibrated on the reports in llm_results/ (o1/o3/o4-mini/Gemini):
+# each biomarker insight is ~800-1000 characters of JSON, each category insight
+# ~1000-1850 and everything else (summary, action plan, timeline) ~15-24 KB.
+OUTPUT_TOKENS_BASE = 6500
+OUTPUT_TOKENS_PER_BIOMARKER = 270
+OUTPUT_TOKENS_PER_CATEGORY = 520
+OUTPUT_SAFETY_MARGIN = 1.15
+
+# Share of OUTPUT_TOKENS_BASE produced by the overview and action plan sections of a sectioned report
+SECTION_BASE_SHARE = {"overview": 0.45, "action_plan": 0.55}
+
+_HEADING = re.compile(r'^# .*$', re.MULTILINE)
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    # tiktoken is optional (counts fall back to a character-based estimate) and imported on first count
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:  # e.g. the encoding file cannot be downloaded
+        logger.warning("⚠️ tiktoken unavailable (%s), estimating tokens from characters", e)
+        return None
+
+@functools.lru_cache(maxsize=256)
+def count_tokens(text: str) -> int:
+    """Token count of text (exact with tiktoken, estimated from characters otherwise); cached for repeated static text."""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return math.ceil(len(text) / FALLBACK_CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def count_message_tokens(messages: Sequence[Dict[str, Any]]) -> int:
+    """Prompt tokens for a chat message list, including ~4 tokens of per-message framing."""
+    return sum(count_tokens(message.get("content") or "") + 4 for message in messages if isinstance(message, dict)) + 2
+
+def section_token_counts(text: str) -> List[Dict[str, Any]]:
+    """Tokens per "# " section of a prompt, in order (text before the first heading is reported as "(preamble)")."""
+    starts = [match.start() for match in _HEADING.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts = [0] + starts
+    sections = []
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        body = text[start:end]
+        heading = body.split('\n', 1)[0].lstrip('# ').strip() if body.startswith('# ') else "(preamble)"
+        sections.append({"section": heading, "characters": len(body), "tokens": count_tokens(body)})
+    return sections
+
+def predict_output_tokens(biomarker_count: int, category_count: int) -> int:
+    """Predicted completion tokens for a full report."""
+    raw = OUTPUT_TOKENS_BASE + OUTPUT_TOKENS_PER_BIOMARKER * biomarker_count + OUTPUT_TOKENS_PER_CATEGORY * category_count
+    return int(raw * OUTPUT_SAFETY_MARGIN)
+
+def predict_section_output_tokens(section: str, item_count: int = 0) -> int:
+    """Predicted completion tokens for one section call of a sectioned report."""
+    if section == "biomarkers":
+        raw = OUTPUT_TOKENS_PER_BIOMARKER * item_count
+    elif section == "categories":
+        raw = OUTPUT_TOKENS_PER_CATEGORY * item_count
+    else:
+        raw = OUTPUT_TOKENS_BASE * SECTION_BASE_SHARE.get(section, 1.0)
+    return int(raw * OUTPUT_SAFETY_MARGIN)
+
+def output_budget(limits: Dict[str, Any]) -> Optional[int]:
+    """Completion tokens usable for the answer: max_output_tokens minus the reasoning reserve (None if unlimited)."""
+    max_output = limits.get("max_output_tokens")
+    if not max_output:
+        return None
+    return max(0, max_output - (limits.get("reasoning_reserve") or 0))
+
+def max_biomarker_chunk_size(limits: Dict[str, Any], default_chunk_size: int) -> int:
+    """Largest biomarker chunk (at most default_chunk_size) whose insights fit the model's output budget."""
+    budget = output_budget(limits)
+    if budget is None:
+        return default_chunk_size
+    per_item = OUTPUT_TOKENS_PER_BIOMARKER * OUTPUT_SAFETY_MARGIN
+    return max(1, min(default_chunk_size, int(budget // per_item)))
+
+def plan_request(model_name: str, messages: Sequence[Dict[str, Any]], biomarker_count: int, category_count: int,
+                 model_limits: Dict[str, Dict[str, Any]], default_chunk_size: int = 12,
+                 overhead_tokens: int = 0) -> Dict[str, Any]:
+    """
+    Plan how to dispatch a report request before calling any model.
+
+    Counts the prompt tokens (overhead_tokens covers text added at dispatch,
+    e.g. the schema instruction), predicts the report size from the biomarker
+    and category counts and checks them against model_limits[model]
+    ("context_window", "max_output_tokens", "reasoning_reserve").
+
+    Returns the counts and a recommendation: "single" if the full report fits
+    model_name in one call, otherwise "sectioned" with a biomarker chunk
+    size that keeps every section within the output budget, plus the other
+    models that could take the report in a single call.
+    """
+    prompt_tokens = count_message_tokens(messages) + overhead_tokens
+    output_tokens = predict_output_tokens(biomarker_count, category_count)
+
+    def fits_single(limits):
+        budget = output_budget(limits)
+        context = limits.get("context_window")
+        return ((budget is None or output_tokens <= budget)
+                and (not context or prompt_tokens + output_tokens + (limits.get("reasoning_reserve") or 0) <= context))
+
+    limits = model_limits.get(model_name, {})
+    plan = {
+        "model": model_name,
+        "prompt_tokens": prompt_tokens,
+        "predicted_output_tokens": output_tokens,
+        "output_budget": output_budget(limits),
+        "context_window": limits.get("context_window"),
+        "fits": fits_single(limits),
+        "alternative_models": [m for m, l in model_limits.items() if m != model_name and fits_single(l)],
+    }
+    if plan["fits"]:
+        plan["strategy"] = "single"
+        plan["chunk_size"] = None
+        return plan
+
+    chunk_size = max_biomarker_chunk_size(limits, default_chunk_size)
+    budget = output_budget(limits)
+    largest_section = max(
+        predict_section_output_tokens("biomarkers", min(chunk_size, biomarker_count)),
+        predict_section_output_tokens("categories", category_count),
+        predict_section_output_tokens("overview"),
+        predict_section_output_tokens("action_plan"),
+    )
+    plan["strategy"] = "sectioned"
+    plan["chunk_size"] = chunk_size
+    plan["sections_fit"] = budget is None or largest_section <= budget
+    return plan
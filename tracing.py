@@ -0,0 +1,211 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Where finished traces are written
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+SERVICE_NAME = "health-vizor"
+
+class Span:
+    """One timed stage. Times are time.time_ns() nanoseconds; end_ns is None while the span is open."""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "lane", "error", "_token")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.lane = trace.lane()
+        self.error = None
+        self._token = None
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return None if self.end_ns is None else (self.end_ns - self.start_ns) / 1e6
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        """Close the span (idempotent) and restore its parent as the current span."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {str(error)[:200]}"
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                _current_span.set(None)  # ended from another context; just detach
+            self._token = None
+
+class Trace:
+    """Spans of one traced operation (e.g. one Generate click), exportable as Chrome trace or OTLP-JSON."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+        self.root = None
+        self._lanes = {}
+        self._lock = threading.Lock()
+        self._token = None
+
+    def lane(self) -> int:
+        """Small integer per thread / asyncio task, so concurrent spans get separate rows in the Chrome viewer."""
+        try:
+            key = id(asyncio.current_task())
+        except RuntimeError:
+            key = None
+        key = key or threading.get_ident()
+        with self._lock:
+            return self._lanes.setdefault(key, len(self._lanes) + 1)
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self) -> None:
+        """End the root span and any span left open, and deactivate the trace."""
+        if self.root is not None:
+            self.root.end()
+        for span in self.spans:
+            span.end()
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                _current_span.set(None)
+            self._token = None
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Spans in tree order (children in start order after their parent) with depth and duration in milliseconds."""
+        children = {}
+        for span in sorted(self.spans, key=lambda s: s.start_ns):
+            children.setdefault(span.parent_id, []).append(span)
+        rows = []
+
+        def visit(parent_id, depth):
+            for span in children.get(parent_id, []):
+                rows.append({"stage": span.name, "depth": depth, "duration_ms": span.duration_ms, "error": span.error})
+                visit(span.span_id, depth + 1)
+
+        visit(None, 0)
+        return rows
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """Chrome trace event format (chrome://tracing, Perfetto, speedscope)."""
+        start = min((span.start_ns for span in self.spans), default=0)
+        events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": lane, "args": {"name": f"lane {lane}"}}
+                  for lane in sorted(self._lanes.values())]
+        for span in self.spans:
+            end_ns = span.end_ns if span.end_ns is not None else time.time_ns()
+            args = dict(span.attributes)
+            if span.error:
+                args["error"] = span.error
+            events.append({
+                "name": span.name,
+                "cat": self.name,
+                "ph": "X",
+                "ts": (span.start_ns - start) / 1000,
+                "dur": (end_ns - span.start_ns) / 1000,
+                "pid": 1,
+                "tid": span.lane,
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace_id": self.trace_id, "name": self.name}}
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """OTLP-JSON (the body of an OTLP/HTTP traces export), loadable by Jaeger / OpenTelemetry tooling."""
+        spans = []
+        for span in self.spans:
+            otlp_span = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns if span.end_ns is not None else time.time_ns()),
+                "attributes": [_otlp_attribute(key, value) for key, value in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            spans.append(otlp_span)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]}
+
+    def write(self, directory: str = TRACE_DIR) -> Dict[str, str]:
+        """Write the trace as <timestamp>_<name>.trace.json (Chrome) and .otlp.json; returns both paths."""
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(directory, f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{self.name}")
+        paths = {"chrome": f"{stem}.trace.json", "otlp": f"{stem}.otlp.json"}
+        with open(paths["chrome"], 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome(), f, default=str)
+        with open(paths["otlp"], 'w', encoding='utf-8') as f:
+            json.dump(self.to_otlp(), f, default=str)
+        return paths
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        wrapped = {"boolValue": value}
+    elif isinstance(value, int):
+        wrapped = {"intValue": str(value)}
+    elif isinstance(value, float):
+        wrapped = {"doubleValue": value}
+    else:
+        wrapped = {"stringValue": str(value)}
+    return {"key": key, "value": wrapped}
+
+_current_span = contextvars.ContextVar("trace_current_span", default=None)
+
+def start_trace(name: str, **attributes: Any) -> Trace:
+    """Start a trace with a root span and make it current; call finish() on it when the operation is done."""
+    trace = Trace(name)
+    root = Span(trace, name, None, attributes)
+    trace.root = root
+    trace.add(root)
+    trace._token = _current_span.set(root)
+    return trace
+
+def start_span(name: str, **attributes: Any) -> Optional[Span]:
+    """Open a child of the current span and make it current (None when no trace is active); close it with end()."""
+    parent = _current_span.get()
+    if parent is None or parent.trace.root.end_ns is not None:
+        return None
+    span = Span(parent.trace, name, parent.span_id, attributes)
+    parent.trace.add(span)
+    span._token = _current_span.set(span)
+    return span
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any):
+    """Time a block as a child span of the current span; a no-op (yields None) outside a trace."""
+    current = start_span(name, **attributes)
+    if current is None:
+        yield None
+        return
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    else:
+        current.end()
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()